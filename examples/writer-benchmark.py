@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Measure how quickly notes are added to a MIDIFile by several workers:
+# threads adding through concurrent writers, and processes building track
+# payloads which are then added to the file.
+#
+#     python writer-benchmark.py [notes] [workers ...]
+
+from __future__ import division, print_function
+
+import multiprocessing
+import sys
+import threading
+import time
+
+from midiutil import MIDIFile
+
+notes = int(sys.argv[1]) if len(sys.argv) > 1 else 400000
+counts = [int(arg) for arg in sys.argv[2:]] or [1, 2, 4, 8]
+
+
+def render(target, track, part, count):
+    for i in range(count):
+        target.addNote(track, part % 16, 40 + (i * 7) % 50, i * 0.25, 1, 100)
+
+
+def renderPayload(args):
+    part, count = args
+    worker = MIDIFile(1)
+    render(worker, 0, part, count)
+    return worker.trackPayload(0)
+
+
+def threaded(workers):
+    MyMIDI = MIDIFile(workers)
+    writers = [MyMIDI.concurrentWriter() for part in range(workers)]
+    threads = [threading.Thread(target=render,
+                                args=(writer, part, part, notes // workers))
+               for part, writer in enumerate(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    MyMIDI.mergeWriters()
+
+
+def processes(workers):
+    MyMIDI = MIDIFile(workers)
+    pool = multiprocessing.Pool(workers)
+    try:
+        payloads = pool.map(renderPayload, [(part, notes // workers)
+                                            for part in range(workers)])
+    finally:
+        pool.close()
+        pool.join()
+    for track, payload in enumerate(payloads):
+        MyMIDI.addTrackPayload(track, payload)
+
+
+if __name__ == '__main__':
+    print("%d notes, %d CPUs" % (notes, multiprocessing.cpu_count()))
+    for name, build in (('threads', threaded), ('processes', processes)):
+        for workers in counts:
+            start = time.time()
+            build(workers)
+            elapsed = time.time() - start
+            print("%-9s %2d: %8.0f notes/s" % (name, workers, notes / elapsed))
@@ -11,9 +11,34 @@
 # -----------------------------------------------------------------------------
 
 from __future__ import division, print_function
+import array
+import binascii
+import bisect
+import copy
+import hashlib
+import heapq
+import io
+import json
 import math
+import mmap
+import numbers
+import operator
+import os
+import random
+import re
 import struct
+import sys
+import tempfile
+import threading
 import warnings
+import wave
+from collections import deque
+
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2: no memoization
+    def lru_cache(maxsize=128):
+        return lambda function: function
 
 __version__ = 'HEAD'
 
@@ -31,7 +56,7 @@ MINOR = 1
 SHARPS = 1
 FLATS = -1
 
-__all__ = ['MIDIFile', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
+__all__ = ['MIDIFile', 'MIDIPattern', 'ChannelAllocator', 'RenderCache', 'InvalidValuesError', 'mergeMIDIFiles', 'readColumns', 'readScalaTuning', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
 
 
 class GenericEvent(object):
@@ -40,6 +65,9 @@ class GenericEvent(object):
     '''
     evtname = None
     sec_sort_order = 0
+    # The integer attributes stored in the columns of a packed event list
+    # (see packEvents); None if the event is stored whole.
+    columns = None
 
     def __init__(self, tick, insertion_order):
         self.tick = tick
@@ -59,6 +87,18 @@ class GenericEvent(object):
         '''
         return (self.evtname == other.evtname and self.tick == other.tick)
 
+    def __copy__(self):
+        '''
+        Return a shallow copy of the event.
+
+        Copies are made whenever an event's time is changed (events may be
+        shared by forked tracks), so this is quite a bit faster than the
+        generic mechanism of the ``copy`` module.
+        '''
+        event = self.__class__.__new__(self.__class__)
+        event.__dict__.update(self.__dict__)
+        return event
+
     def __hash__(self):
         '''
         Return a hash code for the object.
@@ -89,6 +129,7 @@ class NoteOn(GenericEvent):
     evtname = 'NoteOn'
     midi_status = 0x90    # 0x9x is Note On
     sec_sort_order = 3
+    columns = ('channel', 'pitch', 'volume', 'duration')
 
     def __init__(self, channel, pitch, tick, duration, volume,
                  annotation=None, insertion_order=0):
@@ -133,6 +174,7 @@ class NoteOff (GenericEvent):
     evtname = 'NoteOff'
     midi_status = 0x80  # 0x8x is Note Off
     sec_sort_order = 2  # must be less than that of NoteOn
+    columns = ('channel', 'pitch', 'volume')
     # If two events happen at the same time, the secondary sort key is
     # ``sec_sort_order``. Thus a class of events can be processed earlier than
     # another. One place this is used in the code is to make sure that note
@@ -177,6 +219,7 @@ class Tempo(GenericEvent):
     '''
     evtname = 'Tempo'
     sec_sort_order = 3
+    columns = ('tempo',)
 
     def __init__(self, tick, tempo, insertion_order=0):
         self.tempo = int(60000000 / tempo)
@@ -304,6 +347,7 @@ class KeySignature(GenericEvent):
     '''
     evtname = 'KeySignature'
     sec_sort_order = 1
+    columns = ('accidentals', 'accidental_type', 'mode')
 
     def __init__(self, tick, accidentals, accidental_type, mode,
                  insertion_order=0):
@@ -338,6 +382,7 @@ class ProgramChange(GenericEvent):
     evtname = 'ProgramChange'
     midi_status = 0xc0   # 0xcx is Program Change
     sec_sort_order = 1
+    columns = ('channel', 'programNumber')
 
     def __init__(self, channel, tick, programNumber,
                  insertion_order=0):
@@ -359,7 +404,7 @@ class ProgramChange(GenericEvent):
         """
         midibytes = b""
         code = self.midi_status | self.channel
-        varTime = writeVarLength(self.tick)
+        varTime = writeVarLength(self.tick - previous_event_tick)
         for timeByte in varTime:
             midibytes += struct.pack('>B', timeByte)
         midibytes += struct.pack('>B', code)
@@ -462,6 +507,7 @@ class ControllerEvent(GenericEvent):
     evtname = 'ControllerEvent'
     midi_status = 0xB0  # 0xBx is Control Change
     sec_sort_order = 1
+    columns = ('channel', 'controller_number', 'parameter')
 
     def __init__(self, channel, tick, controller_number, parameter,
                  insertion_order=0):
@@ -497,6 +543,7 @@ class ChannelPressureEvent(GenericEvent):
     evtname = 'ChannelPressure'
     midi_status = 0xD0  # 0xDx is Channel Pressure (Aftertouch)
     sec_sort_order = 1
+    columns = ('channel', 'pressure_value')
 
     def __init__(self, channel, tick, pressure_value, insertion_order=0):
         self.channel = channel
@@ -532,6 +579,7 @@ class PitchWheelEvent(GenericEvent):
     evtname = 'PitchWheelEvent'
     midi_status = 0xE0  # 0xEx is Pitch Wheel Change
     sec_sort_order = 1
+    columns = ('channel', 'pitch_wheel_value')
 
     def __init__(self, channel, tick, pitch_wheel_value, insertion_order=0):
         self.channel = channel
@@ -603,6 +651,7 @@ class TimeSignature(GenericEvent):
     '''
     evtname = 'TimeSignature'
     sec_sort_order = 0
+    columns = ('numerator', 'denominator', 'clocks_per_tick', 'notes_per_quarter')
 
     def __init__(self, tick, numerator, denominator, clocks_per_tick,
                  notes_per_quarter, insertion_order=0):
@@ -633,12 +682,255 @@ class TimeSignature(GenericEvent):
         return midibytes
 
 
+class PatternEvent(GenericEvent):
+    '''
+    A class that encapsulates the placement of a :class:`MIDIPattern` on a
+    track.
+
+    The event sorts as the first event of the pattern would, and spans the
+    ticks up to the last event of the pattern. If nothing else in the track
+    falls within that span the pre-serialized pattern data are copied into the
+    stream; otherwise the placement is expanded into its individual events
+    when the track is closed.
+    '''
+    evtname = 'Pattern'
+
+    def __init__(self, tick, pattern, insertion_order=0):
+        self.pattern = pattern
+        self.span = pattern.span
+        self.sec_sort_order = pattern.events[0].sec_sort_order
+        super(PatternEvent, self).__init__(tick + pattern.offset,
+                                           insertion_order)
+
+    def __eq__(self, other):
+        return False
+
+    __hash__ = GenericEvent.__hash__
+
+    def lastKey(self):
+        '''
+        Return the sort key of the last event in the placement.
+        '''
+        return (self.tick + self.span, self.pattern.events[-1].sec_sort_order,
+                self.insertion_order + len(self.pattern.events) - 1)
+
+    def expand(self):
+        '''
+        Return copies of the pattern's events, placed at this event's time.
+        '''
+        events = []
+        for i, event in enumerate(self.pattern.events):
+            event = copy.copy(event)
+            event.tick += self.tick
+            event.insertion_order = self.insertion_order + i
+            events.append(event)
+        return events
+
+    def serialize(self, previous_event_tick):
+        """Return a bytestring representation of the event, in the format required for
+        writing into a standard midi file.
+
+        Only the delta time of the first event is written; the rest of the
+        data comes from the pattern's cache.
+        """
+        varTime = writeVarLength(self.tick - previous_event_tick)
+        return bytes(bytearray(varTime)) + self.pattern.body
+
+
+class NoteIndex(object):
+    '''
+    An index of notes (:class:`NoteOn` events) by the ticks during which they
+    sound, for the note queries of :class:`MIDITrack`.
+
+    The notes are kept sorted by start tick in blocks of a few hundred, each
+    of which records the latest end tick of its notes. A query skips the
+    blocks which start after the region or end before it, so a note is only
+    examined if it is in a block which might overlap the region. Adding a
+    note costs a bisection and an insertion into one block.
+    '''
+    blockSize = 256
+
+    def __init__(self, notes=()):
+        '''
+        Initialize the index, with a list of notes if given. Building the
+        index from a list is quicker than adding the notes one by one.
+        '''
+        entries = sorted((note.tick, i, note.tick + note.duration, note)
+                         for i, note in enumerate(notes))
+        # lists of (start, sequence, end, note), sorted
+        self.blocks = [entries[i:i + self.blockSize]
+                       for i in range(0, len(entries), self.blockSize)]
+        # (start, sequence) of the first note of each block
+        self.firsts = [block[0][:2] for block in self.blocks]
+        # the latest end of the notes of each block
+        self.ends = [max(entry[2] for entry in block) for block in self.blocks]
+        # keeps notes with the same start in the order they were added
+        self.sequence = len(entries)
+
+    def __len__(self):
+        return sum(len(block) for block in self.blocks)
+
+    def add(self, note):
+        '''
+        Add a note to the index.
+        '''
+        entry = (note.tick, self.sequence, note.tick + note.duration, note)
+        self.sequence += 1
+        if not self.blocks:
+            self.blocks.append([entry])
+            self.firsts.append(entry[:2])
+            self.ends.append(entry[2])
+            return
+        i = max(bisect.bisect_right(self.firsts, entry[:2]) - 1, 0)
+        block = self.blocks[i]
+        bisect.insort(block, entry)
+        self.firsts[i] = block[0][:2]
+        self.ends[i] = max(self.ends[i], entry[2])
+        if len(block) > 2 * self.blockSize:
+            rest = block[self.blockSize:]
+            del block[self.blockSize:]
+            self.blocks.insert(i + 1, rest)
+            self.firsts.insert(i + 1, rest[0][:2])
+            self.ends.insert(i + 1, max(entry[2] for entry in rest))
+            self.ends[i] = max(entry[2] for entry in block)
+
+    def overlapping(self, start, end):
+        '''
+        Return the notes which sound at some tick from start up to (but not
+        including) end, in the order of their start ticks.
+        '''
+        notes = []
+        for i, block in enumerate(self.blocks):
+            if self.firsts[i][0] >= end:
+                break
+            if self.ends[i] <= start:
+                continue
+            for entry in block:
+                if entry[0] >= end:
+                    break
+                if entry[2] > start:
+                    notes.append(entry[3])
+        return notes
+
+    def remove(self, start, end):
+        '''
+        Remove the notes which start at a tick from start up to (but not
+        including) end, and return them.
+        '''
+        notes = []
+        i = max(bisect.bisect_left(self.firsts, (start,)) - 1, 0)
+        while i < len(self.blocks) and self.firsts[i][0] < end:
+            block = self.blocks[i]
+            low = bisect.bisect_left(block, (start,))
+            high = bisect.bisect_left(block, (end,))
+            if low == high:
+                i += 1
+                continue
+            notes.extend(entry[3] for entry in block[low:high])
+            del block[low:high]
+            if not block:
+                del self.blocks[i]
+                del self.firsts[i]
+                del self.ends[i]
+                continue
+            self.firsts[i] = block[0][:2]
+            self.ends[i] = max(entry[2] for entry in block)
+            i += 1
+        return notes
+
+    def starting(self, start, end):
+        '''
+        Return the notes which start at a tick from start up to (but not
+        including) end, in the order of their start ticks.
+        '''
+        notes = []
+        i = max(bisect.bisect_left(self.firsts, (start,)) - 1, 0)
+        while i < len(self.blocks) and self.firsts[i][0] < end:
+            block = self.blocks[i]
+            low = bisect.bisect_left(block, (start,))
+            high = bisect.bisect_left(block, (end,))
+            notes.extend(entry[3] for entry in block[low:high])
+            i += 1
+        return notes
+
+
+def stateKey(event):
+    '''
+    Return the key of the state set by an event (the tempo, say, or the
+    value of one controller on one channel), or None if the event sets no
+    state that lasts until the next event of its kind.
+    '''
+    name = event.evtname
+    if name in ('Tempo', 'TimeSignature', 'KeySignature', 'TrackName'):
+        return (name,)
+    if name in ('ProgramChange', 'PitchWheelEvent', 'ChannelPressure'):
+        return (name, event.channel)
+    if name == 'ControllerEvent':
+        return (name, event.channel, event.controller_number)
+    return None
+
+
+class TimeIndex(object):
+    '''
+    An index of the events of a track by time, for :meth:`MIDITrack.slice`.
+
+    Patterns are expanded into their events. The notes are held in a
+    :class:`NoteIndex`; the other events (apart from note offs, which are
+    made again from the notes) are sorted, and those which set a state are
+    also listed by the state they set, so that the state in effect at any
+    tick can be found by bisection.
+    '''
+
+    def __init__(self, events):
+        expanded = []
+        for event in events:
+            if event.evtname == 'Pattern':
+                expanded.extend(event.expand())
+            else:
+                expanded.append(event)
+        self.notes = NoteIndex([event for event in expanded
+                                if event.evtname == 'NoteOn'])
+        self.events = sorted([event for event in expanded
+                              if event.evtname not in ('NoteOn', 'NoteOff')],
+                             key=sort_events)
+        self.ticks = [event.tick for event in self.events]
+        self.states = {}  # state key -> ([tick], [event]), sorted
+        for event in self.events:
+            key = stateKey(event)
+            if key is not None:
+                ticks, events = self.states.setdefault(key, ([], []))
+                ticks.append(event.tick)
+                events.append(event)
+
+    def stateAt(self, tick):
+        '''
+        Return the events which set the states in effect at a tick, for the
+        states which are not set again at that tick, in the order in which
+        they sort.
+        '''
+        carried = []
+        for ticks, events in self.states.values():
+            i = bisect.bisect_left(ticks, tick)
+            if i > 0 and (i == len(ticks) or ticks[i] != tick):
+                carried.append(events[i - 1])
+        carried.sort(key=sort_events)
+        return carried
+
+    def between(self, start, end):
+        '''
+        Return the events (other than notes) at a tick from start up to (but
+        not including) end.
+        '''
+        return self.events[bisect.bisect_left(self.ticks, start):
+                           bisect.bisect_left(self.ticks, end)]
+
+
 class MIDITrack(object):
     '''
     A class that encapsulates a MIDI track
     '''
 
-    def __init__(self, removeDuplicates, deinterleave):
+    def __init__(self, removeDuplicates, deinterleave, removeRedundant=False):
         '''Initialize the MIDITrack object.
         '''
         self.headerString = struct.pack('cccc', b'M', b'T', b'r', b'k')
@@ -649,12 +941,371 @@ class MIDITrack(object):
         self.MIDIEventList = []
         self.remdep = removeDuplicates
         self.deinterleave = deinterleave
+        self.remove_redundant = removeRedundant
+        self.redundantCounts = {}  # evtname -> number of events removed
+        self.expand_patterns = False  # write every pattern event by event
+        self.shared = False  # eventList is shared with a forked track
+        # (eventList, number of events hashed, last event hashed, hashers)
+        self.fingerprintState = None
+        # (eventList, number of events indexed, last event indexed, index)
+        self.noteIndexState = None
+        # (eventList, number of events indexed, last event indexed, index)
+        self.timeIndexState = None
+        self.transforms = ()  # applied on close, see applyTransforms
+
+    def __getstate__(self):
+        '''
+        Return the state of the track for pickling, with the event lists
+        packed into columns (see :func:`eventState`), which is smaller and
+        quicker to write and to load than the pickled event objects.
+        '''
+        state = self.__dict__.copy()
+        state['eventList'] = eventState(self.eventList)
+        state['MIDIEventList'] = eventState(self.MIDIEventList)
+        state['MIDIdata'] = bytes(bytearray(self.MIDIdata))
+        state['shared'] = False
+        state['fingerprintState'] = None
+        state['noteIndexState'] = None
+        state['timeIndexState'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.eventList = eventsFromState(state['eventList'])
+        self.MIDIEventList = eventsFromState(state['MIDIEventList'])
+
+    def __copy__(self):
+        # A shallow copy shares the event lists (see fork), so it must not
+        # go through the pickling state.
+        track = self.__class__.__new__(self.__class__)
+        track.__dict__.update(self.__dict__)
+        return track
+
+    def fingerprint(self):
+        '''
+        Return a digest (a hex string) of everything that determines the
+        data the track writes: its events and its processing options.
+
+        The digest is computed incrementally. Only the events added since
+        the last call are hashed, unless the event list has been replaced or
+        shortened in the meantime (closing the track does that, for
+        instance), in which case it is hashed again from the start.
+        '''
+        events = self.eventList
+        state = self.fingerprintState
+        if (state is None or state[0] is not events or state[1] > len(events) or
+                (state[1] > 0 and events[state[1] - 1] is not state[2])):
+            count = 0
+            hashers = [hashlib.sha1() for i in range(8)]
+        else:
+            count = state[1]
+            # The hashers may be shared with a fork, so they are not updated
+            # in place.
+            hashers = [hasher.copy() for hasher in state[3]]
+        if count < len(events):
+            updateFingerprint(hashers, events[count:], count)
+        self.fingerprintState = (events, len(events),
+                                 events[-1] if events else None, hashers)
+
+        digest = hashlib.sha1(repr((self.remdep, self.deinterleave,
+                                    self.remove_redundant,
+                                    self.expand_patterns,
+                                    transformKey(self.transforms))).encode('utf-8'))
+        for hasher in hashers:
+            digest.update(hasher.digest())
+        return digest.hexdigest()
+
+    def noteIndex(self):
+        '''
+        Return the :class:`NoteIndex` of the notes in the event list.
+
+        The index is built by the first query, and brought up to date by
+        each query after it: the notes added since the last query are added
+        to the index, unless the event list has been replaced or shortened
+        in the meantime (closing the track does that, for instance), in
+        which case the index is built again. Notes placed by patterns are
+        not indexed.
+        '''
+        events = self.eventList
+        state = self.noteIndexState
+        if (state is None or state[0] is not events or state[1] > len(events) or
+                (state[1] > 0 and events[state[1] - 1] is not state[2])):
+            index = NoteIndex([event for event in events
+                               if event.evtname == 'NoteOn'])
+        else:
+            index = state[3]
+            for event in events[state[1]:]:
+                if event.evtname == 'NoteOn':
+                    index.add(event)
+        self.noteIndexState = (events, len(events),
+                               events[-1] if events else None, index)
+        return index
+
+    def notesAt(self, tick):
+        '''
+        Return the notes (:class:`NoteOn` events) sounding at a tick.
+        '''
+        return self.noteIndex().overlapping(tick, tick + 1)
+
+    def notesOverlapping(self, start, end):
+        '''
+        Return the notes (:class:`NoteOn` events) sounding at some tick from
+        start up to (but not including) end.
+        '''
+        return self.noteIndex().overlapping(start, end)
+
+    def removeNotes(self, start, end):
+        '''
+        Remove the notes which start at a tick from start up to (but not
+        including) end, with their :class:`NoteOff` events, and return the
+        removed :class:`NoteOn` events.
+        '''
+        self.unshare()
+        notes = self.noteIndex().remove(start, end)
+        if not notes:
+            return notes
+        removed = set(id(note) for note in notes)
+        offs = {}
+        for note in notes:
+            key = (note.channel, note.pitch, note.tick + note.duration,
+                   note.insertion_order)
+            offs[key] = offs.get(key, 0) + 1
+        events = []
+        for event in self.eventList:
+            if event.evtname == 'NoteOn':
+                if id(event) in removed:
+                    continue
+            elif event.evtname == 'NoteOff':
+                key = (event.channel, event.pitch, event.tick,
+                       event.insertion_order)
+                if offs.get(key):
+                    offs[key] -= 1
+                    continue
+            events.append(event)
+        self.eventList = events
+        self.noteIndexState = (events, len(events),
+                               events[-1] if events else None,
+                               self.noteIndexState[3])
+        return notes
+
+    def playedEvents(self):
+        '''
+        Return the events of the track as they will be written: with the
+        patterns expanded and the transforms (see :meth:`MIDIFile.transpose`)
+        applied, but not yet sorted.
+        '''
+        events = []
+        for event in self.eventList:
+            if event.evtname == 'Pattern':
+                events.extend(event.expand())
+            else:
+                events.append(event)
+        if self.transforms:
+            events = applyTransforms(events, self.transforms)
+        return events
+
+    def noteColumns(self):
+        '''
+        Return the notes (:class:`NoteOn` events) of the event list, and
+        their ticks, durations and volumes as arrays, for the bulk note
+        operations.
+        '''
+        notes = [event for event in self.eventList if event.evtname == 'NoteOn']
+        return (notes, array.array('l', [note.tick for note in notes]),
+                array.array('l', [note.duration for note in notes]),
+                array.array('l', [note.volume for note in notes]))
+
+    def replaceNotes(self, notes, ticks, durations, volumes):
+        '''
+        Replace the notes returned by :meth:`noteColumns`, and their note
+        offs, by notes with new ticks, durations and volumes.
+
+        The events are not changed in place (they may be shared by a fork):
+        new events are made, and the event list is rebuilt in one pass.
+        '''
+        self.unshare()
+        offs = {}
+        for note in notes:
+            key = (note.channel, note.pitch, note.tick + note.duration,
+                   note.insertion_order)
+            offs[key] = offs.get(key, 0) + 1
+        events = []
+        for event in self.eventList:
+            name = event.evtname
+            if name == 'NoteOn':
+                continue
+            if name == 'NoteOff':
+                key = (event.channel, event.pitch, event.tick,
+                       event.insertion_order)
+                if offs.get(key):
+                    offs[key] -= 1
+                    continue
+            events.append(event)
+        events.extend([NoteOn(note.channel, note.pitch, tick, duration, volume,
+                              annotation=note.annotation,
+                              insertion_order=note.insertion_order)
+                       for note, tick, duration, volume in
+                       zip(notes, ticks, durations, volumes)])
+        events.extend([NoteOff(note.channel, note.pitch, tick + duration,
+                               volume, annotation=note.annotation,
+                               insertion_order=note.insertion_order)
+                       for note, tick, duration, volume in
+                       zip(notes, ticks, durations, volumes)])
+        self.eventList = events
+
+    def resample(self, old, new, rounding='nearest'):
+        '''
+        Return copies of the events of the track converted from old to new
+        ticks per quarter note (see :func:`resampleTicks`), and the
+        collisions: a list of (tick, events) for each new tick on which
+        events from different ticks have landed.
+
+        Patterns are expanded. The ticks of all the events, and the ends of
+        the notes, are converted together as one array; a note's duration
+        becomes the difference of its converted end and start, so that it
+        still ends on its note off.
+        '''
+        events = []
+        for event in self.eventList:
+            if event.evtname == 'Pattern':
+                events.extend(event.expand())
+            else:
+                events.append(event)
+        ticks = array.array('l', [event.tick for event in events])
+        notes = [i for i, event in enumerate(events) if event.evtname == 'NoteOn']
+        ends = array.array('l', [events[i].tick + events[i].duration
+                                 for i in notes])
+        newTicks = resampleTicks(ticks, old, new, rounding)
+        newEnds = resampleTicks(ends, old, new, rounding)
+
+        resampled = []
+        for event, tick in zip(events, newTicks):
+            event = copy.copy(event)
+            event.tick = tick
+            resampled.append(event)
+        for i, end in zip(notes, newEnds):
+            resampled[i].duration = end - resampled[i].tick
+
+        first = {}  # new tick -> the old tick of the first event there
+        collided = set()
+        for tick, newTick in zip(ticks, newTicks):
+            if first.setdefault(newTick, tick) != tick:
+                collided.add(newTick)
+        collisions = []
+        if collided:
+            landed = {}
+            for event in resampled:
+                if event.tick in collided:
+                    landed.setdefault(event.tick, []).append(event)
+            collisions = [(tick, sorted(landed[tick], key=sort_events))
+                          for tick in sorted(collided)]
+        return resampled, collisions
+
+    def timeIndex(self):
+        '''
+        Return the :class:`TimeIndex` of the event list, which is built
+        again if events have been added or removed since it was last built.
+        '''
+        events = self.eventList
+        state = self.timeIndexState
+        if (state is None or state[0] is not events or state[1] != len(events) or
+                (state[1] > 0 and events[-1] is not state[2])):
+            state = (events, len(events), events[-1] if events else None,
+                     TimeIndex(events))
+            self.timeIndexState = state
+        return state[3]
+
+    def slice(self, start, end, notes='truncate'):
+        '''
+        Return the events of the track from tick start up to (but not
+        including) end, copied and moved earlier by start ticks, for
+        :meth:`MIDIFile.slice`.
+
+        The events which set the states in effect at start (see
+        :func:`stateKey`) are copied to the start of the slice. ``notes``
+        says what is done with notes which cross the ends of the slice:
+        ``'truncate'`` shortens them to fit, ``'keep'`` keeps whole the notes
+        which start in the slice and leaves out those which start before
+        it, and ``'drop'`` leaves out all of them.
+        '''
+        if notes not in ('truncate', 'keep', 'drop'):
+            raise ValueError("notes must be 'truncate', 'keep' or 'drop'")
+        index = self.timeIndex()
+        events = []
+        for event in index.stateAt(start):
+            event = copy.copy(event)
+            event.tick = 0
+            events.append(event)
+        for event in index.between(start, end):
+            event = copy.copy(event)
+            event.tick -= start
+            events.append(event)
+        if notes == 'keep':
+            selected = index.notes.starting(start, end)
+        else:
+            selected = index.notes.overlapping(start, end)
+        for note in selected:
+            tick = note.tick
+            finish = tick + note.duration
+            if notes == 'truncate':
+                tick = max(tick, start)
+                finish = min(finish, end)
+            elif notes == 'drop' and (tick < start or finish > end):
+                continue
+            note = copy.copy(note)
+            note.tick = tick - start
+            note.duration = finish - tick
+            events.append(note)
+            events.append(NoteOff(note.channel, note.pitch, finish - start,
+                                  note.volume, annotation=note.annotation,
+                                  insertion_order=note.insertion_order))
+        return events
+
+    def fork(self):
+        '''
+        Return a copy of the track which shares its event list (and, if the
+        track has been closed, its MIDI data) with this one.
+
+        Neither track copies the event list until it is modified, and the
+        events themselves are never modified in place, so forking costs the
+        same however many events the track holds.
+        '''
+        track = copy.copy(self)
+        self.shared = True
+        track.shared = True
+        return track
+
+    def unshare(self):
+        '''
+        Prepare a forked track for modification.
+
+        The event list is copied so that the other forks don't see the
+        change, and a closed track is re-opened, as its MIDI data no longer
+        describe the events.
+        '''
+        if not self.shared:
+            return
+        self.eventList = list(self.eventList)
+        self.shared = False
+        if self.closed:
+            self.reopen()
+
+    def reopen(self):
+        '''
+        Discard the processed events and MIDI data so that the track can be
+        closed again.
+        '''
+        self.closed = False
+        self.MIDIEventList = []
+        self.MIDIdata = b""
+        self.dataLength = 0
 
     def addNoteByNumber(self, channel, pitch, tick, duration, volume,
                         annotation=None, insertion_order=0):
         '''
         Add a note by chromatic MIDI number
         '''
+        self.unshare()
         self.eventList.append(NoteOn(channel, pitch, tick, duration, volume,
                                      annotation=annotation,
                                      insertion_order=insertion_order))
@@ -666,26 +1317,82 @@ class MIDITrack(object):
                                       annotation=annotation,
                                       insertion_order=insertion_order))
 
+    def addNotesByNumber(self, channels, pitches, ticks, durations, volumes,
+                         annotations=None, insertion_order=0):
+        '''
+        Add a series of notes. The notes take the insertion orders starting
+        at insertion_order.
+        '''
+        self.unshare()
+        if annotations is None:
+            annotations = [None] * len(pitches)
+        notes = list(zip(channels, pitches, ticks, durations, volumes,
+                         annotations))
+        self.eventList.extend([NoteOn(channel, pitch, tick, duration, volume,
+                                      annotation=annotation,
+                                      insertion_order=insertion_order + i)
+                               for i, (channel, pitch, tick, duration, volume,
+                                       annotation) in enumerate(notes)])
+        self.eventList.extend([NoteOff(channel, pitch, tick + duration, volume,
+                                       annotation=annotation,
+                                       insertion_order=insertion_order + i)
+                               for i, (channel, pitch, tick, duration, volume,
+                                       annotation) in enumerate(notes)])
+
     def addControllerEvent(self, channel, tick, controller_number, parameter,
                            insertion_order=0):
         '''
         Add a controller event.
         '''
 
+        self.unshare()
         self.eventList.append(ControllerEvent(channel, tick, controller_number,
                                               parameter,
                                               insertion_order=insertion_order))
 
-    def addPitchWheelEvent(self, channel, tick, pitch_wheel_value, insertion_order=0):
+    def addControllerEvents(self, channel, ticks, controller_number,
+                            parameters, insertion_order=0):
+        '''
+        Add a series of controller events. The events take the insertion
+        orders starting at insertion_order.
+        '''
+        self.unshare()
+        self.eventList.extend([ControllerEvent(channel, tick, controller_number,
+                                               parameter,
+                                               insertion_order=insertion_order + i)
+                               for i, (tick, parameter) in
+                               enumerate(zip(ticks, parameters))])
+
+    def addPitchWheelEvent(self, channel, tick, pitch_wheel_value, insertion_order=0,
+                           sec_sort_order=None):
         '''
-        Add a pitch wheel event.
+        Add a pitch wheel event. If sec_sort_order is given the event sorts
+        among the events of that order at its tick (see :func:`sort_events`),
+        rather than before them.
         '''
-        self.eventList.append(PitchWheelEvent(channel, tick, pitch_wheel_value, insertion_order=insertion_order))
+        self.unshare()
+        event = PitchWheelEvent(channel, tick, pitch_wheel_value, insertion_order=insertion_order)
+        if sec_sort_order is not None:
+            event.sec_sort_order = sec_sort_order
+        self.eventList.append(event)
+
+    def addPitchWheelEvents(self, channel, ticks, pitch_wheel_values,
+                            insertion_order=0):
+        '''
+        Add a series of pitch wheel events. The events take the insertion
+        orders starting at insertion_order.
+        '''
+        self.unshare()
+        self.eventList.extend([PitchWheelEvent(channel, tick, value,
+                                               insertion_order=insertion_order + i)
+                               for i, (tick, value) in
+                               enumerate(zip(ticks, pitch_wheel_values))])
 
     def addTempo(self, tick, tempo, insertion_order=0):
         '''
         Add a tempo change (or set) event.
         '''
+        self.unshare()
         self.eventList.append(Tempo(tick, tempo,
                                     insertion_order=insertion_order))
 
@@ -693,6 +1400,7 @@ class MIDITrack(object):
         '''
         Add a SysEx event.
         '''
+        self.unshare()
         self.eventList.append(SysExEvent(tick, manID, payload,
                                          insertion_order=insertion_order))
 
@@ -702,6 +1410,7 @@ class MIDITrack(object):
         '''
         Add a Universal SysEx event.
         '''
+        self.unshare()
         self.eventList.append(UniversalSysExEvent(tick, realTime, sysExChannel,
                               code, subcode, payload,
                               insertion_order=insertion_order))
@@ -710,6 +1419,7 @@ class MIDITrack(object):
         '''
         Add a program change event.
         '''
+        self.unshare()
         self.eventList.append(ProgramChange(channel, tick, program,
                                             insertion_order=insertion_order))
 
@@ -717,6 +1427,7 @@ class MIDITrack(object):
         '''
         Add a channel pressure event.
         '''
+        self.unshare()
         self.eventList.append(ChannelPressureEvent(channel, tick, pressure_value,
                                                    insertion_order=insertion_order))
 
@@ -724,6 +1435,7 @@ class MIDITrack(object):
         '''
         Add a track name event.
         '''
+        self.unshare()
         self.eventList.append(TrackName(tick, trackName,
                                         insertion_order=insertion_order))
 
@@ -732,6 +1444,7 @@ class MIDITrack(object):
         '''
         Add a time signature.
         '''
+        self.unshare()
         self.eventList.append(TimeSignature(tick, numerator, denominator,
                                             clocks_per_tick, notes_per_quarter,
                                             insertion_order=insertion_order))
@@ -740,6 +1453,7 @@ class MIDITrack(object):
         '''
         Add a copyright notice
         '''
+        self.unshare()
         self.eventList.append(Copyright(tick, notice,
                                         insertion_order=insertion_order))
 
@@ -748,6 +1462,7 @@ class MIDITrack(object):
         '''
         Add a copyright notice
         '''
+        self.unshare()
         self.eventList.append(KeySignature(tick, accidentals, accidental_type,
                                            mode,
                                            insertion_order=insertion_order))
@@ -756,24 +1471,87 @@ class MIDITrack(object):
         '''
         Add a text event
         '''
+        self.unshare()
         self.eventList.append(Text(tick, text,
                               insertion_order=insertion_order))
 
+    def addPattern(self, tick, pattern, insertion_order=0):
+        '''
+        Place a pattern. Its events take the insertion orders starting at
+        insertion_order.
+        '''
+        pattern.close()
+        if len(pattern.events) > 0:
+            self.unshare()
+            self.eventList.append(PatternEvent(tick, pattern,
+                                               insertion_order=insertion_order))
+
     def changeNoteTuning(self, tunings, sysExChannel=0x7F, realTime=True,
-                         tuningProgam=0, insertion_order=0):
+                         tuningProgam=0, insertion_order=0, tick=0):
         '''
         Change the tuning of MIDI notes
         '''
-        payload = struct.pack('>B', tuningProgam)
-        payload = payload + struct.pack('>B', len(tunings))
+        payload = bytearray([tuningProgam, len(tunings)])
         for (noteNumber, frequency) in tunings:
-            payload = payload + struct.pack('>B', noteNumber)
-            MIDIFreqency = frequencyTransform(frequency)
-            for byte in MIDIFreqency:
-                payload = payload + struct.pack('>B', byte)
+            payload.append(noteNumber)
+            payload.extend(tuningBytes(frequency))
+
+        self.unshare()
+        self.eventList.append(UniversalSysExEvent(tick, realTime, sysExChannel,
+                              8, 2, bytes(payload),
+                              insertion_order=insertion_order))
+
+    def addTuningDump(self, tick, frequencies, tuningProgram=0, tuningName="",
+                      bank=None, sysExChannel=0x7F, insertion_order=0):
+        '''
+        Add a bulk tuning dump (of all 128 notes).
+        '''
+        frequencies = list(frequencies)
+        if len(frequencies) != 128:
+            raise ValueError("A tuning dump needs 128 frequencies, not %d" %
+                             len(frequencies))
+        payload = bytearray()
+        if bank is None:
+            subcode = 1
+        else:
+            subcode = 4
+            payload.append(bank)
+        payload.append(tuningProgram)
+        payload.extend(tuningName.encode("ISO-8859-1")[:16].ljust(16, b' '))
+        for frequency in frequencies:
+            payload.extend(tuningBytes(frequency))
+        # The checksum covers everything from the non-real-time code on.
+        checksum = 0x7E ^ sysExChannel ^ 8 ^ subcode
+        for byte in payload:
+            checksum ^= byte
+        payload.append(checksum & 0x7F)
+
+        self.unshare()
+        self.eventList.append(UniversalSysExEvent(tick, False, sysExChannel,
+                              8, subcode, bytes(payload),
+                              insertion_order=insertion_order))
 
-        self.eventList.append(UniversalSysExEvent(0, realTime, sysExChannel,
-                              8, 2, payload, insertion_order=insertion_order))
+    def changeScaleTuning(self, tick, offsets, channels, realTime=True,
+                          sysExChannel=0x7F, insertion_order=0):
+        '''
+        Add a scale/octave tuning (1 byte form) event.
+        '''
+        offsets = list(offsets)
+        if len(offsets) != 12:
+            raise ValueError("A scale tuning needs 12 offsets, not %d" %
+                             len(offsets))
+        mask = 0
+        for channel in channels:
+            mask |= 1 << channel
+        payload = bytearray([(mask >> 14) & 0x03, (mask >> 7) & 0x7F,
+                             mask & 0x7F])
+        payload.extend(min(max(int(round(offset)) + 64, 0), 127)
+                       for offset in offsets)
+
+        self.unshare()
+        self.eventList.append(UniversalSysExEvent(tick, realTime, sysExChannel,
+                              8, 8, bytes(payload),
+                              insertion_order=insertion_order))
 
     def processEventList(self):
         '''
@@ -781,7 +1559,13 @@ class MIDITrack(object):
         which is then sorted to be in chronological order by start tick.
         '''
 
-        self.MIDIEventList = [evt for evt in self.eventList]
+        # Processing changes the times of the events, so work on copies and
+        # leave the eventList (which may be shared by forks) intact. The
+        # transforms are applied as the copies are made.
+        if self.transforms:
+            self.MIDIEventList = applyTransforms(self.eventList, self.transforms)
+        else:
+            self.MIDIEventList = [copy.copy(evt) for evt in self.eventList]
         # Assumptions in the code expect the list to be time-sorted.
         self.MIDIEventList.sort(key=sort_events)
 
@@ -805,6 +1589,77 @@ class MIDITrack(object):
         self.eventList = list(s)
         self.eventList.sort(key=sort_events)
 
+    def resolvePatterns(self, foreign=()):
+        '''
+        Expand the pattern placements that interleave with other events.
+
+        :param foreign: Optional. The sorted events of the other tracks
+            written in the same stream (those of a format 0 file), with
+            their patterns expanded.
+
+        A placement can be written to the stream as a single block only if no
+        other event (or other placement) sorts between its first and last
+        events, and if none of its notes is already sounding when it starts
+        (otherwise de-interleaving could change the result). Placements that
+        fail either test are replaced in the eventList by their events.
+        '''
+
+        placements = [evt for evt in self.eventList if evt.evtname == 'Pattern']
+        if len(placements) == 0:
+            return
+        if self.expand_patterns:
+            others = [evt for evt in self.eventList if evt.evtname != 'Pattern']
+            for placement in placements:
+                others.extend(placement.expand())
+            self.eventList = others
+            return
+        others = [evt for evt in self.eventList if evt.evtname != 'Pattern']
+        others.sort(key=sort_events)
+        placements.sort(key=sort_events)
+
+        interleaved = [False] * len(placements)
+        sounding = {}
+        index = 0
+        foreignIndex = 0
+        latest = None  # index of the placement reaching furthest so far
+        for i, placement in enumerate(placements):
+            first = sort_events(placement)
+            last = placement.lastKey()
+            while (foreignIndex < len(foreign) and
+                   sort_events(foreign[foreignIndex]) < first):
+                foreignIndex += 1
+            if (foreignIndex < len(foreign) and
+                    sort_events(foreign[foreignIndex]) <= last):
+                interleaved[i] = True
+            while index < len(others) and sort_events(others[index]) < first:
+                event = others[index]
+                index += 1
+                if event.evtname == 'NoteOn':
+                    key = (event.pitch, event.channel)
+                    sounding[key] = sounding.get(key, 0) + 1
+                elif event.evtname == 'NoteOff':
+                    key = (event.pitch, event.channel)
+                    if sounding.get(key, 0) > 1:
+                        sounding[key] -= 1
+                    else:
+                        sounding.pop(key, None)
+            if index < len(others) and sort_events(others[index]) <= last:
+                interleaved[i] = True
+            if latest is not None and placements[latest].lastKey() >= first:
+                interleaved[i] = True
+                interleaved[latest] = True
+            if not placement.pattern.notes.isdisjoint(sounding):
+                interleaved[i] = True
+            if latest is None or last > placements[latest].lastKey():
+                latest = i
+
+        for i, placement in enumerate(placements):
+            if interleaved[i]:
+                others.extend(placement.expand())
+            else:
+                others.append(placement)
+        self.eventList = others
+
     def closeTrack(self):
         '''
         Called to close a track before writing
@@ -820,11 +1675,26 @@ class MIDITrack(object):
             return
         self.closed = True
 
+        self.resolvePatterns()
+
         if self.remdep:
             self.removeDuplicates()
 
         self.processEventList()
 
+    def removeRedundantEvents(self):
+        '''
+        Remove events from the (sorted) MIDIEventList which don't change
+        anything, as if the track were played on its own (see
+        :func:`dropRedundantEvents`). The number of events dropped, by event
+        name, is stored in redundantCounts.
+
+        The tracks of a format 0 or 1 file share their channels, so
+        :class:`MIDIFile` removes the redundant events of all its tracks
+        together instead.
+        '''
+        self.redundantCounts = dropRedundantEvents([self.MIDIEventList])[0]
+
     def writeMIDIStream(self):
         '''
         Write the meta data and note data to the packed MIDI stream.
@@ -842,18 +1712,46 @@ class MIDITrack(object):
 
         self.dataLength = struct.pack('>L', len(self.MIDIdata))
 
+    def writeMergedStream(self, eventLists, origin):
+        '''
+        Merge several sorted event lists and write them to the MIDI stream.
+
+        The events are expected to have absolute times, which are written
+        relative to origin. This is used for format 0 files.
+        '''
+
+        def decorated(index, eventList):
+            for position, event in enumerate(eventList):
+                yield (sort_events(event), index, position, event)
+
+        previous_event_tick = origin
+        chunks = []
+        for entry in heapq.merge(*[decorated(index, eventList) for
+                                   index, eventList in enumerate(eventLists)]):
+            event = entry[-1]
+            chunks.append(event.serialize(previous_event_tick))
+            previous_event_tick = event.tick
+            if event.evtname == 'Pattern':
+                previous_event_tick += event.span
+        self.MIDIdata += b"".join(chunks)
+
+        self.MIDIdata += struct.pack('BBBB', 0x00, 0xFF, 0x2F, 0x00)
+        self.dataLength = struct.pack('>L', len(self.MIDIdata))
+
     def writeEventsToStream(self):
         '''
         Write the events in MIDIEvents to the MIDI stream.
         MIDIEventList is presumed to be already sorted in chronological order.
         '''
         previous_event_tick = 0
+        chunks = []
         for event in self.MIDIEventList:
-            self.MIDIdata += event.serialize(previous_event_tick)
+            chunks.append(event.serialize(previous_event_tick))
             # previous_event_tick = event.tick
             # I do not like that adjustTimeAndOrigin() changes GenericEvent.tick
             # from absolute to relative. I intend to change that, and just
             # calculate the relative tick here, without changing GenericEvent.tick
+        self.MIDIdata += b"".join(chunks)
 
     def deInterleaveNotes(self):
         '''
@@ -917,6 +1815,8 @@ class MIDITrack(object):
             adjustedTick = event.tick - internal_origin
             event.tick = adjustedTick - runningTick
             runningTick = adjustedTick
+            if event.evtname == 'Pattern':
+                runningTick += event.span
             tempEventList.append(event)
 
         self.MIDIEventList = tempEventList
@@ -931,6 +1831,42 @@ class MIDITrack(object):
         fileHandle.write(self.MIDIdata)
 
 
+class RawTrack(MIDITrack):
+    '''
+    A track whose MIDI data are copied, unchanged, from an existing file.
+
+    The data (a ``memoryview`` of the source, so nothing is copied until it
+    is written) are used as they are: the track has no events, can not be
+    modified, and is neither shifted nor merged with other tracks.
+    '''
+
+    def __init__(self, data):
+        super(RawTrack, self).__init__(False, False)
+        self.MIDIdata = data
+        self.dataLength = struct.pack('>L', len(data))
+        self.closed = True
+
+    def unshare(self):
+        # Every change to a track's events goes through unshare first.
+        raise ValueError("A track copied with addTrackChunks can not be "
+                         "modified")
+
+    def reopen(self):
+        pass
+
+    def fingerprint(self):
+        return hashlib.sha1(bytes(bytearray(self.MIDIdata))).hexdigest()
+
+    def closeTrack(self):
+        pass
+
+    def adjustTimeAndOrigin(self, origin, adjust):
+        pass
+
+    def writeMIDIStream(self):
+        pass
+
+
 class MIDIHeader(object):
     '''
     Class to encapsulate the MIDI header structure.
@@ -947,8 +1883,8 @@ class MIDIHeader(object):
         :param numTracks: The number of tracks the file contains. Integer,
             one or greater
         :param file_format: The format of the multi-track file. This should
-            either be ``1`` (the default, and the most widely supported
-            format) or ``2``.
+            be ``1`` (the default, and the most widely supported format),
+            ``2``, or ``0`` (a single track).
         :param ticks_per_quarternote: The number of ticks per quarter
             note is what the Standard MIDI File Format Specification calls
             "division".  Ticks are the integer unit of time in the SMF, and in
@@ -972,6 +1908,166 @@ class MIDIHeader(object):
         fileHandle.write(self.ticks_per_quarternote)
 
 
+class MIDIPattern(object):
+    '''
+    A block of channel events that is serialized once and can then be placed
+    on a track any number of times with :meth:`MIDIFile.addPattern`.
+
+    Loops (a drum bar, an ostinato) are the typical use. Each placement that
+    does not interleave with other events in the track is written by copying
+    the cached bytes of the pattern, so the cost of a repeat is about that of
+    a memory copy rather than that of processing every event again.
+    '''
+
+    def __init__(self, ticks_per_quarternote=TICKSPERQUARTERNOTE,
+                 eventtime_is_ticks=False, removeDuplicates=True,
+                 deinterleave=True):
+        '''Initialize the MIDIPattern class
+
+        :param ticks_per_quarternote: The resolution of the pattern. This
+            should be the same as that of the :class:`MIDIFile` on which the
+            pattern is placed.
+        :param eventtime_is_ticks: If set True means event time and duration
+            argument values are integer ticks instead of fractional quarter
+            notes.
+        :param removeDuplicates: If set to ``True`` remove duplicate events
+            from the pattern
+        :param deinterleave: If set to ``True`` deinterleave the notes in
+            the pattern
+
+        Times are relative to the start of the pattern, which is the time
+        given when it is placed. A pattern is closed (and serialized) when it
+        is first placed; events added after that are ignored.
+
+        Example:
+
+        .. code::
+
+            bar = MIDIPattern()
+            for beat in range(4):
+                bar.addNote(9, 36, beat, 0.5, 100)
+            for i in range(400):
+                MyMIDI.addPattern(0, i * 4, bar)
+        '''
+        self.track = MIDITrack(removeDuplicates, deinterleave)
+        self.closed = False
+        self.events = []
+        self.notes = set()
+        self.body = b""
+        self.offset = 0
+        self.span = 0
+
+        self.ticks_per_quarternote = ticks_per_quarternote
+        self.eventtime_is_ticks = eventtime_is_ticks
+        if self.eventtime_is_ticks:
+            self.time_to_ticks = lambda x: x
+        else:
+            self.time_to_ticks = self.quarter_to_tick
+        self.event_counter = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['time_to_ticks']
+        state['events'] = eventState(self.events)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.events = eventsFromState(state['events'])
+        if self.eventtime_is_ticks:
+            self.time_to_ticks = lambda x: x
+        else:
+            self.time_to_ticks = self.quarter_to_tick
+
+    def quarter_to_tick(self, quarternote_time):
+        return int(quarternote_time * self.ticks_per_quarternote)
+
+    def addNote(self, channel, pitch, time, duration, volume,
+                annotation=None):
+        '''
+        Add a note to the pattern. See :meth:`MIDIFile.addNote`.
+        '''
+        self.track.addNoteByNumber(channel, pitch, self.time_to_ticks(time),
+                                   self.time_to_ticks(duration), volume,
+                                   annotation=annotation,
+                                   insertion_order=self.event_counter)
+        self.event_counter += 1
+
+    def addControllerEvent(self, channel, time, controller_number, parameter):
+        '''
+        Add a controller event to the pattern. See
+        :meth:`MIDIFile.addControllerEvent`.
+        '''
+        self.track.addControllerEvent(channel, self.time_to_ticks(time),
+                                      controller_number, parameter,
+                                      insertion_order=self.event_counter)
+        self.event_counter += 1
+
+    def addPitchWheelEvent(self, channel, time, pitchWheelValue):
+        '''
+        Add a pitch wheel event to the pattern. See
+        :meth:`MIDIFile.addPitchWheelEvent`.
+        '''
+        self.track.addPitchWheelEvent(channel, self.time_to_ticks(time),
+                                      pitchWheelValue,
+                                      insertion_order=self.event_counter)
+        self.event_counter += 1
+
+    def addProgramChange(self, channel, time, program):
+        '''
+        Add a program change to the pattern. See
+        :meth:`MIDIFile.addProgramChange`.
+        '''
+        self.track.addProgramChange(channel, self.time_to_ticks(time), program,
+                                    insertion_order=self.event_counter)
+        self.event_counter += 1
+
+    def addChannelPressure(self, channel, time, pressure_value):
+        '''
+        Add a channel pressure event to the pattern. See
+        :meth:`MIDIFile.addChannelPressure`.
+        '''
+        self.track.addChannelPressure(channel, self.time_to_ticks(time),
+                                      pressure_value,
+                                      insertion_order=self.event_counter)
+        self.event_counter += 1
+
+    def close(self):
+        '''
+        Close the pattern for further writing and serialize it.
+
+        The events are stored with times relative to the first event, and the
+        serialized data are stored without the delta time of the first event,
+        which is written separately for each placement.
+        '''
+
+        if self.closed:
+            return
+        self.closed = True
+
+        self.track.closeTrack()
+        self.events = self.track.MIDIEventList
+        if len(self.events) == 0:
+            return
+
+        self.offset = self.events[0].tick
+        chunks = []
+        previous_event_tick = 0
+        for event in self.events:
+            event.tick -= self.offset
+            chunks.append(event.serialize(previous_event_tick))
+            previous_event_tick = event.tick
+            if event.evtname == 'NoteOn':
+                self.notes.add((event.pitch, event.channel))
+        # The first delta time is always zero, a single byte.
+        self.body = b"".join(chunks)[1:]
+        self.span = self.events[-1].tick
+
+    def __len__(self):
+        self.close()
+        return len(self.events)
+
+
 class MIDIFile(object):
     '''
     A class that encapsulates a full, well-formed MIDI file object.
@@ -983,7 +2079,9 @@ class MIDIFile(object):
 
     def __init__(self, numTracks=1, removeDuplicates=True, deinterleave=True,
                  adjust_origin=False, file_format=1,
-                 ticks_per_quarternote=TICKSPERQUARTERNOTE, eventtime_is_ticks=False):
+                 ticks_per_quarternote=TICKSPERQUARTERNOTE, eventtime_is_ticks=False,
+                 removeRedundant=False, polyphony=None, polyphonyPerChannel=False,
+                 stealPolicy='oldest', validate=False):
         '''Initialize the MIDIFile class
 
         :param numTracks: The number of tracks the file contains. Integer,
@@ -995,8 +2093,8 @@ class MIDIFile(object):
         :param adjust_origin: If set to ``True`` shift all the events in the tracks 
             so that the first event takes place at time t=0. Default is ``False``
         :param file_format: The format of the multi-track file. This should
-            either be ``1`` (the default, and the most widely supported
-            format) or ``2``.
+            be ``1`` (the default, and the most widely supported format),
+            ``2``, or ``0`` (see below).
         :param ticks_per_quarternote: The number of ticks per quarter note is
             what the Standard MIDI File Format Specification calls "division".
             Ticks are the integer unit of time in the SMF, and in most if
@@ -1007,6 +2105,21 @@ class MIDIFile(object):
         :param eventtime_is_ticks: If set True means event time and duration
             argument values are integer ticks instead of fractional quarter
             notes.
+        :param removeRedundant: If set to ``True`` remove events that don't
+            change anything (such as a program change to the program already
+            selected on the channel) before writing to disk. See
+            ``redundantEventCounts()``.
+        :param polyphony: Optional. The number of voices of the device the
+            file is for. When the file is closed, notes that would need more
+            voices than this steal the voice of a sounding note, which is cut
+            short (see below).
+        :param polyphonyPerChannel: If set to ``True`` the ``polyphony``
+            limit applies to each channel separately rather than to all of
+            them together.
+        :param stealPolicy: The note whose voice is stolen: ``'oldest'``
+            (the default), ``'quietest'`` or ``'lowest'``.
+        :param validate: If set to ``True`` the values passed to the ``add``
+            methods are checked when they are added (see below).
 
         Note that the default for ``adjust_origin`` will change in a future
         release, so one should probably explicitly set it.
@@ -1043,14 +2156,51 @@ class MIDIFile(object):
 
         In a format 2 file all tracks are indexed and the track parameter
         is interpreted literally.
+
+        A format 0 file contains a single track, which is what many hardware
+        players require. Events are added exactly as for a format 1 file
+        (including the tempo track), and when the file is closed all the
+        tracks are merged into the one that is written.
+
+        Polyphony Limits
+        ----------------
+
+        Some devices can only sound a fixed number of notes at once, and drop
+        (or cut short) notes beyond that. With ``polyphony`` set, the notes
+        of all the tracks are swept in order when the file is closed and this
+        is done in the file itself, following ``stealPolicy``, so that what is
+        heard is what the file says. The number of notes stolen is stored in
+        ``stolenNotes``. Tracks added with ``addTrackChunks`` are not
+        examined.
+
+        Validation
+        ----------
+
+        Without validation, a value out of range (a pitch of 128, say) is
+        only noticed when the file is written, if at all. With
+        ``validate=True`` the channels, pitches, velocities, times, durations
+        and the values of controller, program, pressure, pitch wheel and
+        tempo events are checked as they are added (including the events of
+        curves and placed patterns), and an :class:`InvalidValuesError` (a
+        ``ValueError``) names every value out of range. Integers of any
+        integral type (``numpy`` integers, for instance) are accepted. For
+        the bulk methods (such as :meth:`addNotes`) whole
+        columns are checked at once, and all the offending indices are
+        reported. Data known to be valid can be added to a validating file
+        without the cost of checking by passing ``trusted=True`` to
+        :meth:`addNotes`.
         '''
 
         self.tracks = list()
-        if file_format == 1:
+        if file_format in (0, 1):
             self.numTracks = numTracks + 1  # self.tracks[0] is the baked-in tempo track
         else:
             self.numTracks = numTracks
-        self.header = MIDIHeader(self.numTracks, file_format, ticks_per_quarternote)
+        if file_format == 0:
+            self.header = MIDIHeader(1, file_format, ticks_per_quarternote)
+        else:
+            self.header = MIDIHeader(self.numTracks, file_format, ticks_per_quarternote)
+        self.mergedTrack = None  # the single track written in format 0
 
         self.adjust_origin = adjust_origin
         self.closed = False
@@ -1062,15 +2212,56 @@ class MIDIFile(object):
         else:
             self.time_to_ticks = self.quarter_to_tick
 
+        if stealPolicy not in ('oldest', 'quietest', 'lowest'):
+            raise ValueError("Unknown stealing policy %r" % (stealPolicy,))
+        self.polyphony = polyphony
+        self.polyphonyPerChannel = polyphonyPerChannel
+        self.stealPolicy = stealPolicy
+        self.stolenNotes = 0
+        self.validate = validate
+        self.collisions = []  # set by resample
+
+        # Concurrent writers (see concurrentWriter), in order of creation.
+        # In a writer this is None.
+        self.writers = []
+        self.writersLock = threading.Lock()
+
         for i in range(0, self.numTracks):
-            self.tracks.append(MIDITrack(removeDuplicates, deinterleave))
+            self.tracks.append(MIDITrack(removeDuplicates, deinterleave,
+                                         removeRedundant))
+            # The notes of a pattern must be seen to count the voices.
+            self.tracks[i].expand_patterns = polyphony is not None
         # to keep track of the order of insertion for new sorting
         self.event_counter = 0
 
-    # Public Functions. These (for the most part) wrap the MIDITrack functions,
-    # where most Processing takes place.
-
-    def quarter_to_tick(self, quarternote_time):
+    def __getstate__(self):
+        '''
+        Return the state of the file for pickling. The events of the tracks
+        (and of any concurrent writers) are packed into binary columns, see
+        :meth:`MIDITrack.__getstate__`.
+        '''
+        state = self.__dict__.copy()
+        del state['time_to_ticks']
+        del state['writersLock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.writersLock = threading.Lock()
+        if self.eventtime_is_ticks:
+            self.time_to_ticks = lambda x: x
+        else:
+            self.time_to_ticks = self.quarter_to_tick
+
+    def __copy__(self):
+        midi_file = self.__class__.__new__(self.__class__)
+        midi_file.__dict__.update(self.__dict__)
+        return midi_file
+
+    # Public Functions. These (for the most part) wrap the MIDITrack functions,
+    # where most Processing takes place.
+
+    def quarter_to_tick(self, quarternote_time):
         return int(quarternote_time * self.ticks_per_quarternote)
 
     def tick_to_quarter(self, ticknum):
@@ -1100,7 +2291,11 @@ class MIDIFile(object):
         `csound <http://csound.github.io/>`_ orchestra files directly from the
         class ``EventList``.
         """
-        if self.header.numeric_format == 1:
+        if self.validate:
+            checkValues(channel=[channel], pitch=[pitch],
+                        time=[self.time_to_ticks(time)],
+                        duration=[self.time_to_ticks(duration)], volume=[volume])
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addNoteByNumber(channel, pitch,
                                            self.time_to_ticks(time), self.time_to_ticks(duration),
@@ -1108,6 +2303,168 @@ class MIDIFile(object):
                                            insertion_order=self.event_counter)
         self.event_counter += 1
 
+    def addNotes(self, track, channel, pitches, times, durations, volumes,
+                 annotations=None, trusted=False):
+        """
+
+        Add a series of notes to the MIDIFile object
+
+        :param track: The track to which the notes are added.
+        :param channel: The MIDI channel of the notes: either one channel for
+            all of them [Integer, 0-15], or a sequence with one per note.
+        :param pitches: The MIDI pitch numbers of the notes.
+        :param times: The times at which the notes sound, as for
+            :meth:`addNote`.
+        :param durations: The durations of the notes.
+        :param volumes: The volumes (velocities) of the notes.
+        :param annotations: Optional. The annotations of the notes.
+        :param trusted: If set to ``True`` the values are not checked, even
+            if the MIDIFile validates its input.
+
+        The result is the same as calling :meth:`addNote` for each note in
+        turn, but quicker. If the MIDIFile validates its input, each column
+        is checked in one pass, and all the values out of range are reported
+        together.
+        """
+        try:
+            channels = [operator.index(channel)] * len(pitches)
+        except TypeError:
+            channels = channel
+        ticks = [self.time_to_ticks(time) for time in times]
+        durations = [self.time_to_ticks(duration) for duration in durations]
+        if self.validate and not trusted:
+            checkValues(channel=channels, pitch=pitches, time=ticks,
+                        duration=durations, volume=volumes)
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        self.tracks[track].addNotesByNumber(channels, pitches, ticks, durations,
+                                            volumes, annotations=annotations,
+                                            insertion_order=self.event_counter)
+        self.event_counter += len(pitches)
+
+    def addPianoRoll(self, track, channel, time, roll, step, velocity=None):
+        """
+
+        Add the notes of a piano roll to the MIDIFile object
+
+        :param track: The track to which the notes are added.
+        :param channel: The MIDI channel of the notes [Integer, 0-15].
+        :param time: The time at which the roll starts, in beats (or ticks
+            if ``eventtime_is_ticks``).
+        :param roll: The piano roll: a sequence of rows, one for each pitch
+            from 0 (up to 128 of them), each holding a value from 0 to 255
+            for each time step. A row may be a ``bytes``, ``bytearray`` or
+            ``array('B')`` object, a list of integers, or a NumPy array of
+            ``uint8`` or ``bool`` values.
+        :param step: The length of a time step, in beats (or ticks).
+        :param velocity: Optional. If given, a note is a run of non-zero
+            values, and every note has this velocity (this suits binary
+            rolls). Otherwise the values are the velocities, and a change of
+            value starts a new note.
+
+        This is the reverse of :meth:`pianoRoll`. The onsets and offsets of
+        the notes are found by a regular expression over the bytes of each
+        row, which runs in C and yields one match for each note, and the
+        notes are added in bulk, as by :meth:`addNotes`, in order of onset
+        and pitch. The times are computed in ticks, so that the notes fall
+        exactly on the steps; the step must therefore be a whole number of
+        ticks. A roll of more than 128 rows, or a velocity above 127, is
+        rejected whether or not the file validates its input, as it can't be
+        written.
+        """
+        start = self.time_to_ticks(time)
+        ticks = self.time_to_ticks(step)
+        if ticks <= 0 or ticks != (step if self.eventtime_is_ticks
+                                   else step * self.ticks_per_quarternote):
+            raise ValueError("The step must be a whole number of ticks")
+        if len(roll) > 128:
+            raise ValueError("A piano roll has at most 128 rows")
+        if velocity is None:
+            runs = re.compile(br'([^\x00])\1*')
+        else:
+            runs = re.compile(br'[^\x00]+')
+        notes = []
+        for pitch, row in enumerate(roll):
+            values = bytearray(row)
+            data = bytes(values)
+            if data.count(b'\0') == len(data):
+                continue
+            notes.extend((match.start(), pitch, match.end(),
+                          values[match.start()] if velocity is None else velocity)
+                         for match in runs.finditer(data))
+        notes.sort()
+        pitches = [note[1] for note in notes]
+        volumes = [note[3] for note in notes]
+        onsets = [start + note[0] * ticks for note in notes]
+        durations = [(note[2] - note[0]) * ticks for note in notes]
+        # A velocity above 127 would be written as a status byte, so the
+        # velocities are checked even if the file doesn't validate its input.
+        bad = invalidIndices(volumes, 0, 127)
+        if bad:
+            raise InvalidValuesError({'volume': bad})
+        if self.validate:
+            checkValues(channel=[channel], time=[start])
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        self.tracks[track].addNotesByNumber([channel] * len(notes), pitches,
+                                            onsets, durations, volumes,
+                                            insertion_order=self.event_counter)
+        self.event_counter += len(notes)
+
+    def notesAt(self, track, time):
+        """
+
+        Return the notes sounding in a track at a time.
+
+        :param track: The track to search.
+        :param time: The time, in beats (or ticks if ``eventtime_is_ticks``).
+
+        The notes are returned as the :class:`NoteOn` events of the track
+        (with ``tick``, ``duration``, ``channel``, ``pitch`` and ``volume``
+        attributes), in the order of their start times. The track keeps an
+        index of its notes, built on the first query and updated as notes
+        are added, so a query takes time proportional to the notes near the
+        time asked about rather than to the length of the track. Notes
+        added as part of a :class:`MIDIPattern` are not found.
+        """
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        return self.tracks[track].notesAt(self.time_to_ticks(time))
+
+    def notesOverlapping(self, track, start, end):
+        """
+
+        Return the notes sounding in a track at some time from start up to
+        (but not including) end, as for :meth:`notesAt`.
+
+        :param track: The track to search.
+        :param start: The start of the region.
+        :param end: The end of the region.
+        """
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        return self.tracks[track].notesOverlapping(self.time_to_ticks(start),
+                                                   self.time_to_ticks(end))
+
+    def removeNotes(self, track, start, end):
+        """
+
+        Remove the notes of a track which start at some time from start up
+        to (but not including) end, and return them as for :meth:`notesAt`.
+
+        :param track: The track from which the notes are removed.
+        :param start: The start of the region.
+        :param end: The end of the region.
+
+        Finding the notes uses the index of :meth:`notesAt`. Removing them
+        and their note off events from the track's event list takes one pass
+        over the list.
+        """
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        return self.tracks[track].removeNotes(self.time_to_ticks(start),
+                                              self.time_to_ticks(end))
+
     def addTrackName(self, track, time, trackName):
         """
         Name a track.
@@ -1118,7 +2475,7 @@ class MIDIFile(object):
             of the track).
         :param trackName: The name to assign to the track [String]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addTrackName(self.time_to_ticks(time), trackName,
                                         insertion_order=self.event_counter)
@@ -1175,7 +2532,7 @@ class MIDIFile(object):
         time signature of, say, 6/8, one still needs to specify the clocks
         per quarter note.
         '''
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track = 0
 
         self.tracks[track].addTimeSignature(self.time_to_ticks(time), numerator, denominator,
@@ -1194,7 +2551,9 @@ class MIDIFile(object):
         :param time: The time (in beats) at which tempo event is placed
         :param tempo: The tempo, in Beats per Minute. [Integer]
         """
-        if self.header.numeric_format == 1:
+        if self.validate:
+            checkValues(time=[self.time_to_ticks(time)], tempo=[tempo])
+        if self.header.numeric_format in (0, 1):
             track = 0
         self.tracks[track].addTempo(self.time_to_ticks(time), tempo,
                                     insertion_order=self.event_counter)
@@ -1210,7 +2569,7 @@ class MIDIFile(object):
             general this sould be time t=0
         :param notice: The copyright notice [String]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addCopyright(self.time_to_ticks(time), notice,
                                         insertion_order=self.event_counter)
@@ -1248,7 +2607,7 @@ class MIDIFile(object):
 
             MyMIDI.addKeySignature(0, 0, 3, SHARPS, MINOR)
         '''
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track = 0  # User reported that this is needed.
         self.tracks[track].addKeySignature(self.time_to_ticks(time), accidentals, accidental_type,
                                            mode, insertion_order=self.event_counter)
@@ -1263,12 +2622,55 @@ class MIDIFile(object):
         :param time: The time (in beats) at which text event is placed.
         :param text: The text to adde [ASCII String]
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addText(self.time_to_ticks(time), text,
                                    insertion_order=self.event_counter)
         self.event_counter += 1
 
+    def addPattern(self, track, time, pattern):
+        """
+
+        Place a pattern on a track
+
+        :param track: The track on which the pattern is placed.
+        :param time: The time at which the pattern starts. Event times within
+            the pattern are relative to this.
+        :param pattern: The :class:`MIDIPattern` to place.
+
+        The pattern is serialized once, when it is first placed. Each
+        placement that does not interleave with other events in the track
+        (including other placements) is written by copying those bytes;
+        others are expanded into ordinary events when the file is closed.
+        Either way the resulting file is the same as one in which the
+        pattern's events had been added individually.
+
+        As an example, to repeat a one bar drum pattern 400 times:
+
+        .. code:: python
+
+            from midiutil.MidiFile import MIDIFile, MIDIPattern
+            bar = MIDIPattern()
+            for beat in range(4):
+                bar.addNote(9, 36, beat, 0.5, 100)
+            MyMIDI = MIDIFile(1)
+            for i in range(400):
+                MyMIDI.addPattern(0, i * 4, bar)
+
+        If the MIDIFile validates its input, the events of the pattern are
+        checked where they are placed, and an error is raised before any of
+        them is added.
+        """
+        if self.validate:
+            pattern.close()
+            checkValues(**eventValues(pattern.events,
+                                      self.time_to_ticks(time) + pattern.offset))
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        self.tracks[track].addPattern(self.time_to_ticks(time), pattern,
+                                      insertion_order=self.event_counter)
+        self.event_counter += len(pattern)
+
     def addProgramChange(self, tracknum, channel, time, program):
         """
 
@@ -1281,7 +2683,10 @@ class MIDIFile(object):
             placed [Float].
         :param program: the program number. [Integer, 0-127].
         """
-        if self.header.numeric_format == 1:
+        if self.validate:
+            checkValues(channel=[channel], time=[self.time_to_ticks(time)],
+                        program=[program])
+        if self.header.numeric_format in (0, 1):
             tracknum += 1
         self.tracks[tracknum].addProgramChange(channel, self.time_to_ticks(time), program,
                                                insertion_order=self.event_counter)
@@ -1298,7 +2703,10 @@ class MIDIFile(object):
             placed [Float].
         :param pressure_value: the pressure value. [Integer, 0-127].
         """
-        if self.header.numeric_format == 1:
+        if self.validate:
+            checkValues(channel=[channel], time=[self.time_to_ticks(time)],
+                        pressure_value=[pressure_value])
+        if self.header.numeric_format in (0, 1):
             tracknum += 1
         track = self.tracks[tracknum]
         track.addChannelPressure(channel, self.time_to_ticks(time), pressure_value,
@@ -1319,12 +2727,117 @@ class MIDIFile(object):
         :param parameter: The event's parameter, the meaning of which varies by
             event type.
         """
-        if self.header.numeric_format == 1:
+        if self.validate:
+            checkValues(channel=[channel], time=[self.time_to_ticks(time)],
+                        controller_number=[controller_number],
+                        parameter=[parameter])
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addControllerEvent(channel, self.time_to_ticks(time), controller_number,
                                               parameter, insertion_order=self.event_counter)  # noqa: E128
         self.event_counter += 1
 
+    def addControllerRamp(self, track, channel, time, duration,
+                          controller_number, start_value, end_value,
+                          resolution, curve='linear', tolerance=0):
+        """
+
+        Add a ramp of controller events
+
+        :param track: The track to which the events are added.
+        :param channel: the MIDI channel to assign to the events.
+            [Integer, 0-15]
+        :param time: The time at which the ramp starts.
+        :param duration: The length of the ramp.
+        :param controller_number: The controller ID of the events.
+        :param start_value: The value at the start of the ramp. [0-127]
+        :param end_value: The value at the end of the ramp. [0-127]
+        :param resolution: The time between the points at which the ramp is
+            sampled. Like ``time`` and ``duration`` this is in quarter notes
+            or ticks, depending on how the MIDIFile was created.
+        :param curve: The shape of the ramp: ``'linear'`` or
+            ``'exponential'`` (which changes by a constant ratio at each
+            step, as is usually wanted for volume and filter frequency).
+        :param tolerance: Points whose value is within ``tolerance`` of the
+            last value written are dropped. [Integer]
+
+        The last event of the ramp always has ``end_value``. As each sample is rounded to an integer
+        controller value, consecutive samples with the same value are never
+        written, so a slow ramp produces far fewer events than there are
+        sample points.
+
+        Returns the number of sample points that were dropped.
+
+        Example:
+
+        .. code:: python
+
+            # Fade channel 0 out over two bars, sampling every 32nd note
+            MyMIDI.addControllerRamp(0, 0, 8, 8, 7, 100, 0, 0.125)
+        """
+        start = self.time_to_ticks(time)
+        length = self.time_to_ticks(duration)
+        step = max(self.time_to_ticks(resolution), 1)
+        count = -(-length // step) + 1
+        ticks = [min(i * step, length) for i in range(count)]
+        fractions = [tick / length if length else 1.0 for tick in ticks]
+        if curve == 'linear':
+            values = [start_value + (end_value - start_value) * fraction
+                      for fraction in fractions]
+        elif curve == 'exponential':
+            # Geometric interpolation, offset by one so that zero is allowed.
+            ratio = (end_value + 1) / (start_value + 1)
+            values = [(start_value + 1) * ratio ** fraction - 1
+                      for fraction in fractions]
+        else:
+            raise ValueError("Unknown curve type: %s" % curve)
+        return self.addControllerCurve(track, channel, time, controller_number,
+                                       values, resolution, tolerance=tolerance,
+                                       ticks=[start + tick for tick in ticks])
+
+    def addControllerCurve(self, track, channel, time, controller_number,
+                           values, resolution, tolerance=0, ticks=None):
+        """
+
+        Add controller events following a sampled curve
+
+        :param track: The track to which the events are added.
+        :param channel: the MIDI channel to assign to the events.
+            [Integer, 0-15]
+        :param time: The time of the first sample.
+        :param controller_number: The controller ID of the events.
+        :param values: The sampled values. They are rounded to integers and
+            limited to the range 0-127.
+        :param resolution: The time between samples, in quarter notes or ticks
+            depending on how the MIDIFile was created.
+        :param tolerance: Samples whose value is within ``tolerance`` of the
+            last value written are dropped. [Integer]
+        :param ticks: Optional. The time of each sample in ticks. If given,
+            ``time`` and ``resolution`` are ignored.
+
+        Returns the number of samples that were dropped. See
+        ``addControllerRamp()``.
+        """
+        if ticks is None:
+            start = self.time_to_ticks(time)
+            step = self.time_to_ticks(resolution)
+            ticks = [start + i * step for i in range(len(values))]
+        values = [min(max(int(round(value)), 0), 127) for value in values]
+        if self.validate:
+            checkValues(channel=[channel], time=ticks,
+                        controller_number=[controller_number])
+        kept = thinValues(values, tolerance)
+
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        self.tracks[track].addControllerEvents(channel,
+                                               [ticks[i] for i in kept],
+                                               controller_number,
+                                               [values[i] for i in kept],
+                                               insertion_order=self.event_counter)
+        self.event_counter += len(kept)
+        return len(values) - len(kept)
+
     def addPitchWheelEvent(self, track, channel, time, pitchWheelValue):
         """
 
@@ -1335,12 +2848,88 @@ class MIDIFile(object):
         :param time: The time (in beats) at which the event is placed [Float].
         :param pitchWheelValue: 0 for no pitch change. [Integer, -8192-8192]
         """
-        if self.header.numeric_format == 1:
+        if self.validate:
+            checkValues(channel=[channel], time=[self.time_to_ticks(time)],
+                        pitchWheelValue=[pitchWheelValue])
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addPitchWheelEvent(channel, self.time_to_ticks(time), pitchWheelValue,
                                               insertion_order=self.event_counter)
         self.event_counter += 1
 
+    def addPitchWheelCurve(self, track, channel, time, values, resolution,
+                           tolerance=0, method='deviation'):
+        """
+
+        Add pitch wheel events following a sampled curve
+
+        :param track: The track to which the events are added.
+        :param channel: the MIDI channel to assign to the events.
+            [Integer, 0-15]
+        :param time: The time of the first sample.
+        :param values: The sampled pitch wheel values. They are rounded to
+            integers and limited to the range -8192 to 8191.
+        :param resolution: The time between samples, in quarter notes or ticks
+            depending on how the MIDIFile was created.
+        :param tolerance: The largest error, in pitch wheel units, allowed in
+            the simplified curve.
+        :param method: How the curve is simplified: ``'deviation'`` (the
+            default) or ``'rdp'`` (see below).
+
+        Vibrato and glides sampled finely produce a great many events, most of
+        which change the pitch imperceptibly. The curve is simplified before
+        the events are added, so that only the points needed to stay within
+        ``tolerance`` of the original are written. They are added to the
+        track in one batch.
+
+        A synthesizer holds each pitch wheel value until the next event, and
+        the ``'deviation'`` method respects this: a sample is dropped if it
+        is within ``tolerance`` of the last value written. The ``'rdp'``
+        method (Ramer-Douglas-Peucker) keeps the points needed for straight
+        lines *between* the written points to stay within ``tolerance``. It
+        usually drops many more points, but is only accurate for receivers
+        that interpolate between pitch wheel events.
+
+        Returns the number of samples that were dropped.
+
+        Example:
+
+        .. code:: python
+
+            import math
+            # Half a second of 6 Hz vibrato at 120 BPM, sampled every tick
+            vibrato = [400 * math.sin(2 * math.pi * 6 * tick / 1920.0)
+                       for tick in range(960)]
+            MyMIDI.addPitchWheelCurve(0, 0, 4, vibrato, 1.0 / 960,
+                                      tolerance=20)
+        """
+        start = self.time_to_ticks(time)
+        step = self.time_to_ticks(resolution)
+        if step == 0:
+            # Sub-tick resolution, so place each sample individually
+            ticks = [self.time_to_ticks(time + i * resolution)
+                     for i in range(len(values))]
+        else:
+            ticks = [start + i * step for i in range(len(values))]
+        values = [min(max(int(round(value)), -8192), 8191) for value in values]
+        if self.validate:
+            checkValues(channel=[channel], time=ticks)
+        if method == 'deviation':
+            kept = thinValues(values, tolerance)
+        elif method == 'rdp':
+            kept = simplifyCurve(ticks, values, tolerance)
+        else:
+            raise ValueError("Unknown simplification method: %s" % method)
+
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        self.tracks[track].addPitchWheelEvents(channel,
+                                               [ticks[i] for i in kept],
+                                               [values[i] for i in kept],
+                                               insertion_order=self.event_counter)
+        self.event_counter += len(kept)
+        return len(values) - len(kept)
+
     def makeRPNCall(self, track, channel, time, controller_msb, controller_lsb,
                     data_msb, data_lsb, time_order=False):
         '''
@@ -1400,7 +2989,7 @@ class MIDIFile(object):
         '''
         tick = self.time_to_ticks(time)
 
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         track = self.tracks[track]
 
@@ -1455,7 +3044,7 @@ class MIDIFile(object):
         '''
         tick = self.time_to_ticks(time)
 
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         track = self.tracks[track]
 
@@ -1524,7 +3113,7 @@ class MIDIFile(object):
                          time_order=time_order)
 
     def changeNoteTuning(self, track, tunings, sysExChannel=0x7F,
-                         realTime=True, tuningProgam=0):
+                         realTime=True, tuningProgam=0, time=0):
         """
         Add a real-time MIDI tuning standard update to a track.
 
@@ -1539,6 +3128,8 @@ class MIDIFile(object):
             flagged as real-time or non-real-time. As with the ``sysExChannel``
             argument, this should in general be left at it's default value.
         :param tuningProgram: The tuning program number.
+        :param time: The time of the event. This defaults to the start of the
+            track.
 
         This function specifically implements the "real time single note tuning
         change" (although the name is misleading, as multiple notes can be
@@ -1558,11 +3149,88 @@ class MIDIFile(object):
             tuning = [(69, 500)]
             MyMIDI.changeNoteTuning(0, tuning, tuningProgam=0)
         """
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].changeNoteTuning(tunings, sysExChannel, realTime,
                                             tuningProgam,
-                                            insertion_order=self.event_counter)
+                                            insertion_order=self.event_counter,
+                                            tick=self.time_to_ticks(time))
+        self.event_counter += 1
+
+    def addTuningDump(self, track, time, frequencies, tuningProgram=0,
+                      tuningName="", bank=None, sysExChannel=0x7F):
+        """
+        Add a MIDI tuning standard bulk tuning dump to a track.
+
+        :param track: The track to which the tuning is added.
+        :param time: The time of the event.
+        :param frequencies: A sequence of 128 frequencies, one for each MIDI
+            note. An entry of ``None`` (or a frequency outside the range of the
+            tuning standard, about 8.18 to 13289 Hz) leaves the note unchanged.
+        :param tuningProgram: The tuning program number. [Integer, 0-127]
+        :param tuningName: The name of the tuning. Up to 16 ASCII characters.
+        :param bank: The tuning bank. If given the "bulk dump with bank"
+            form of the message is written, otherwise the original form,
+            which implies bank 0, is used.
+        :param sysExChannel: The SysEx channel of the event. Unless there is a
+            specific reason for changing it, it should be left at its default
+            value.
+
+        Where ``changeNoteTuning`` retunes some notes, the bulk dump defines
+        a complete tuning program of 128 notes in one (non-real-time) event.
+        As with ``changeNoteTuning``, the program may then need to be selected
+        with ``changeTuningProgram`` and ``changeTuningBank``.
+
+        A tuning can be read from Scala files with ``readScalaTuning``:
+
+        .. code:: python
+
+            from midiutil.MidiFile import MIDIFile, readScalaTuning
+            with open("bohlen-pierce.scl") as scl:
+                frequencies = readScalaTuning(scl)
+            MyMIDI.addTuningDump(0, 0, frequencies, tuningProgram=1,
+                                 tuningName="Bohlen-Pierce")
+            MyMIDI.changeTuningProgram(0, 0, 0, 1)
+        """
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        self.tracks[track].addTuningDump(self.time_to_ticks(time), frequencies,
+                                         tuningProgram, tuningName, bank,
+                                         sysExChannel,
+                                         insertion_order=self.event_counter)
+        self.event_counter += 1
+
+    def changeScaleTuning(self, track, time, offsets, channels=None,
+                          realTime=True, sysExChannel=0x7F):
+        """
+        Add a MIDI tuning standard scale/octave tuning to a track.
+
+        :param track: The track to which the tuning is added.
+        :param time: The time of the event.
+        :param offsets: Twelve offsets, in cents, for the pitch classes C
+            through B. They are rounded to integers in the range -64 to 63.
+        :param channels: The MIDI channels to which the tuning applies.
+            Defaults to all sixteen.
+        :param realTime: Sets the real-time flag. Defaults to real-time.
+        :param sysExChannel: The SysEx channel of the event.
+
+        This retunes every octave in the same way, which is all that many
+        tunings (such as historical temperaments) need, in a short message.
+        For example, quarter-comma meantone:
+
+        .. code:: python
+
+            meantone = [10.3, -13.7, 3.4, 20.5, -3.4, 13.7, -10.3, 6.8,
+                        -17.1, 0, 17.1, -6.8]
+            MyMIDI.changeScaleTuning(0, 0, meantone)
+        """
+        if channels is None:
+            channels = range(16)
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        self.tracks[track].changeScaleTuning(self.time_to_ticks(time), offsets,
+                                             channels, realTime, sysExChannel,
+                                             insertion_order=self.event_counter)
         self.event_counter += 1
 
     def addSysEx(self, track, time, manID, payload):
@@ -1583,7 +3251,7 @@ class MIDIFile(object):
 
         '''
         tick = self.time_to_ticks(time)
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addSysEx(tick, manID, payload,
                                     insertion_order=self.event_counter)
@@ -1616,30 +3284,570 @@ class MIDIFile(object):
 
         '''
         tick = self.time_to_ticks(time)
-        if self.header.numeric_format == 1:
+        if self.header.numeric_format in (0, 1):
             track += 1
         self.tracks[track].addUniversalSysEx(tick, code, subcode, payload,
                                              sysExChannel, realTime,
                                              insertion_order=self.event_counter)  # noqa: E128
         self.event_counter += 1
 
-    def writeFile(self, fileHandle):
+    def writeFile(self, fileHandle, cache=None):
         '''
         Write the MIDI File.
 
         :param fileHandle: A file handle that has been opened for binary
             writing.
+        :param cache: Optional. A :class:`RenderCache`. The file is looked
+            up in it by its fingerprint (see :meth:`fingerprint`), and if it
+            is found the cached data are written without closing the file.
+            Otherwise the file is closed, with the tracks looked up in the
+            cache, and the data written are stored in it.
+
+        Example:
+
+        .. code:: python
+
+            cache = RenderCache("/var/cache/midi", maxBytes=2 ** 30)
+            with open("output.mid", "wb") as output_file:
+                MyMIDI.writeFile(output_file, cache=cache)
         '''
 
+        if cache is not None and not self.rendered():
+            # The key is that of the events as added: closing the file
+            # changes its fingerprint, so it must be taken first.
+            key = 'file-' + self.fingerprint()
+            data = cache.get(key)
+            if data is None:
+                self.close(cache)
+                output = io.BytesIO()
+                self.writeFile(output)
+                data = output.getvalue()
+                cache.put(key, data)
+            fileHandle.write(data)
+            return
+
         self.header.writeFile(fileHandle)
 
         # Close the tracks and have them create the MIDI event data structures.
         self.close()
 
         # Write the MIDI Events to file.
+        if self.header.numeric_format == 0:
+            self.mergedTrack.writeTrack(fileHandle)
+            return
         for i in range(0, self.numTracks):
             self.tracks[i].writeTrack(fileHandle)
 
+    def rendered(self):
+        '''
+        Return ``True`` if the file has been closed and its data are up to
+        date, so that writing it again needs no processing.
+        '''
+        if not self.closed:
+            return False
+        if self.header.numeric_format == 0:
+            # The tracks are merged on close, so they hold no data of their
+            # own.
+            return all(track.closed for track in self.tracks)
+        return all(len(track.MIDIdata) > 0 for track in self.tracks)
+
+    def tempoMap(self):
+        '''
+        Return the tempo map of the file, as a function which takes a list of
+        ticks and returns the times, in seconds, at which they fall.
+
+        The tempo is 120 beats per minute until the first tempo event.
+        '''
+        self.mergeWriters()
+        if self.header.numeric_format in (0, 1):
+            tracks = self.tracks[0:1]
+        else:
+            tracks = self.tracks
+        tempos = sorted([event for track in tracks
+                         if not isinstance(track, RawTrack)
+                         for event in track.playedEvents()
+                         if event.evtname == 'Tempo'], key=sort_events)
+        return TempoMap([(event.tick, event.tempo) for event in tempos],
+                        self.ticks_per_quarternote)
+
+    def pianoRoll(self, step, track=None, seconds=False, binary=False,
+                  sparse=False):
+        '''
+        Return the notes of the file, or of one track, as a piano roll: a
+        matrix of pitch by time step.
+
+        :param step: The length of a time step, in beats (or ticks if
+            ``eventtime_is_ticks``), or in seconds if ``seconds`` is set.
+        :param track: Optional. The track whose notes are taken; all the
+            tracks if not given.
+        :param seconds: Optional. If set, the step is in seconds, and the
+            notes are placed in time by the file's tempo map.
+        :param binary: Optional. If set, the matrix holds 1 where a note
+            sounds; otherwise it holds the note's velocity.
+        :param sparse: Optional. If set, the piano roll is returned as a
+            list of ``(pitch, first step, end step, value)`` tuples, one for
+            each note, rather than as a dense matrix.
+
+        The dense matrix is a list of 128 ``array('B')`` rows, one for each
+        pitch, with a column for each time step up to the end of the last
+        note; ``numpy.array(roll)`` turns it into a NumPy array. A note
+        covers the steps from the one in which it starts up to (but not
+        including) the one in which it ends, and at least one step. Where
+        notes of the same pitch overlap, the velocity of the one which
+        started last is used.
+
+        The notes are taken as they will be played (see
+        :meth:`playedNotes`): with patterns expanded, transforms applied, and
+        the notes cut short or removed by the ``polyphony`` limit. Their
+        start and end times are converted to steps as two arrays, and each
+        note fills its span of its pitch's row with a single slice
+        assignment, so the cost is in proportion to the number of notes
+        rather than to the number of ticks.
+
+        The dense matrix needs pitches from 0 to 127 and velocities from 0
+        to 255; if a note is out of range (which only a file that does not
+        validate its input can hold), an :class:`InvalidValuesError` is
+        raised.
+        '''
+        notes, ends = self.playedNotes(track)
+        if not sparse:
+            errors = {}
+            for name, values, high in (('pitch', [note.pitch for note in notes], 127),
+                                       ('volume', [note.volume for note in notes], 255)):
+                indices = invalidIndices(values, 0, high)
+                if indices:
+                    errors[name] = indices
+            if errors:
+                raise InvalidValuesError(errors)
+        starts = [note.tick for note in notes]
+        if seconds:
+            if step <= 0:
+                raise ValueError("The step must be positive")
+            tempoMap = self.tempoMap()
+            starts = tempoMap.seconds(starts)
+            ends = tempoMap.seconds(ends)
+        else:
+            step = self.time_to_ticks(step)
+            if step <= 0:
+                raise ValueError("The step must be at least one tick")
+        # Times in seconds are not exact, so a time within a nanostep of a
+        # step boundary is taken to be on it.
+        fuzz = 1e-9 if seconds else 0
+        first = array.array('l', [int(math.floor(start / step + fuzz))
+                                  for start in starts])
+        last = array.array('l', [max(int(math.ceil(end / step - fuzz)), begin + 1)
+                                 for end, begin in zip(ends, first)])
+        values = [1 if binary else note.volume for note in notes]
+
+        if sparse:
+            return [(note.pitch, begin, end, value) for note, begin, end, value
+                    in zip(notes, first, last, values)]
+        width = max(last) if notes else 0
+        rows = [array.array('B', [0]) * width for pitch in range(128)]
+        for note, begin, end, value in zip(notes, first, last, values):
+            rows[note.pitch][begin:end] = array.array('B', [value]) * (end - begin)
+        return rows
+
+    def playedNotes(self, track=None):
+        '''
+        Return the notes of the file, or of one track, as they will be
+        played: a list of :class:`NoteOn` events in order of time, and a
+        list of the tick at which each one ends.
+
+        Patterns are expanded and transforms applied (see
+        :meth:`MIDITrack.playedEvents`). If the file has a ``polyphony``
+        limit the voices are stolen as they will be when the file is closed
+        (see :func:`stealNotes`), on copies of the events: a stolen note
+        ends early, or is left out if it would not sound at all.
+        '''
+        self.mergeWriters()
+        tracks = [midi_track for midi_track in self.tracks
+                  if not isinstance(midi_track, RawTrack)]
+        if track is not None:
+            if self.header.numeric_format in (0, 1):
+                track += 1
+            selected = self.tracks[track]
+        if self.polyphony is None:
+            if track is not None:
+                tracks = [selected]
+            notes = sorted([event for midi_track in tracks
+                            for event in midi_track.playedEvents()
+                            if event.evtname == 'NoteOn'], key=sort_events)
+            return notes, [note.tick + note.duration for note in notes]
+
+        # The voices are shared by all the tracks, so all of them are played.
+        eventLists = [sorted([copy.copy(event) for event in midi_track.playedEvents()
+                              if event.evtname in ('NoteOn', 'NoteOff')],
+                             key=sort_events)
+                      for midi_track in tracks]
+        stealNotes(eventLists, self.polyphony, self.polyphonyPerChannel,
+                   self.stealPolicy)
+        spans = []
+        for midi_track, events in zip(tracks, eventLists):
+            if track is not None and midi_track is not selected:
+                continue
+            # The NoteOffs end the notes in the order they started.
+            pending = {}
+            for event in events:
+                key = (event.pitch, event.channel)
+                if event.evtname == 'NoteOn':
+                    span = [event, event.tick + event.duration]
+                    spans.append(span)
+                    pending.setdefault(key, deque()).append(span)
+                elif pending.get(key):
+                    pending[key].popleft()[1] = event.tick
+        spans.sort(key=lambda span: sort_events(span[0]))
+        return [span[0] for span in spans], [span[1] for span in spans]
+
+    def renderWAV(self, fileHandle, sampleRate=22050, waveform='sine',
+                  gain=0.1, blockSize=4096):
+        '''
+        Render a preview of the notes of the file as audio, and write it as a
+        mono, 16-bit WAV file.
+
+        :param fileHandle: A file name, or a file opened for binary writing.
+        :param sampleRate: Optional. The sample rate, in Hz.
+        :param waveform: Optional. The voice: ``'sine'`` (the default),
+            ``'saw'``, or a wavetable, a sequence of numbers from -1 to 1
+            holding one cycle of the waveform.
+        :param gain: Optional. The amplitude of a note of velocity 127, as a
+            fraction of full scale. The mix is clipped, so this should be
+            lowered for dense scores.
+        :param blockSize: Optional. The number of samples rendered at a time.
+
+        The notes are placed in time by the file's tempo map (see
+        :meth:`tempoMap`), as they will be written (see :meth:`playedNotes`),
+        and are played in equal temperament; pitch
+        bends, programs, controllers and tunings are ignored. Each note has
+        a linear attack and release of 5 milliseconds, applied as a table of
+        gains over the first and last samples of the note. The waveform is
+        checked before anything is written.
+
+        The audio is rendered and written a block at a time, so the memory
+        used does not grow with the length of the file. Each voice plays from
+        a table holding a whole number of cycles of its waveform at its
+        pitch and velocity, computed once and kept in a small cache, so a
+        note's samples in a block are a slice of its table. The notes
+        sounding in a block are summed in one pass over the block, and the
+        mix is only clipped if it is out of range.
+        '''
+        self.mergeWriters()
+        if blockSize <= 0:
+            raise ValueError("The block size must be positive")
+        checkWaveform(waveform)
+        notes, ends = self.playedNotes()
+        tempoMap = self.tempoMap()
+        starts = tempoMap.seconds([note.tick for note in notes])
+        ends = tempoMap.seconds(ends)
+        voices = sorted((int(round(start * sampleRate)),
+                         int(round(end * sampleRate)), note.pitch, note.volume)
+                        for note, start, end in zip(notes, starts, ends)
+                        if end > start)
+        total = max([voice[1] for voice in voices] + [0])
+
+        ramp = max(int(sampleRate * 0.005), 1)
+        attack = list(range(ramp))  # the gain, in ramp-ths, from the start
+        release = list(range(ramp, 0, -1))  # and up to the end
+        bases = {}  # pitch -> table at velocity 127
+        tables = {}  # (pitch, velocity) -> table
+        silence = array.array('i', [0]) * blockSize
+        output = wave.open(fileHandle, 'wb')
+        try:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(sampleRate)
+            following = 0  # the next voice to start
+            sounding = []
+            for begin in range(0, total, blockSize):
+                end = min(begin + blockSize, total)
+                length = end - begin
+                while following < len(voices) and voices[following][0] < end:
+                    sounding.append(voices[following])
+                    following += 1
+                sounding = [voice for voice in sounding if voice[1] > begin]
+                parts = []
+                for start, stop, pitch, volume in sounding:
+                    table = tables.get((pitch, volume))
+                    if table is None:
+                        base = bases.get(pitch)
+                        if base is None:
+                            base = waveTable(waveform,
+                                             440.0 * 2 ** ((pitch - 69) / 12.0),
+                                             sampleRate, gain * 32767)
+                            bases[pitch] = base
+                        if len(tables) >= 1024:
+                            tables.clear()
+                        table = array.array('i', [value * volume // 127
+                                                  for value in base])
+                        tables[(pitch, volume)] = table
+                    first = max(start, begin)
+                    last = min(stop, end)
+                    samples = loopedSlice(table, first - start, last - first)
+                    # The attack and the release
+                    for gains, origin in ((attack, start),
+                                          (release, stop - ramp)):
+                        low = max(first, origin)
+                        high = min(last, origin + ramp)
+                        if low < high:
+                            samples[low - first:high - first] = array.array(
+                                'i', [sample * factor // ramp for sample, factor
+                                      in zip(samples[low - first:high - first],
+                                             gains[low - origin:high - origin])])
+                    parts.append(silence[:first - begin] + samples +
+                                 silence[:end - last])
+                if not parts:
+                    mix = silence[:length]
+                elif len(parts) == 1:
+                    mix = parts[0]
+                else:
+                    mix = list(map(sum, zip(*parts)))
+                if mix and (max(mix) > 32767 or min(mix) < -32768):
+                    mix = [min(max(value, -32768), 32767) for value in mix]
+                block = array.array('h', mix)
+                if sys.byteorder == 'big':
+                    block.byteswap()
+                output.writeframes(arrayToBytes(block))
+        finally:
+            output.close()
+
+    def writeColumns(self, fileHandle):
+        '''
+        Write the events of the file as typed binary columns, which can be
+        read back with :func:`readColumns`, or memory-mapped by other tools.
+
+        :param fileHandle: A file opened for binary writing.
+
+        The file holds, for each track, seven columns of little-endian values
+        (with their ``numpy`` types):
+
+        * ``tick`` (``<i4``): the time of the event;
+        * ``type`` (``|u1``): the kind of event, an index into the ``types``
+          list of the metadata (``'NoteOn'``, ``'ControllerEvent'`` and so
+          on);
+        * ``channel`` (``|u1``): the channel, or 255 for events without one;
+        * ``data1`` (``<i4``): the pitch of a note, the controller number,
+          the program, the pressure or pitch wheel value, or the tempo (in
+          microseconds per quarter note);
+        * ``data2`` (``<i4``): the velocity of a note, or the value of a
+          controller;
+        * ``duration`` (``<i4``): the duration of a note, in ticks;
+        * ``order``  (``<i4``): the insertion order of the event.
+
+        The other attributes of events (the texts and data of meta and
+        system exclusive events, the fields of time and key signatures, and
+        the annotations of notes) are held, per track, in a side table of
+        JSON. Patterns are expanded into their events. Everything is checked
+        before anything is written: a ``ValueError`` is raised if an
+        annotation can't be written as JSON, and an
+        :class:`InvalidValuesError` if a channel is out of range.
+
+        The file starts with the magic string ``b'MUcf'``, a version number
+        and the length of the metadata (a ``'<4sHHI'`` struct), followed by
+        the metadata, in JSON. This gives the options of the file, the
+        ``types`` list and, for each track, the number of events, the offsets
+        of its columns and the offset and length of its side table. The
+        offsets count from the start of the data, which is the first multiple
+        of eight bytes after the metadata, and every column starts on a
+        multiple of eight, so that the columns can be mapped without copying:
+
+        .. code:: python
+
+            data = numpy.memmap("song.mcf", mode="r")
+            ticks = data[base + offset:base + offset + 4 * count].view("<i4")
+        '''
+        self.mergeWriters()
+        if any(isinstance(track, RawTrack) for track in self.tracks):
+            raise ValueError("Tracks added with addTrackChunks can't be written "
+                             "as columns")
+        chunks = []
+        length = 0
+        tracks = []
+        for track in self.tracks:
+            events = []
+            for event in track.eventList:
+                if event.evtname == 'Pattern':
+                    events.extend(event.expand())
+                else:
+                    events.append(event)
+            columns, side = eventTable(events)
+            offsets = {}
+            for name, code, dtype in columnFormats:
+                offsets[name] = length
+                data = arrayToBytes(columns[name])
+                chunks.append(data)
+                length += len(data)
+                padding = -length % 8
+                chunks.append(b"\0" * padding)
+                length += padding
+            try:
+                side = json.dumps([[i, jsonValue(fields)] for i, fields in side],
+                                  sort_keys=True).encode('utf-8')
+            except (TypeError, ValueError) as error:
+                raise ValueError("Track %d can't be written as columns, as an "
+                                 "annotation is not a JSON value (%s)" %
+                                 (len(tracks), error))
+            tracks.append({'count': len(events), 'columns': offsets,
+                           'side': [length, len(side)],
+                           'transforms': [jsonValue(list(step)) for step in
+                                          transformKey(track.transforms)]})
+            chunks.append(side)
+            length += len(side)
+
+        first = self.tracks[0]
+        metadata = json.dumps({
+            'format': self.header.numeric_format,
+            'ticks_per_quarternote': self.ticks_per_quarternote,
+            'numTracks': len(self.tracks) - (1 if self.header.numeric_format in (0, 1) else 0),
+            'removeDuplicates': first.remdep,
+            'deinterleave': first.deinterleave,
+            'removeRedundant': first.remove_redundant,
+            'adjust_origin': self.adjust_origin,
+            'eventtime_is_ticks': self.eventtime_is_ticks,
+            'polyphony': self.polyphony,
+            'polyphonyPerChannel': self.polyphonyPerChannel,
+            'stealPolicy': self.stealPolicy,
+            'types': [cls.evtname for cls in packedEventClasses],
+            'columns': [[name, dtype] for name, code, dtype in columnFormats],
+            'tracks': tracks}, sort_keys=True).encode('utf-8')
+        fileHandle.write(columnsHeader.pack(COLUMNS_MAGIC, 1, 0, len(metadata)))
+        fileHandle.write(metadata)
+        fileHandle.write(b"\0" * (-(columnsHeader.size + len(metadata)) % 8))
+        for chunk in chunks:
+            fileHandle.write(chunk)
+
+    def addTrackChunks(self, data, tracks=None, tempo_track=False):
+        '''
+        Copy track chunks, byte for byte, from an existing MIDI file.
+
+        :param data: The contents of a standard MIDI file (any bytes-like
+            object), or a file handle opened for binary reading.
+        :param tracks: Optional. The indices of the track chunks to copy, in
+            the order in which they should be added. Chunks are counted from
+            zero in the order they appear in the source file, so in a format 1
+            file chunk 0 is the tempo track. By default all the chunks of the
+            file are copied, except the tempo track of a format 1 file.
+        :param tempo_track: If set to ``True``, the first of the selected
+            chunks replaces the tempo track of this (format 1) file, rather
+            than that track being generated from the tempo and time signature
+            events added to it.
+
+        The events of the copied tracks are not parsed or re-encoded: the
+        chunks are sliced out of ``data`` and written as they are, after
+        a new header. This makes it cheap to bundle or re-order tracks of
+        files that have already been rendered. The copied tracks are added
+        after the existing tracks and can not be modified. As their times
+        can not be changed, the source must have the same resolution
+        (``ticks_per_quarternote``) as this file, and ``adjust_origin`` does
+        not apply to them.
+
+        Example:
+
+        .. code:: python
+
+            # Bundle the second track of one render with the tracks of
+            # another, under a new tempo track.
+            MyMIDI = MIDIFile(0)
+            MyMIDI.addTempo(0, 0, 96)
+            with open("strings.mid", "rb") as strings:
+                MyMIDI.addTrackChunks(strings, tracks=[2])
+            with open("brass.mid", "rb") as brass:
+                MyMIDI.addTrackChunks(brass)
+        '''
+        if self.header.numeric_format == 0:
+            raise ValueError("Track chunks can not be added to a format 0 file")
+        if hasattr(data, 'read'):
+            data = data.read()
+        file_format, division, chunks = readTrackChunks(data)
+        if division != self.ticks_per_quarternote:
+            raise ValueError("The file's resolution (%d) is not that of the "
+                             "MIDIFile (%d)" % (division,
+                                                self.ticks_per_quarternote))
+        if tracks is None:
+            tracks = range(1 if file_format == 1 else 0, len(chunks))
+        rawTracks = [RawTrack(chunks[index]) for index in tracks]
+        if tempo_track and self.header.numeric_format == 1 and rawTracks:
+            self.tracks[0] = rawTracks.pop(0)
+        self.tracks.extend(rawTracks)
+        self.numTracks = len(self.tracks)
+        self.header = MIDIHeader(self.numTracks, self.header.numeric_format,
+                                 self.ticks_per_quarternote)
+
+    def trackPayload(self, track):
+        '''
+        Return the events of a track packed into a compact binary string,
+        which can be added to another :class:`MIDIFile` with
+        :meth:`addTrackPayload`.
+
+        :param track: The track whose events are packed.
+
+        This is meant for building the tracks of a large file in several
+        processes: each worker builds its track in a :class:`MIDIFile` of
+        its own and returns the payload, which is much smaller than the
+        pickled events and quicker to make and to read. See
+        :func:`packEvents`: placed patterns are expanded into their events,
+        and annotations must be JSON values.
+
+        Example:
+
+        .. code:: python
+
+            def render(part):
+                worker = MIDIFile(1)
+                # ... add the events of the part to track 0 ...
+                return worker.trackPayload(0)
+
+            with multiprocessing.Pool() as pool:
+                payloads = pool.map(render, parts)
+            for track, payload in enumerate(payloads):
+                MyMIDI.addTrackPayload(track, payload)
+        '''
+        self.mergeWriters()
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        events = []
+        for event in self.tracks[track].eventList:
+            if event.evtname == 'Pattern':
+                events.extend(event.expand())
+            else:
+                events.append(event)
+        return packEvents(events, self.ticks_per_quarternote)
+
+    def addTrackPayload(self, track, payload):
+        '''
+        Add the events packed by :meth:`trackPayload` to a track.
+
+        :param track: The track to which the events are added.
+        :param payload: The packed events.
+
+        The events follow those already added to the file in insertion
+        order, keeping their order among themselves, so adding the payloads
+        in a fixed order gives the same file however the workers were
+        scheduled. The payload must have the resolution of this file.
+
+        If a track needs no more processing once it is built, a worker can
+        instead write a file of its own, which is added here with
+        :meth:`addTrackChunks`. That costs nothing per event, whereas the
+        events of a payload are rebuilt as objects.
+        '''
+        division, events = unpackEvents(payload)
+        if division and division != self.ticks_per_quarternote:
+            raise ValueError("The payload's resolution (%d) is not that of "
+                             "the MIDIFile (%d)" % (division,
+                                                    self.ticks_per_quarternote))
+        if len(events) == 0:
+            return
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        base = self.event_counter
+        for event in events:
+            event.insertion_order += base
+        self.event_counter = max(event.insertion_order for event in events) + 1
+        track = self.tracks[track]
+        track.unshare()
+        if track.closed:
+            track.reopen()
+        track.eventList.extend(events)
+
     def shiftTracks(self, offset=0):
         """Shift tracks to be zero-origined, or origined at offset.
 
@@ -1658,48 +3866,643 @@ class MIDIFile(object):
                         origin = event.tick
 
         for track in self.tracks:
+            if isinstance(track, RawTrack):
+                continue
             tempEventList = []
             # runningTick = 0
 
             for event in track.eventList:
                 adjustedTick = event.tick - origin
                 # event.time = adjustedTime - runningTick + tick_offset
+                # Events may be shared by forked tracks, so shift a copy.
+                event = copy.copy(event)
                 event.tick = adjustedTick + tick_offset
                 # runningTick = adjustedTick
                 tempEventList.append(event)
 
+            track.unshare()
             track.eventList = tempEventList
 
+    def fork(self):
+        '''
+        Return a copy of the MIDIFile which can be modified independently.
+
+        The copy shares its tracks with this object: a track's events (and,
+        if the file has been closed, its serialized data) are only copied
+        when one of the two files modifies that track. This makes it cheap to
+        generate many variants of one arrangement, as the cost is
+        proportional to the tracks that change rather than to the whole file.
+
+        Example:
+
+        .. code:: python
+
+            base = MIDIFile(4)
+            # ... add the arrangement ...
+            variant = base.fork()
+            variant.addNote(2, 0, 62, 8, 1, 100)  # only track 2 is copied
+
+        If the file has already been closed, modifying a track of the fork
+        re-opens that track, and only it is serialized again when the fork
+        is written.
+        '''
+        self.mergeWriters()
+        midi_file = copy.copy(self)
+        if not self.eventtime_is_ticks:
+            midi_file.time_to_ticks = midi_file.quarter_to_tick
+        midi_file.tracks = [track.fork() for track in self.tracks]
+        midi_file.writers = []
+        midi_file.writersLock = threading.Lock()
+        return midi_file
+
+    def addTransform(self, step):
+        '''
+        Record a transform step (see :func:`applyTransforms`) on every track,
+        to be applied when the file is closed, and return the file.
+        '''
+        self.mergeWriters()
+        for track in self.tracks:
+            if isinstance(track, RawTrack):
+                continue
+            track.transforms = track.transforms + (step,)
+            # The events of a pattern are transformed one by one.
+            track.expand_patterns = True
+            track.reopen()
+        return self
+
+    def transpose(self, semitones, channels=None):
+        '''
+        Transpose the notes when the file is closed.
+
+        :param semitones: The number of semitones by which the notes are
+            raised (or lowered, if negative).
+        :param channels: Optional. The channels transposed; all of them if
+            not given.
+
+        This, :meth:`scaleVelocity`, :meth:`filterChannels`, :meth:`quantize`
+        and :meth:`stretch` don't change the events: they record a transform
+        which is applied as the file is closed and written, and return the
+        file, so that they can be chained:
+
+        .. code:: python
+
+            MyMIDI.transpose(2).scaleVelocity(0.8).quantize(0.25)
+            MyMIDI.writeFile(output_file)
+
+        However many transforms are recorded, they are fused together and
+        applied in the single pass over each track's events which copies
+        them for writing. As the events are unchanged, the transforms can be
+        cleared with :meth:`clearTransforms`, and a :meth:`fork` can be given
+        transforms of its own. Notes transposed out of the range 0-127 are
+        left out. Tracks added with :meth:`addTrackChunks` are not
+        transformed.
+        '''
+        channels = None if channels is None else frozenset(channels)
+        return self.addTransform(('transpose', semitones, channels))
+
+    def scaleVelocity(self, factor, channels=None):
+        '''
+        Multiply the velocities of the notes by a factor when the file is
+        closed (see :meth:`transpose`). The velocities are rounded and kept
+        within the range 1-127.
+
+        :param factor: The factor by which the velocities are multiplied.
+        :param channels: Optional. The channels changed; all of them if not
+            given.
+        '''
+        channels = None if channels is None else frozenset(channels)
+        return self.addTransform(('scaleVelocity', factor, channels))
+
+    def filterChannels(self, channels):
+        '''
+        Leave out the channel events (notes, controller events and so on) of
+        every channel but those given when the file is closed (see
+        :meth:`transpose`).
+
+        :param channels: The channels kept.
+        '''
+        return self.addTransform(('filterChannels', frozenset(channels)))
+
+    def quantize(self, grid):
+        '''
+        Move the start of each note to the nearest multiple of a grid when
+        the file is closed (see :meth:`transpose`). The notes keep their
+        durations.
+
+        :param grid: The spacing of the grid, in beats (or ticks if
+            ``eventtime_is_ticks``).
+        '''
+        grid = self.time_to_ticks(grid)
+        if grid <= 0:
+            raise ValueError("The quantize grid must be at least one tick")
+        return self.addTransform(('quantize', grid))
+
+    def stretch(self, factor):
+        '''
+        Multiply the times of all the events (and the durations of the
+        notes) by a factor when the file is closed (see :meth:`transpose`).
+        The tempo is unchanged, so a factor of 2 makes the music last twice
+        as long.
+
+        :param factor: The factor by which the times are multiplied.
+        '''
+        if factor <= 0:
+            raise ValueError("The stretch factor must be positive")
+        return self.addTransform(('stretch', factor))
+
+    def quantizeNotes(self, track, grid, swing=0.0, strength=1.0):
+        '''
+        Move the notes of a track towards the nearest line of a grid, with
+        swing if required. Unlike :meth:`quantize` this changes the notes
+        now, and only those of one track.
+
+        :param track: The track whose notes are quantized.
+        :param grid: The spacing of the grid, in beats (or ticks if
+            ``eventtime_is_ticks``).
+        :param swing: Optional. The fraction of the grid spacing (from 0 to
+            1) by which every second line of the grid is delayed: 1/3 gives
+            the triplet swing of a jazz eighth note grid of 0.5.
+        :param strength: Optional. The fraction of the distance to the grid
+            line by which each note is moved. 1 (the default) puts the notes
+            on the grid.
+
+        The notes keep their durations. The ticks of all the notes are
+        taken as one array, moved together, and the notes and their note
+        offs replaced in a single pass over the event list. Notes added as
+        part of a :class:`MIDIPattern` are not moved.
+        '''
+        grid = self.time_to_ticks(grid)
+        if grid <= 0:
+            raise ValueError("The quantize grid must be at least one tick")
+        if not 0 <= swing < 1:
+            raise ValueError("swing must be at least 0 and less than 1")
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        notes, ticks, durations, volumes = self.tracks[track].noteColumns()
+        pair = 2 * grid
+        offbeat = grid + swing * grid
+        # The nearest of the lines at the start of the pair of grid spaces
+        # holding the tick, the delayed line within it, and the start of the
+        # next pair.
+        lines = [min((tick // pair * pair, tick // pair * pair + offbeat,
+                      (tick // pair + 1) * pair), key=lambda line: abs(line - tick))
+                 for tick in ticks]
+        moved = array.array('l', [int(round(tick + (line - tick) * strength))
+                                  for tick, line in zip(ticks, lines)])
+        self.tracks[track].replaceNotes(notes, moved, durations, volumes)
+
+    def humanizeNotes(self, track, timing=0.0, velocity=0.0, seed=0):
+        '''
+        Add random variations to the times and the volumes of the notes of a
+        track.
+
+        :param track: The track whose notes are changed.
+        :param timing: Optional. The standard deviation of the change in the
+            time of each note, in beats (or ticks if ``eventtime_is_ticks``).
+        :param velocity: Optional. The standard deviation of the change in the
+            volume of each note.
+        :param seed: Optional. The seed of the random number generator. The
+            same seed always gives the same result, so renders are
+            reproducible.
+
+        The changes are drawn from normal distributions, rounded, and kept
+        within range (times from 0, volumes from 1 to 127). The notes keep
+        their durations. As with :meth:`quantizeNotes`, the notes are taken
+        as columns and replaced in one pass.
+        '''
+        if self.header.numeric_format in (0, 1):
+            track += 1
+        if not self.eventtime_is_ticks:
+            timing *= self.ticks_per_quarternote
+        notes, ticks, durations, volumes = self.tracks[track].noteColumns()
+        generator = random.Random(seed)
+        gauss = generator.gauss
+        if timing:
+            ticks = array.array('l', [max(int(round(tick + gauss(0, timing))), 0)
+                                      for tick in ticks])
+        if velocity:
+            volumes = array.array('l', [min(max(int(round(volume +
+                                                          gauss(0, velocity))),
+                                                1), 127)
+                                        for volume in volumes])
+        self.tracks[track].replaceNotes(notes, ticks, durations, volumes)
+
+    def clearTransforms(self):
+        '''
+        Discard the transforms recorded by :meth:`transpose` and the like,
+        and return the file.
+        '''
+        for track in self.tracks:
+            if isinstance(track, RawTrack) or not track.transforms:
+                continue
+            track.transforms = ()
+            track.expand_patterns = self.polyphony is not None
+            track.reopen()
+        return self
+
+    def slice(self, start, end, notes='truncate'):
+        '''
+        Return a new MIDIFile holding the part of this one from time start up
+        to (but not including) end, moved to the beginning of the file.
+
+        :param start: The start of the slice, in beats (or ticks if
+            ``eventtime_is_ticks``).
+        :param end: The end of the slice.
+        :param notes: What to do with notes which cross the ends of the
+            slice: ``'truncate'`` (the default) shortens them to fit,
+            ``'keep'`` keeps whole the notes which start in the slice and
+            leaves out those which start before it, and ``'drop'`` leaves out
+            all of them.
+
+        The tempo, time and key signatures, track names, and the programs,
+        controller values, pitch wheel and channel pressure of each channel
+        in effect at ``start`` are copied to the beginning of the slice, so
+        that it plays as the same passage of the whole file would. Other
+        events from before ``start`` (text, system exclusive messages) are
+        not.
+
+        Each track keeps its events sorted by time once it has been sliced,
+        so cutting several slices from a file that is not modified in
+        between costs time in proportion to the size of each slice, rather
+        than to that of the file. The new file has the same options as this
+        one. Tracks added with :meth:`addTrackChunks` can't be sliced.
+        '''
+        self.mergeWriters()
+        start = self.time_to_ticks(start)
+        end = self.time_to_ticks(end)
+        if any(isinstance(track, RawTrack) for track in self.tracks):
+            raise ValueError("Tracks added with addTrackChunks can't be sliced")
+        midi_file = copy.copy(self)
+        if not self.eventtime_is_ticks:
+            midi_file.time_to_ticks = midi_file.quarter_to_tick
+        midi_file.tracks = []
+        for track in self.tracks:
+            sliced = MIDITrack(track.remdep, track.deinterleave,
+                               track.remove_redundant)
+            sliced.expand_patterns = track.expand_patterns
+            sliced.transforms = track.transforms
+            sliced.eventList = track.slice(start, end, notes)
+            midi_file.tracks.append(sliced)
+        midi_file.header = copy.copy(self.header)
+        midi_file.mergedTrack = None
+        midi_file.closed = False
+        midi_file.writers = []
+        midi_file.writersLock = threading.Lock()
+        midi_file.stolenNotes = 0
+        return midi_file
+
+    def resample(self, ticks_per_quarternote, rounding='nearest'):
+        '''
+        Return a new MIDIFile holding the same events as this one at a
+        different resolution.
+
+        :param ticks_per_quarternote: The resolution of the new file.
+        :param rounding: Optional. How times which fall between the ticks
+            of the new resolution are rounded: ``'nearest'`` (the default,
+            with halves rounded up), ``'floor'`` or ``'ceil'``.
+
+        The times of the events of each track are converted together, as one
+        array of integers, so the conversion is exact when the new resolution
+        is a multiple of the old one. At a lower resolution events at
+        different times may land on the same tick, and notes may become
+        shorter or vanish. The new file's ``collisions`` attribute lists
+        them: it holds a tuple ``(track, tick, events)`` for each such tick,
+        where ``track`` is the index of the track in ``tracks`` (in formats
+        0 and 1 ``tracks[0]`` holds the tempo events) and ``events`` are the
+        events on the tick. This file is unchanged, so one arrangement can be
+        delivered at several resolutions:
+
+        .. code:: python
+
+            for resolution in (96, 480, 960):
+                with open("song-%d.mid" % resolution, "wb") as output_file:
+                    MyMIDI.resample(resolution).writeFile(output_file)
+
+        Tracks added with :meth:`addTrackChunks` can't be resampled.
+        '''
+        self.mergeWriters()
+        if any(isinstance(track, RawTrack) for track in self.tracks):
+            raise ValueError("Tracks added with addTrackChunks can't be resampled")
+        old = self.ticks_per_quarternote
+        new = ticks_per_quarternote
+        midi_file = copy.copy(self)
+        midi_file.ticks_per_quarternote = new
+        if not self.eventtime_is_ticks:
+            midi_file.time_to_ticks = midi_file.quarter_to_tick
+        midi_file.header = copy.copy(self.header)
+        midi_file.header.ticks_per_quarternote = struct.pack('>H', new)
+        midi_file.tracks = []
+        midi_file.collisions = []
+        for index, track in enumerate(self.tracks):
+            resampled = MIDITrack(track.remdep, track.deinterleave,
+                                  track.remove_redundant)
+            resampled.expand_patterns = track.expand_patterns
+            resampled.transforms = tuple(
+                ('quantize', max(resampleTicks([step[1]], old, new, rounding)[0], 1))
+                if step[0] == 'quantize' else step for step in track.transforms)
+            resampled.eventList, collisions = track.resample(old, new, rounding)
+            midi_file.tracks.append(resampled)
+            midi_file.collisions.extend((index, tick, events)
+                                        for tick, events in collisions)
+        midi_file.mergedTrack = None
+        midi_file.closed = False
+        midi_file.writers = []
+        midi_file.writersLock = threading.Lock()
+        midi_file.stolenNotes = 0
+        return midi_file
+
+    def concurrentWriter(self):
+        '''
+        Return an object through which one thread can add events to the
+        file while other threads do the same.
+
+        The writer has the ``add`` methods of :class:`MIDIFile` (``addNote``,
+        ``addControllerEvent``, ``addPattern`` and so on), and the same
+        tracks and time units, but it keeps the events in buffers of its own
+        and counts insertion order by itself, so no locking is needed while
+        events are added. When the file is closed the buffers of all the
+        writers are moved into the tracks, each writer taking the next range
+        of insertion orders in the order in which the writers were created.
+
+        The file written therefore does not depend on how the threads were
+        scheduled, provided that the writers are created in a fixed order
+        (for instance, all of them before the threads are started). It is the
+        same file as would be obtained by adding all the events of the first
+        writer, then all those of the second, and so on.
+
+        Example:
+
+        .. code:: python
+
+            writers = [MyMIDI.concurrentWriter() for part in parts]
+            threads = [threading.Thread(target=render, args=(part, writer))
+                       for part, writer in zip(parts, writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            MyMIDI.close()
+
+        A writer should only be used by one thread at a time, and not while
+        the file is being closed. Patterns placed from several threads should
+        be closed first (``len(pattern)`` does that), as closing one is not
+        thread-safe. A writer only adds events: everything else (closing,
+        writing, forking and so on) is done on the file itself.
+
+        The writers make adding events from several threads safe, not
+        faster. Under CPython's global interpreter lock only one thread runs
+        at a time, so the threads together add notes at about the rate of a
+        single thread. To use several cores, build the tracks in processes
+        and add them with :meth:`addTrackPayload` or :meth:`addTrackChunks`.
+        ``examples/writer-benchmark.py`` measures both.
+        '''
+        if self.writers is None:
+            raise ValueError("A concurrent writer only adds events; this is "
+                             "done with its MIDIFile")
+        writer = copy.copy(self)
+        if not self.eventtime_is_ticks:
+            writer.time_to_ticks = writer.quarter_to_tick
+        writer.tracks = [MIDITrack(track.remdep, track.deinterleave,
+                                   track.remove_redundant)
+                         for track in self.tracks]
+        writer.event_counter = 0
+        writer.writers = None
+        with self.writersLock:
+            self.writers.append(writer)
+        return writer
+
+    def mergeWriters(self):
+        '''
+        Move the events added through the concurrent writers into the
+        tracks. Called on close, and by everything that reads the events.
+        '''
+        if self.writers is None:
+            raise ValueError("A concurrent writer only adds events; this is "
+                             "done with its MIDIFile")
+        for writer in self.writers:
+            base = self.event_counter
+            for track, buffer in zip(self.tracks, writer.tracks):
+                events, buffer.eventList = buffer.eventList, []
+                if len(events) == 0:
+                    continue
+                # The events belong to the writer alone, so they can be
+                # renumbered in place.
+                for event in events:
+                    event.insertion_order += base
+                track.unshare()
+                if track.closed:
+                    track.reopen()
+                track.eventList.extend(events)
+            self.event_counter += writer.event_counter
+            writer.event_counter = 0
+
     # End Public Functions ########################
 
-    def close(self):
+    def close(self, cache=None):
         '''
         Close the MIDIFile for further writing.
 
         To close the File for events, we must close the tracks, adjust the time
         to be zero-origined, and have the tracks write to their MIDI Stream
         data structure.
+
+        :param cache: Optional. A :class:`RenderCache` in which the data of
+            each track are looked up by the track's fingerprint, and stored
+            if they are not found. This is only done if the tracks are
+            independent of each other (``adjust_origin`` is off and there is
+            no ``polyphony`` limit).
         '''
 
-        if self.closed:
+        self.mergeWriters()
+
+        if self.header.numeric_format == 0:
+            self.closeMerged()
             return
 
-        for i in range(0, self.numTracks):
-            self.tracks[i].closeTrack()
+        # Only the tracks which have not been written need processing. In a
+        # forked file, tracks shared with the parent keep their data.
+        tracks = [track for track in self.tracks if len(track.MIDIdata) == 0]
+        if self.closed and len(tracks) == 0:
+            return
+
+        independent = not (self.adjust_origin or self.polyphony is not None or
+                           self.sharesChannelState())
+        if not independent and len(tracks) < self.numTracks:
+            # The origin may have moved, or the tracks share voices or
+            # channel state, so everything is written again.
+            for track in self.tracks:
+                track.reopen()
+            tracks = self.tracks
+
+        misses = []
+        if cache is not None and independent:
+            pending = []
+            for track in tracks:
+                key = 'track-' + track.fingerprint()
+                data = cache.get(key)
+                if data is None:
+                    pending.append(track)
+                    misses.append((track, key))
+                else:
+                    track.MIDIEventList = []
+                    track.MIDIdata = data
+                    track.dataLength = struct.pack('>L', len(data))
+                    track.closed = True
+            tracks = pending
+
+        for track in tracks:
+            track.closeTrack()
             # We want things like program changes to come before notes when
             # they are at the same time, so we sort the MIDI events by both
             # their start time and a secondary ordinality defined for each kind
             # of event.
-            self.tracks[i].MIDIEventList.sort(key=sort_events)
+            track.MIDIEventList.sort(key=sort_events)
 
+        self.removeRedundantEvents(tracks)
+        self.limitPolyphony()
         origin = self.findOrigin()
 
-        for i in range(0, self.numTracks):
-            self.tracks[i].adjustTimeAndOrigin(origin, self.adjust_origin)
-            self.tracks[i].writeMIDIStream()
+        for track in tracks:
+            track.adjustTimeAndOrigin(origin, self.adjust_origin)
+            track.writeMIDIStream()
+        for track, key in misses:
+            cache.put(key, bytes(bytearray(track.MIDIdata)))
 
         self.closed = True
 
+    def closeMerged(self):
+        '''
+        Close a format 0 file, merging all the tracks into one.
+
+        Each track is closed (which leaves its MIDIEventList sorted), and the
+        sorted lists are merged lazily and serialized as they are merged.
+        '''
+
+        if self.closed and all(track.closed for track in self.tracks):
+            return
+
+        # The tracks are written as one stream, so a pattern which
+        # interleaves with the events of another track is expanded too.
+        for track in self.tracks:
+            if track.closed or not any(event.evtname == 'Pattern'
+                                       for event in track.eventList):
+                continue
+            foreign = []
+            for other in self.tracks:
+                if other is track:
+                    continue
+                for event in other.eventList:
+                    if event.evtname == 'Pattern':
+                        foreign.extend(event.expand())
+                    else:
+                        foreign.append(event)
+            foreign.sort(key=sort_events)
+            track.resolvePatterns(foreign)
+
+        for track in self.tracks:
+            track.closeTrack()
+            track.MIDIEventList.sort(key=sort_events)
+
+        self.removeRedundantEvents(self.tracks)
+        self.limitPolyphony()
+        origin = self.findOrigin() if self.adjust_origin else 0
+
+        self.mergedTrack = MIDITrack(False, False)
+        self.mergedTrack.writeMergedStream([track.MIDIEventList
+                                            for track in self.tracks], origin)
+        self.closed = True
+
+    def sharesChannelState(self):
+        '''
+        Return ``True`` if the redundant events of a track depend on the
+        other tracks: in a format 0 or 1 file the tracks play on the same
+        channels, so another track may change a value in between.
+        '''
+        return (self.header.numeric_format != 2 and
+                any(track.remove_redundant for track in self.tracks))
+
+    def removeRedundantEvents(self, tracks):
+        '''
+        Remove the events which don't change anything from the closed and
+        sorted tracks given, if the file was created with
+        ``removeRedundant=True``. Called on close.
+
+        In a format 0 or 1 file the state of the channels is followed across
+        all the tracks together (so the tracks given are all of them). Copied
+        track chunks (see :meth:`addTrackChunks`) may change any channel, so
+        nothing is removed from a file which has them.
+        '''
+        tracks = [track for track in tracks if track.remove_redundant]
+        if not tracks:
+            return
+        if self.header.numeric_format == 2:
+            for track in tracks:
+                track.removeRedundantEvents()
+            return
+        if any(isinstance(track, RawTrack) for track in self.tracks):
+            for track in tracks:
+                track.redundantCounts = {}
+            return
+        counts = dropRedundantEvents([track.MIDIEventList for track in tracks])
+        for track, trackCounts in zip(tracks, counts):
+            track.redundantCounts = trackCounts
+
+    def limitPolyphony(self):
+        '''
+        Steal the voices of notes beyond the ``polyphony`` limit, if there is
+        one. Called on close, after the tracks are closed and sorted.
+        '''
+        if self.polyphony is None:
+            return
+        self.stolenNotes = stealNotes([track.MIDIEventList
+                                       for track in self.tracks],
+                                      self.polyphony, self.polyphonyPerChannel,
+                                      self.stealPolicy)
+
+    def fingerprint(self):
+        '''
+        Return a digest (a hex string) of everything that determines the
+        file written: the header, the options that affect processing, and
+        the events of each track.
+
+        Two files with the same fingerprint write the same data, so it can
+        be used as the key of a cache of rendered files. Annotations are not
+        included, as they are not written. The fingerprints of the tracks
+        (see :meth:`MIDITrack.fingerprint`) are kept up to date as events are
+        added, so asking for the fingerprint again only costs the events
+        added since. Note that closing the file changes the fingerprint, as
+        duplicate events are removed.
+        '''
+        self.mergeWriters()
+        digest = hashlib.sha1(repr((self.header.numeric_format,
+                                    self.ticks_per_quarternote,
+                                    len(self.tracks), self.adjust_origin,
+                                    self.polyphony, self.polyphonyPerChannel,
+                                    self.stealPolicy)).encode('utf-8'))
+        for track in self.tracks:
+            digest.update(track.fingerprint().encode('utf-8'))
+        return digest.hexdigest()
+
+    def redundantEventCounts(self):
+        '''
+        Return the number of redundant events removed when the file was
+        closed.
+
+        The result is a dict keyed by event name (``'ControllerEvent'``,
+        ``'ProgramChange'``, ``'PitchWheelEvent'`` and ``'Tempo'``). Events
+        are only removed if the MIDIFile was created with
+        ``removeRedundant=True``. An event is redundant if it sets a value
+        (a controller, the program or the pitch wheel of its channel, or the
+        tempo) to the value it already has. In a format 0 or 1 file the
+        values are followed across all the tracks, as they share the
+        channels; in a format 2 file each track is on its own.
+        '''
+        counts = {}
+        for track in self.tracks:
+            for evtname, count in track.redundantCounts.items():
+                counts[evtname] = counts.get(evtname, 0) + count
+        return counts
+
     def findOrigin(self):
         '''
         Find the earliest time in the file's tracks.append.
@@ -1720,6 +4523,466 @@ class MIDIFile(object):
         return origin
 
 
+class RenderCache(object):
+    '''
+    A directory of rendered MIDI data, keyed by fingerprint, which
+    :meth:`MIDIFile.writeFile` can consult so that identical files (or
+    tracks) are not processed again.
+
+    The size of the directory is bounded: when data are stored, the entries
+    used least recently are removed until the total is at most ``maxBytes``.
+    Entries are written atomically (to a temporary file which is then
+    renamed), so several processes can share a cache.
+    '''
+
+    def __init__(self, directory, maxBytes=256 * 2 ** 20):
+        '''Initialize the RenderCache class
+
+        :param directory: The directory in which the entries are stored. It
+            is created if it does not exist.
+        :param maxBytes: The largest total size of the entries.
+
+        The number of lookups that found an entry, and that did not, are
+        counted in ``hits`` and ``misses``.
+        '''
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.mid')
+
+    def get(self, key):
+        '''
+        Return the data stored under key, or ``None``. An entry that is found
+        is marked as used.
+        '''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        '''
+        Store data under key, and remove the least recently used entries if
+        the cache has grown too large.
+        '''
+        # The name of the temporary file is unique to this write, whichever
+        # process or thread makes it.
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', prefix='.' + key,
+                                             dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as entry:
+                entry.write(data)
+            getattr(os, 'replace', os.rename)(temporary, self.path(key))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the total size is at
+        most ``maxBytes``.
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.mid'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue  # removed by another process
+            entries.append((status.st_mtime, status.st_size, path))
+            total += status.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class ChannelAllocator(object):
+    '''
+    Place microtonal notes on a :class:`MIDIFile` by giving each sounding
+    note a channel of its own and bending that channel to the exact pitch.
+
+    This is the usual way of playing microtonal music on synthesizers that
+    do not support the MIDI Tuning Standard (it is also how MPE controllers
+    work). Each note is assigned a free channel from a pool, and a pitch
+    wheel event is written on that channel just before the NoteOn.
+
+    Channels are reused in least-recently-released order, so that the
+    release tail of a note is disturbed by a new pitch bend as late as
+    possible. Free and busy channels are kept in priority queues, so
+    allocation is O(log n) in the size of the pool.
+    '''
+
+    def __init__(self, midi_file, track, channels=None, pitchBendRange=2):
+        '''Initialize the ChannelAllocator class
+
+        :param midi_file: The :class:`MIDIFile` to which notes are added.
+        :param track: The track to which notes are added.
+        :param channels: The channels that may be allocated. The default is
+            all channels but channel 9 (percussion).
+        :param pitchBendRange: The pitch bend range of the synthesizer, in
+            semitones. It can be set on the synthesizer with
+            :meth:`addPitchBendRange`. Must be at least 0.5.
+
+        Notes must be added in order of start time. If more notes sound at
+        once than there are channels in the pool a ``ValueError`` is raised.
+        A channel released at the very time a note starts may be reused
+        straight away; its pitch wheel event then sorts after the NoteOff
+        of the previous note, so that the bend does not reach the end of
+        that note.
+
+        Example:
+
+        .. code::
+
+            allocator = ChannelAllocator(MyMIDI, 0)
+            allocator.addPitchBendRange(0)
+            # A 7-limit harmonic seventh above middle C
+            allocator.addNote(60, 0, 4, 100)
+            allocator.addNote(60 + 12 * math.log(7 / 4, 2), 0, 4, 100)
+        '''
+        if channels is None:
+            channels = [channel for channel in range(16) if channel != 9]
+        if len(channels) == 0:
+            raise ValueError("At least one channel is needed")
+        if pitchBendRange < 0.5:
+            raise ValueError("pitchBendRange must be at least 0.5 semitones")
+        self.midi_file = midi_file
+        self.track = track
+        self.channels = list(channels)
+        self.pitchBendRange = pitchBendRange
+        # Entries are (release tick, sequence, channel). Channels that were
+        # never used sort first, in the order given.
+        self.free = [(-1, i, channel) for i, channel in enumerate(self.channels)]
+        self.busy = []
+        self.bends = {}
+        self.sequence = len(self.channels)
+        self.last_tick = 0
+
+    def pitchWheelValue(self, pitch):
+        '''
+        Return the nearest MIDI note number to a fractional pitch, and the
+        pitch wheel value that bends it to that pitch.
+        '''
+        nearest = int(math.floor(pitch + 0.5))
+        value = int(round((pitch - nearest) * 8192 / self.pitchBendRange))
+        return nearest, max(-8192, min(8191, value))
+
+    def addNote(self, pitch, time, duration, volume, annotation=None):
+        '''
+        Add a note, allocating it a channel.
+
+        :param pitch: The pitch, as a fractional MIDI note number, 60.5 being
+            a quarter tone above middle C [Float].
+        :param time: The time at which the note sounds, in the units of the
+            :class:`MIDIFile`.
+        :param duration: The duration of the note.
+        :param volume: The volume (velocity) of the note. [Integer, 0-127].
+        :param annotation: Arbitrary data to attach to the note.
+
+        Returns the channel on which the note was placed. The pitch wheel
+        event is only written if the channel is not already bent by the
+        right amount.
+        '''
+        tick = self.midi_file.time_to_ticks(time)
+        if tick < self.last_tick:
+            raise ValueError("Notes must be added in order of start time")
+        self.last_tick = tick
+        end = tick + self.midi_file.time_to_ticks(duration)
+
+        busy = self.busy
+        free = self.free
+        while busy and busy[0][0] <= tick:
+            heapq.heappush(free, heapq.heappop(busy))
+        if not free:
+            raise ValueError("More than %d notes sound at time %s"
+                             % (len(self.channels), time))
+        released, sequence, channel = heapq.heappop(free)
+        heapq.heappush(busy, (end, self.sequence, channel))
+        self.sequence += 1
+
+        nearest, value = self.pitchWheelValue(pitch)
+        if self.bends.get(channel) != value:
+            self.bends[channel] = value
+            if released == tick:
+                # The previous note on the channel ends now: bend after its
+                # NoteOff (and before the NoteOn, which sorts after both).
+                midi_file = self.midi_file
+                track = self.track
+                if midi_file.header.numeric_format in (0, 1):
+                    track += 1
+                midi_file.tracks[track].addPitchWheelEvent(
+                    channel, tick, value, insertion_order=midi_file.event_counter,
+                    sec_sort_order=NoteOff.sec_sort_order)
+                midi_file.event_counter += 1
+            else:
+                self.midi_file.addPitchWheelEvent(self.track, channel, time, value)
+        self.midi_file.addNote(self.track, channel, nearest, time, duration,
+                               volume, annotation=annotation)
+        return channel
+
+    def addPitchBendRange(self, time):
+        '''
+        Set the pitch bend range of every channel in the pool to
+        ``pitchBendRange``, with an RPN call on each channel.
+
+        :param time: The time at which the calls are placed.
+        '''
+        semitones = int(self.pitchBendRange)
+        cents = int(round((self.pitchBendRange - semitones) * 100))
+        for channel in self.channels:
+            self.midi_file.makeRPNCall(self.track, channel, time, 0, 0,
+                                       semitones, cents, time_order=True)
+
+
+def readColumns(fileHandle):
+    '''
+    Read a file written by :meth:`MIDIFile.writeColumns` and return a
+    :class:`MIDIFile` holding its events, with the options it was written
+    with.
+
+    :param fileHandle: A file opened for binary reading, or the contents of
+        one (any bytes-like object). A file on disk is memory-mapped rather
+        than read.
+
+    The events of each track are made in one pass over its columns.
+    '''
+    if not hasattr(fileHandle, 'read'):
+        return columnsFile(memoryview(fileHandle))
+    try:
+        mapped = mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError,
+            io.UnsupportedOperation):
+        return columnsFile(memoryview(fileHandle.read()))
+    try:
+        return columnsFile(memoryview(mapped))
+    finally:
+        mapped.close()
+
+
+def columnsFile(view):
+    '''
+    Return the :class:`MIDIFile` of :func:`readColumns`, from a
+    ``memoryview`` of the data.
+    '''
+    if (len(view) < columnsHeader.size or
+            view[0:4].tobytes() != COLUMNS_MAGIC):
+        raise ValueError("The data are not a MIDIUtil column file")
+    magic, version, reserved, length = columnsHeader.unpack_from(view, 0)
+    if version != 1:
+        raise ValueError("Unknown column file version %d" % version)
+    offset = columnsHeader.size
+    metadata = json.loads(view[offset:offset + length].tobytes().decode('utf-8'))
+    offset += length
+    base = offset + (-offset % 8)
+
+    midi_file = MIDIFile(metadata['numTracks'],
+                         removeDuplicates=metadata['removeDuplicates'],
+                         deinterleave=metadata['deinterleave'],
+                         adjust_origin=metadata['adjust_origin'],
+                         file_format=metadata['format'],
+                         ticks_per_quarternote=metadata['ticks_per_quarternote'],
+                         eventtime_is_ticks=metadata['eventtime_is_ticks'],
+                         removeRedundant=metadata['removeRedundant'],
+                         polyphony=metadata['polyphony'],
+                         polyphonyPerChannel=metadata['polyphonyPerChannel'],
+                         stealPolicy=metadata['stealPolicy'])
+    classes = dict((cls.evtname, cls) for cls in packedEventClasses)
+    types = [classes[name] for name in metadata['types']]
+    counter = 0
+    for track, layout in zip(midi_file.tracks, metadata['tracks']):
+        count = layout['count']
+        columns = {}
+        for name, code, dtype in columnFormats:
+            columns[name] = mappedColumn(view, code,
+                                         base + layout['columns'][name], count)
+        start, length = layout['side']
+        start += base
+        side = json.loads(view[start:start + length].tobytes().decode('utf-8'),
+                          object_hook=fromJsonValue)
+        try:
+            track.eventList = tableEvents(types, columns, side)
+            order = max(columns['order']) if count else -1
+        finally:
+            # The views must be released before the file is unmapped.
+            for column in columns.values():
+                if isinstance(column, memoryview):
+                    column.release()
+        track.transforms = tuple(
+            tuple(frozenset(part) if isinstance(part, list) else part
+                  for part in step) for step in layout['transforms'])
+        if track.transforms:
+            track.expand_patterns = True
+        counter = max(counter, order + 1)
+    midi_file.event_counter = counter
+    return midi_file
+
+
+def mappedColumn(view, code, start, count):
+    '''
+    Return a column of ``count`` little-endian values of an ``array`` type
+    code from a ``memoryview`` of a column file. On a little-endian machine
+    this is a cast of the view, so the data are not copied; otherwise (or on
+    Python 2) the values are copied into an ``array``.
+    '''
+    data = view[start:start + count * array.array(code).itemsize]
+    if sys.byteorder == 'little' and hasattr(data, 'cast'):
+        return data.cast(code)
+    column = arrayFromBytes(code, data.tobytes())
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def mergeMIDIFiles(midi_files, track_map=None, channel_map=None,
+                   ticks_per_quarternote=None):
+    '''
+    Merge several MIDIFile objects into a new one.
+
+    :param midi_files: A list of :class:`MIDIFile` objects. They are not
+        modified.
+    :param track_map: Optional. A list with an entry for each file, each of
+        which is either ``None`` or a list giving the destination track of
+        each of the file's tracks (or ``None`` to drop a track). By default
+        the tracks of each file follow those of the previous file.
+    :param channel_map: Optional. A list with an entry for each file, each of
+        which is either ``None`` or a dict mapping source channels to
+        destination channels. Channels not in the dict are unchanged.
+    :param ticks_per_quarternote: The resolution of the new file. Defaults to
+        the highest resolution of the files being merged; events of files
+        with another resolution are rescaled (and rounded) to it. The end of
+        a note is rescaled as its :class:`NoteOff` is, so that the two still
+        meet.
+
+    Track numbers are the same as the ones used to add events: in a format 0
+    or 1 file the tempo track is not counted, and the tempo tracks of all such
+    files are merged into the tempo track of the new file. The new
+    file takes its format and other settings from the first file. The
+    transforms recorded on the files (see :meth:`MIDIFile.transpose`) are
+    applied to their events as they are merged. Files with tracks copied by
+    :meth:`MIDIFile.addTrackChunks` can't be merged.
+
+    The events of each source track are sorted (which, as they are usually
+    added in time order, is close to linear) and the tracks that map to the
+    same destination are combined with a heap-based k-way merge. Events at
+    the same time and with the same secondary sort order keep the order in
+    which they were added to their file, and events from earlier files come
+    first, so the result is the same as if all the events had been added to
+    one file, file by file.
+
+    Example:
+
+    .. code:: python
+
+        # Put the single track of a drum stem on channel 9 of track 1
+        mix = mergeMIDIFiles([melody, drums], track_map=[None, [1]],
+                             channel_map=[None, {0: 9}])
+    '''
+    for midi_file in midi_files:
+        midi_file.mergeWriters()
+        if any(isinstance(track, RawTrack) for track in midi_file.tracks):
+            raise ValueError("Tracks added with addTrackChunks can't be "
+                             "merged")
+    first = midi_files[0]
+    if ticks_per_quarternote is None:
+        ticks_per_quarternote = max(midi_file.ticks_per_quarternote
+                                    for midi_file in midi_files)
+    file_format = first.header.numeric_format
+    tempo_tracks = 1 if file_format in (0, 1) else 0
+
+    # The insertion orders of each file are moved past those of the files
+    # before it, so that a note and its NoteOff keep a shared order and the
+    # events of a file keep their relative order.
+    offsets = []
+    event_counter = 0
+    for midi_file in midi_files:
+        offsets.append(event_counter)
+        event_counter += midi_file.event_counter
+
+    def decorated(track, file_index, scale, channels):
+        # Yield the events of a track, changed as needed, in sorted order with
+        # the merge key in front.
+        offset = offsets[file_index]
+        events = track.eventList
+        if scale != 1 or channels or track.transforms:
+            events = track.playedEvents()
+        events = sorted(events, key=sort_events)
+        for sequence, event in enumerate(events):
+            key = (event.tick, event.sec_sort_order, file_index,
+                   event.insertion_order, sequence)
+            event = copy.copy(event)
+            event.insertion_order += offset
+            if scale != 1:
+                if event.evtname == 'NoteOn':
+                    # The end is scaled as the tick of the NoteOff is
+                    end = int(round((event.tick + event.duration) * scale))
+                    event.tick = int(round(event.tick * scale))
+                    event.duration = end - event.tick
+                else:
+                    event.tick = int(round(event.tick * scale))
+            if channels and getattr(event, 'channel', None) in channels:
+                event.channel = channels[event.channel]
+            yield key + (event,)
+
+    sources = {}  # destination index in tracks -> decorated event streams
+    numTracks = 0
+    for file_index, midi_file in enumerate(midi_files):
+        scale = ticks_per_quarternote / midi_file.ticks_per_quarternote
+        channels = channel_map[file_index] if channel_map else None
+        user_tracks = midi_file.tracks
+        if midi_file.header.numeric_format in (0, 1):
+            stream = decorated(midi_file.tracks[0], file_index, scale, channels)
+            sources.setdefault(0, []).append(stream)
+            user_tracks = midi_file.tracks[1:]
+        mapping = track_map[file_index] if track_map else None
+        if mapping is None:
+            mapping = range(numTracks, numTracks + len(user_tracks))
+        for track, destination in zip(user_tracks, mapping):
+            if destination is None:
+                continue
+            numTracks = max(numTracks, destination + 1)
+            stream = decorated(track, file_index, scale, channels)
+            sources.setdefault(destination + tempo_tracks, []).append(stream)
+
+    midi_file = MIDIFile(max(numTracks, 1),
+                         removeDuplicates=first.tracks[0].remdep,
+                         deinterleave=first.tracks[0].deinterleave,
+                         removeRedundant=first.tracks[0].remove_redundant,
+                         adjust_origin=first.adjust_origin,
+                         file_format=file_format,
+                         ticks_per_quarternote=ticks_per_quarternote,
+                         eventtime_is_ticks=first.eventtime_is_ticks)
+
+    midi_file.event_counter = event_counter
+    for destination in sorted(sources):
+        eventList = midi_file.tracks[destination].eventList
+        for entry in heapq.merge(*sources[destination]):
+            eventList.append(entry[-1])
+
+    return midi_file
+
+
 def writeVarLength(i):
     '''
     Accept an integer, and serialize it as a MIDI file variable length quantity
@@ -1776,12 +5039,1070 @@ def readVarLength(offset, buffer):
     return (output, bytesRead)
 
 
+def readTrackChunks(data):
+    '''
+    Locate the track chunks of a standard MIDI file.
+
+    It returns a tuple of the file's format, its division (ticks per quarter
+    note), and a list with the data of each MTrk chunk. The data are
+    ``memoryview`` slices of the input, so no bytes are copied. Chunks of other
+    types are skipped, as the standard requires.
+    '''
+    view = memoryview(data)
+    if len(view) < 14 or view[0:4].tobytes() != b'MThd':
+        raise ValueError("The data are not a standard MIDI file")
+    headerLength = struct.unpack_from('>L', view, 4)[0]
+    file_format, numTracks, division = struct.unpack_from('>HHH', view, 8)
+
+    chunks = []
+    offset = 8 + headerLength
+    while offset + 8 <= len(view):
+        chunkType = view[offset:offset + 4].tobytes()
+        chunkLength = struct.unpack_from('>L', view, offset + 4)[0]
+        offset += 8
+        if offset + chunkLength > len(view):
+            raise ValueError("The data end inside a chunk: %d bytes were "
+                             "declared, %d are left" %
+                             (chunkLength, len(view) - offset))
+        if chunkType == b'MTrk':
+            chunks.append(view[offset:offset + chunkLength])
+        offset += chunkLength
+    return (file_format, division, chunks)
+
+
+# The event classes that can be stored in a packed event list. The index of
+# a class in this list is its code in the packed data, so new classes must
+# be added at the end.
+packedEventClasses = [NoteOn, NoteOff, ControllerEvent, PitchWheelEvent,
+                      ProgramChange, ChannelPressureEvent, Tempo,
+                      TimeSignature, KeySignature, TrackName, Text, Copyright,
+                      SysExEvent, UniversalSysExEvent, PatternEvent]
+# The attributes of the events with columns, built from the packed tick,
+# insertion order and column values. Building the dict with constant keys is
+# much quicker than going through the names in ``columns``, which these must
+# match.
+packedEventFields = {
+    NoteOn: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'channel': a, 'pitch': b,
+        'volume': c, 'duration': d, 'annotation': None},
+    NoteOff: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'channel': a, 'pitch': b,
+        'volume': c, 'annotation': None},
+    ControllerEvent: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'channel': a,
+        'controller_number': b, 'parameter': c},
+    PitchWheelEvent: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'channel': a,
+        'pitch_wheel_value': b},
+    ProgramChange: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'channel': a,
+        'programNumber': b},
+    ChannelPressureEvent: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'channel': a,
+        'pressure_value': b},
+    Tempo: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'tempo': a},
+    TimeSignature: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'numerator': a,
+        'denominator': b, 'clocks_per_tick': c, 'notes_per_quarter': d},
+    KeySignature: lambda tick, order, a, b, c, d: {
+        'tick': tick, 'insertion_order': order, 'accidentals': a,
+        'accidental_type': b, 'mode': c},
+}
+# magic, version, byte order, division, count, side table length
+packedHeader = struct.Struct('<4sBBHII')
+PACKED_MAGIC = b'MUev'
+PACKED_VERSION = 2  # 1 had a pickled side table
+PACKED_COLUMNS = 6  # tick, insertion order and four integer attributes
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+
+def arrayToBytes(values):
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()  # Python 2
+
+
+def arrayFromBytes(typecode, data):
+    values = array.array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)  # Python 2
+    return values
+
+
+# The valid range of each argument checked by checkValues: (lowest, highest,
+# whether it must be an integer). The tempo is in beats per minute, and must
+# give a number of microseconds per quarter note that fits in three bytes.
+valueRanges = {
+    'channel': (0, 15, True),
+    'pitch': (0, 127, True),
+    'volume': (0, 127, True),
+    'time': (0, 0x0FFFFFFF, True),
+    'duration': (0, 0x0FFFFFFF, True),
+    'program': (0, 127, True),
+    'controller_number': (0, 127, True),
+    'parameter': (0, 127, True),
+    'pressure_value': (0, 127, True),
+    'pitchWheelValue': (-8192, 8191, True),
+    'tempo': (60000000 / 0xFFFFFF, 60000000, False),
+}
+
+
+class InvalidValuesError(ValueError):
+    '''
+    Raised when values added to a validating :class:`MIDIFile` are out of
+    range. ``errors`` maps the name of each offending argument to the list of
+    the indices of the bad values (the index is 0 for a single value).
+    '''
+
+    def __init__(self, errors):
+        self.errors = errors
+        descriptions = []
+        for name in sorted(errors):
+            indices = errors[name]
+            shown = ', '.join(str(i) for i in indices[:10])
+            if len(indices) > 10:
+                shown += ', ... (%d in all)' % len(indices)
+            descriptions.append('%s at index %s' % (name, shown))
+        super(InvalidValuesError, self).__init__(
+            "Values out of range: " + '; '.join(descriptions))
+
+
+def invalidIndices(values, low, high, integer=True):
+    '''
+    Return the indices of the values which are not in the range low to high
+    (inclusive), or which are not integers if ``integer`` is set.
+
+    The common case of a valid column is checked at C speed, by converting
+    it to an ``array`` and taking its minimum and maximum. Only if that fails
+    are the values examined one by one to find the bad ones.
+    '''
+    try:
+        column = array.array('l' if integer else 'd', values)
+        if len(column) == 0 or (min(column) >= low and max(column) <= high):
+            return []
+    except (TypeError, OverflowError):
+        pass
+    if integer:
+        return [i for i, value in enumerate(values)
+                if not isIntegerIn(value, low, high)]
+    return [i for i, value in enumerate(values)
+            if not (isinstance(value, numbers.Real) and low <= value <= high)]
+
+
+def isIntegerIn(value, low, high):
+    '''
+    Return ``True`` if value is an integer (of any integral type, such as a
+    ``numpy`` integer) from low to high.
+    '''
+    try:
+        value = operator.index(value)
+    except TypeError:
+        return False
+    return low <= value <= high
+
+
+# The attributes of the channel events, by their names in valueRanges.
+eventValueNames = {'channel': 'channel', 'pitch': 'pitch', 'volume': 'volume',
+                   'duration': 'duration', 'programNumber': 'program',
+                   'controller_number': 'controller_number',
+                   'parameter': 'parameter', 'pressure_value': 'pressure_value',
+                   'pitch_wheel_value': 'pitchWheelValue'}
+
+
+def eventValues(events, start=0):
+    '''
+    Return the values of a list of channel events as columns for
+    :func:`checkValues`, with the events' ticks offset by start as the
+    ``time`` column. An index in a column counts the events which have
+    that value.
+    '''
+    columns = {'time': [start + event.tick for event in events]}
+    for event in events:
+        for attribute, value in event.__dict__.items():
+            name = eventValueNames.get(attribute)
+            if name is not None:
+                columns.setdefault(name, []).append(value)
+    return columns
+
+
+def checkValues(**columns):
+    '''
+    Check columns of values, given by argument name (see ``valueRanges``),
+    and raise an :class:`InvalidValuesError` naming all the values out of
+    range.
+    '''
+    errors = {}
+    for name, values in columns.items():
+        low, high, integer = valueRanges[name]
+        indices = invalidIndices(values, low, high, integer)
+        if indices:
+            errors[name] = indices
+    if errors:
+        raise InvalidValuesError(errors)
+
+
+def packEvents(events, ticks_per_quarternote=0):
+    '''
+    Pack a list of events into a compact binary string.
+
+    :param events: The events, for instance the ``eventList`` of a
+        :class:`MIDITrack`.
+    :param ticks_per_quarternote: Optional. The resolution of the events'
+        ticks, which is stored with them.
+
+    The time, insertion order and integer attributes (pitch, velocity and so
+    on) of the events are stored in typed columns of 32-bit integers, at
+    about 25 bytes an event. The other attributes of events (the texts and
+    data of meta and SysEx events) and note annotations are stored in a side
+    table of JSON, as in :meth:`MIDIFile.writeColumns`, so that reading
+    packed data never runs code. Annotations must therefore be JSON values
+    (byte strings are allowed too), and come back as JSON does: tuples as
+    lists, for instance. Placed patterns can not be packed; expand them
+    first (:meth:`MIDIFile.trackPayload` does). A ``ValueError`` is raised
+    if the events can't be packed.
+
+    This is much smaller than a pickled list of the event objects, and
+    quicker to make and to read back with :func:`unpackEvents`, which makes
+    it suitable for passing events between processes.
+    '''
+    kinds, columns, side = eventColumns(events)
+    try:
+        sideTable = json.dumps([[i, jsonValue(fields)] for i, fields in side],
+                               sort_keys=True).encode('utf-8') if side else b""
+    except (TypeError, ValueError) as error:
+        raise ValueError("The events can't be packed, as an annotation or "
+                         "a pattern is not a JSON value (%s)" % error)
+    return packedColumns(kinds, columns, sideTable, ticks_per_quarternote)
+
+
+def packedColumns(kinds, columns, sideTable, ticks_per_quarternote=0):
+    '''
+    Join the columns of :func:`eventColumns` and a side table into the
+    packed data of :func:`packEvents`.
+    '''
+    chunks = [packedHeader.pack(PACKED_MAGIC, PACKED_VERSION,
+                                sys.byteorder == 'big', ticks_per_quarternote,
+                                len(kinds), len(sideTable)),
+              bytes(kinds)]
+    chunks.extend(arrayToBytes(column) for column in columns)
+    chunks.append(sideTable)
+    return b"".join(chunks)
+
+
+def eventState(events):
+    '''
+    Return the state of a list of events for pickling: the packed columns,
+    and the side table as it is, to be pickled with the rest of the state.
+    Unlike :func:`packEvents` this keeps patterns and annotations of any
+    kind. See :func:`eventsFromState`.
+    '''
+    kinds, columns, side = eventColumns(events)
+    return (packedColumns(kinds, columns, b""), side)
+
+
+def eventsFromState(state):
+    '''
+    Rebuild a list of events from the state made by :func:`eventState`.
+    '''
+    data, side = state
+    events = unpackEvents(data)[1]
+    for i, fields in side:
+        events[i].__dict__.update(fields)
+    return events
+
+
+def eventColumns(events):
+    '''
+    Split a list of events into the columns of :func:`packEvents`.
+
+    Returns a tuple of the class codes of the events (a ``bytearray``), the
+    six columns (``array`` objects of tick, insertion order and up to four
+    attributes), and the side table, a list of (index, dict of attributes)
+    for the events stored whole and the extra attributes of the others.
+    '''
+    classCodes = dict((cls, code) for code, cls in enumerate(packedEventClasses))
+    count = len(events)
+    kinds = bytearray([classCodes[event.__class__] for event in events])
+    # Each column is built in one pass, looking the attribute up by class.
+    # Classes with fewer than four attributes get zeros.
+    data = []
+    for j in range(4):
+        names = dict((cls, cls.columns[j] if cls.columns and j < len(cls.columns)
+                      else None) for cls in packedEventClasses)
+        data.append([event.__dict__.get(names[event.__class__], 0)
+                     for event in events])
+    columns = [[event.tick for event in events],
+               [event.insertion_order for event in events]] + data
+    try:
+        columns = [array.array('i', column) for column in columns]
+        whole = set()
+    except (TypeError, OverflowError):
+        # Some value is not an int32: store those events whole.
+        whole = set(i for i in range(count)
+                    if not all(isinstance(column[i], int) and
+                               INT_MIN <= column[i] <= INT_MAX
+                               for column in columns))
+        for column in columns:
+            for i in whole:
+                column[i] = 0
+        columns = [array.array('i', column) for column in columns]
+
+    # The side table holds the events stored whole, and the attributes of
+    # the others which are not in the columns (other than a None annotation).
+    plain = dict((cls, len(cls.columns) + (3 if cls in (NoteOn, NoteOff) else 2)
+                  if cls.columns else -1) for cls in packedEventClasses)
+    side = []
+    for i in sorted(whole.union(
+            i for i, event in enumerate(events)
+            if len(event.__dict__) != plain[event.__class__] or
+            event.__dict__.get('annotation') is not None)):
+        event = events[i]
+        fields = event.__dict__
+        if i in whole or event.columns is None:
+            side.append((i, fields))
+        else:
+            side.append((i, dict((name, value) for name, value in fields.items()
+                                 if name not in event.columns and
+                                 name != 'tick' and name != 'insertion_order')))
+    return (kinds, columns, side)
+
+
+# magic, version, reserved, metadata length
+columnsHeader = struct.Struct('<4sHHI')
+COLUMNS_MAGIC = b'MUcf'
+# The columns of writeColumns: name, array type code and numpy type.
+columnFormats = [('tick', 'i', '<i4'), ('type', 'B', '|u1'),
+                 ('channel', 'B', '|u1'), ('data1', 'i', '<i4'),
+                 ('data2', 'i', '<i4'), ('duration', 'i', '<i4'),
+                 ('order', 'i', '<i4')]
+NO_CHANNEL = 255
+
+
+def eventTable(events):
+    '''
+    Split a list of events into the named columns and the side table of
+    :meth:`MIDIFile.writeColumns`, from the columns of :func:`eventColumns`.
+
+    The columns are little-endian ``array`` objects; the side table is a list
+    of (index, dict of attributes).
+    '''
+    kinds, (ticks, orders, a, b, c, d), side = eventColumns(events)
+    channelKinds = set(code for code, cls in enumerate(packedEventClasses)
+                       if cls.columns and cls.columns[0] == 'channel')
+    tempo = packedEventClasses.index(Tempo)
+    isChannel = [kind in channelKinds for kind in kinds]
+    # The channel column is one byte, with 255 for events without a channel.
+    badChannels = [i for i, (value, channel) in enumerate(zip(a, isChannel))
+                   if channel and not 0 <= value <= 15]
+    if badChannels:
+        raise InvalidValuesError({'channel': badChannels})
+    columns = {
+        'tick': ticks,
+        'type': array.array('B', kinds),
+        'channel': array.array('B', [value if channel else NO_CHANNEL for
+                                     value, channel in zip(a, isChannel)]),
+        'data1': array.array('i', [second if channel else
+                                   first if kind == tempo else 0
+                                   for kind, channel, first, second in
+                                   zip(kinds, isChannel, a, b)]),
+        'data2': array.array('i', [value if channel else 0 for
+                                   value, channel in zip(c, isChannel)]),
+        'duration': array.array('i', [value if channel else 0 for
+                                      value, channel in zip(d, isChannel)]),
+        'order': orders,
+    }
+
+    # Time and key signatures don't fit the named columns, so their fields
+    # join the side table.
+    signatures = set(packedEventClasses.index(cls)
+                     for cls in (TimeSignature, KeySignature))
+    fields = dict(side)
+    for i, kind in enumerate(kinds):
+        if kind in signatures:
+            cls = packedEventClasses[kind]
+            extra = dict(zip(cls.columns, (a[i], b[i], c[i], d[i])))
+            extra.update(fields.get(i, {}))
+            fields[i] = extra
+    if sys.byteorder == 'big':
+        for column in columns.values():
+            column.byteswap()
+    return columns, sorted(fields.items())
+
+
+def tableEvents(types, columns, side):
+    '''
+    Rebuild the events of one track of :meth:`MIDIFile.writeColumns` from
+    its columns (in the byte order of the machine) and its side table.
+    '''
+    build = []
+    for cls in types:
+        if cls.columns and cls.columns[0] == 'channel':
+            build.append(packedEventFields[cls])
+        elif cls is Tempo:
+            build.append(lambda tick, order, channel, data1, data2, duration:
+                         {'tick': tick, 'insertion_order': order, 'tempo': data1})
+        else:
+            build.append(lambda tick, order, channel, data1, data2, duration:
+                         {'tick': tick, 'insertion_order': order})
+    new = object.__new__
+    events = []
+    append = events.append
+    for tick, kind, channel, data1, data2, duration, order in zip(
+            columns['tick'], columns['type'], columns['channel'],
+            columns['data1'], columns['data2'], columns['duration'],
+            columns['order']):
+        event = new(types[kind])
+        event.__dict__ = build[kind](tick, order, channel, data1, data2, duration)
+        append(event)
+    for i, fields in side:
+        events[i].__dict__.update(fields)
+    return events
+
+
+def jsonValue(value):
+    '''
+    Return a value with its byte strings replaced by ``{"$bytes": hex}``,
+    for writing as JSON.
+    '''
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': binascii.hexlify(value).decode('ascii')}
+    if isinstance(value, (list, tuple)):
+        return [jsonValue(part) for part in value]
+    if isinstance(value, dict):
+        return dict((name, jsonValue(part)) for name, part in value.items())
+    return value
+
+
+def fromJsonValue(value):
+    '''
+    The ``object_hook`` which turns the byte strings of :func:`jsonValue`
+    back into bytes.
+    '''
+    if len(value) == 1 and '$bytes' in value:
+        return bytes(bytearray.fromhex(value['$bytes']))
+    return value
+
+
+def updateFingerprint(hashers, events, start):
+    '''
+    Add events to the fingerprint of a list of events.
+
+    :param hashers: Eight ``hashlib`` objects: one for the class codes, one
+        for each column of :func:`eventColumns` and one for the side table.
+    :param events: The events to add, which follow ``start`` events already
+        added.
+
+    The columns are hashed as little-endian int32 arrays, so the result
+    does not depend on how the list was split into calls. Annotations are
+    left out, as they are not written to the file, and a placed pattern is
+    represented by its serialized data.
+    '''
+    kinds, columns, side = eventColumns(events)
+    hashers[0].update(bytes(kinds))
+    for hasher, column in zip(hashers[1:7], columns):
+        if sys.byteorder == 'big':
+            column.byteswap()
+        hasher.update(arrayToBytes(column))
+    for i, fields in side:
+        described = [(name, value.body if name == 'pattern' else value)
+                     for name, value in sorted(fields.items())
+                     if name != 'annotation']
+        if described:
+            hashers[7].update(repr((start + i, described)).encode('utf-8'))
+
+
+def unpackEvents(data):
+    '''
+    Rebuild the events packed by :func:`packEvents`.
+
+    :param data: The packed data (any bytes-like object).
+
+    Returns a tuple of the resolution stored with the events (zero if none
+    was) and the list of events.
+    '''
+    view = memoryview(data)
+    if len(view) < packedHeader.size or view[0:4].tobytes() != PACKED_MAGIC:
+        raise ValueError("The data are not a packed event list")
+    magic, version, bigEndian, division, count, sideLength = \
+        packedHeader.unpack_from(view, 0)
+    if version != PACKED_VERSION:
+        raise ValueError("Unknown packed event list version %d" % version)
+    offset = packedHeader.size
+    kinds = bytearray(view[offset:offset + count].tobytes())
+    offset += count
+    columns = []
+    width = 4 * count
+    for j in range(PACKED_COLUMNS):
+        column = arrayFromBytes('i', view[offset:offset + width].tobytes())
+        if bool(bigEndian) != (sys.byteorder == 'big'):
+            column.byteswap()
+        columns.append(column)
+        offset += width
+    side = json.loads(view[offset:offset + sideLength].tobytes().decode('utf-8'),
+                      object_hook=fromJsonValue) if sideLength else []
+
+    build = [packedEventFields.get(cls, lambda *values: {})
+             for cls in packedEventClasses]
+    new = object.__new__
+    events = []
+    append = events.append
+    for kind, tick, order, a, b, c, d in zip(kinds, *columns):
+        event = new(packedEventClasses[kind])
+        event.__dict__ = build[kind](tick, order, a, b, c, d)
+        append(event)
+    for i, fields in side:
+        events[i].__dict__.update(fields)
+    return (division, events)
+
+
+def dropRedundantEvents(eventLists):
+    '''
+    Remove the events which don't change anything from sorted event lists
+    that play together, and return a dict for each list with the number of
+    events removed, by event name. The lists are modified in place.
+
+    The lists are swept once in merged order while the current program,
+    pitch wheel value and controller values of each channel, and the tempo,
+    are followed; an event which sets one of these to the value it already
+    has is dropped. The order in which a player takes the events of
+    different lists at the same tick is not known, so when more than one
+    list sets a value at a tick those events are all kept, and the value is
+    only known afterwards if they agree.
+
+    The data entry controllers (6, 38, 96 and 97) are never dropped, as
+    repeating them is meaningful, and nor are the channel mode messages
+    (120-127). Reset All Controllers (121) forgets the state of its
+    channel, and a placed pattern forgets everything until it ends, as its
+    events are not examined.
+    '''
+
+    def setting(event):
+        # The value an event sets, as (key, value), or (None, None).
+        name = event.evtname
+        if name == 'ControllerEvent':
+            number = event.controller_number
+            if number in (6, 38, 96, 97) or number >= 120:
+                return (None, None)
+            return (('cc', event.channel, number), event.parameter)
+        if name == 'ProgramChange':
+            return (('program', event.channel), event.programNumber)
+        if name == 'PitchWheelEvent':
+            return (('pitch', event.channel), event.pitch_wheel_value)
+        if name == 'Tempo':
+            return (('tempo',), event.tempo)
+        return (None, None)
+
+    def decorated(index, eventList):
+        for position, event in enumerate(eventList):
+            yield (event.tick, index, position, event)
+
+    state = {}
+    counts = [{} for events in eventLists]
+    kept = [[] for events in eventLists]
+    opaqueUntil = -1  # the last tick of the patterns placed so far
+    merged = heapq.merge(*[decorated(index, eventList) for
+                           index, eventList in enumerate(eventLists)])
+    entry = next(merged, None)
+    while entry is not None:
+        # The events at one tick, in the order of their lists.
+        tick = entry[0]
+        group = []
+        while entry is not None and entry[0] == tick:
+            group.append((entry[1], entry[3]))
+            entry = next(merged, None)
+
+        writers = {}  # key -> the lists setting it at this tick
+        resets = set()  # the channels reset at this tick
+        for index, event in group:
+            key, value = setting(event)
+            if key is not None:
+                writers.setdefault(key, set()).add(index)
+            elif event.evtname == 'ControllerEvent' and \
+                    event.controller_number == 121:
+                resets.add(event.channel)
+            elif event.evtname == 'Pattern':
+                opaqueUntil = max(opaqueUntil, event.tick + event.span)
+        contested = set(key for key, indices in writers.items()
+                        if len(indices) > 1 or
+                        (key[0] in ('cc', 'pitch') and key[1] in resets))
+
+        last = {}  # contested key -> {list: the last value it sets}
+        for index, event in group:
+            key, value = setting(event)
+            if key is None or tick <= opaqueUntil:
+                pass
+            elif key in contested:
+                last.setdefault(key, {})[index] = value
+            elif key in state and state[key] == value:
+                counts[index][event.evtname] = \
+                    counts[index].get(event.evtname, 0) + 1
+                continue
+            else:
+                state[key] = value
+            kept[index].append(event)
+
+        if tick <= opaqueUntil:
+            state.clear()
+            continue
+        for channel in resets:
+            for key in list(state):
+                if key[0] in ('cc', 'pitch') and key[1] == channel:
+                    del state[key]
+        for key, values in last.items():
+            values = set(values.values())
+            if key[0] in ('cc', 'pitch') and key[1] in resets:
+                pass  # The reset may come before or after
+            elif len(values) == 1:
+                state[key] = values.pop()
+            else:
+                state.pop(key, None)
+
+    for eventList, events in zip(eventLists, kept):
+        eventList[:] = events
+    return counts
+
+
+def stealNotes(eventLists, voices, perChannel=False, policy='oldest'):
+    '''
+    Limit the number of notes sounding at once, as a synthesizer with a
+    fixed number of voices would.
+
+    :param eventLists: A list of sorted event lists (the MIDIEventLists of
+        the tracks of a file), which are modified in place. The tracks are
+        assumed to play on one device, so their notes share the voices.
+    :param voices: The largest number of notes that may sound at once.
+    :param perChannel: If ``True`` the limit applies to each channel
+        separately, otherwise to all the channels together.
+    :param policy: Which note loses its voice when a note starts and none
+        is free: ``'oldest'`` (the note that started first), ``'quietest'``
+        (the lowest velocity) or ``'lowest'`` (the lowest pitch). Ties go to
+        the oldest note.
+
+    The lists are swept once in merged order. Notes are paired with their
+    NoteOffs in the order the device would see them, and the sounding notes
+    of each voice pool are kept in a priority queue ordered by the policy,
+    so the cost is O(n log n). A stolen note ends when the note that stole
+    its voice starts. A stolen note that would not sound at all (the new
+    note itself, which the ``'quietest'`` and ``'lowest'`` policies may
+    choose, or one starting at the same time) is removed.
+
+    Returns the number of notes stolen.
+    '''
+
+    if policy == 'oldest':
+        priority = lambda event, seq: (event.tick, seq)  # noqa: E731
+    elif policy == 'quietest':
+        priority = lambda event, seq: (event.volume, event.tick, seq)  # noqa: E731
+    elif policy == 'lowest':
+        priority = lambda event, seq: (event.pitch, event.tick, seq)  # noqa: E731
+    else:
+        raise ValueError("Unknown stealing policy %r" % (policy,))
+
+    # Pair each NoteOn with the NoteOff that ends it, in both directions.
+    noteOns = []
+    noteOffs = []
+    for events in eventLists:
+        pending = {}
+        onOf = {}
+        offOf = {}
+        for i, event in enumerate(events):
+            if event.evtname == 'NoteOn':
+                pending.setdefault((event.pitch, event.channel), deque()).append(i)
+            elif event.evtname == 'NoteOff':
+                waiting = pending.get((event.pitch, event.channel))
+                if waiting:
+                    on = waiting.popleft()
+                    onOf[i] = on
+                    offOf[on] = i
+        noteOns.append(onOf)
+        noteOffs.append(offOf)
+
+    decorated = [[(sort_events(event), t, i) for i, event in enumerate(events)
+                  if event.evtname in ('NoteOn', 'NoteOff')]
+                 for t, events in enumerate(eventLists)]
+
+    pools = {}  # channel (or None) -> [number sounding, priority queue]
+    voices_of = {}  # (track, index of NoteOn) -> voice
+    changed = {}  # track -> indices of the events removed
+    stolen = 0
+    seq = 0
+    for key, t, i in heapq.merge(*decorated):
+        event = eventLists[t][i]
+        if event.evtname == 'NoteOff':
+            voice = voices_of.pop((t, noteOns[t].get(i)), None)
+            if voice is not None and voice[3]:
+                voice[3] = False
+                pools[voice[4]][0] -= 1
+            continue
+
+        pool_key = event.channel if perChannel else None
+        pool = pools.get(pool_key)
+        if pool is None:
+            pool = pools[pool_key] = [0, []]
+        # A voice is [priority, track, index of NoteOn, sounding, pool key]
+        voice = [priority(event, seq), t, i, True, pool_key]
+        seq += 1
+        voices_of[(t, i)] = voice
+        heapq.heappush(pool[1], voice)
+        pool[0] += 1
+        while pool[0] > voices:
+            victim = heapq.heappop(pool[1])
+            if not victim[3]:
+                continue  # already ended
+            victim[3] = False
+            pool[0] -= 1
+            stolen += 1
+            vt, vi = victim[1], victim[2]
+            removed = changed.setdefault(vt, set())
+            off = noteOffs[vt].get(vi)
+            if eventLists[vt][vi].tick == event.tick:
+                removed.add(vi)
+                if off is not None:
+                    removed.add(off)
+            elif off is not None:
+                eventLists[vt][off].tick = event.tick
+
+    for t, removed in changed.items():
+        events = eventLists[t]
+        if removed:
+            events[:] = [event for i, event in enumerate(events)
+                         if i not in removed]
+        events.sort(key=sort_events)
+
+    return stolen
+
+
+class TempoMap(object):
+    '''
+    The times of the ticks of a file, given its tempo events.
+    '''
+
+    def __init__(self, tempos, ticks_per_quarternote):
+        '''
+        :param tempos: A list of (tick, microseconds per quarter note) in
+            the order of their ticks.
+        :param ticks_per_quarternote: The resolution of the file.
+        '''
+        self.ticks = [0]  # the tick at which each tempo starts,
+        self.starts = [0.0]  # its time in seconds
+        self.rates = [500000.0 / (1e6 * ticks_per_quarternote)]  # and its
+        # seconds per tick
+        for tick, tempo in tempos:
+            rate = tempo / (1e6 * ticks_per_quarternote)
+            if tick == self.ticks[-1]:
+                self.rates[-1] = rate
+                continue
+            self.starts.append(self.starts[-1] +
+                               (tick - self.ticks[-1]) * self.rates[-1])
+            self.ticks.append(tick)
+            self.rates.append(rate)
+
+    def seconds(self, ticks):
+        '''
+        Return the times, in seconds, of a list of ticks.
+        '''
+        if len(self.ticks) == 1:
+            rate = self.rates[0]
+            return [tick * rate for tick in ticks]
+        find = bisect.bisect_right
+        breaks, starts, rates = self.ticks, self.starts, self.rates
+        times = []
+        append = times.append
+        for tick in ticks:
+            i = find(breaks, tick) - 1
+            append(starts[i] + (tick - breaks[i]) * rates[i])
+        return times
+
+
+def waveTable(waveform, frequency, sampleRate, amplitude):
+    '''
+    Return an ``array('i')`` holding a whole number of cycles of a waveform
+    (see :meth:`MIDIFile.renderWAV`), at least 2048 samples long, played at
+    a frequency and scaled to an amplitude.
+
+    The number of cycles is chosen so that the table repeats seamlessly; the
+    pitch is out by less than half a sample in the length of the table (a
+    fraction of a cent).
+    '''
+    cycles = max(int(math.ceil(2048 * frequency / sampleRate)), 1)
+    length = max(int(round(cycles * sampleRate / frequency)), 1)
+    phases = [(i * cycles % length) / length for i in range(length)]
+    checkWaveform(waveform)
+    if waveform == 'sine':
+        values = [math.sin(2 * math.pi * phase) for phase in phases]
+    elif waveform == 'saw':
+        values = [2 * phase - 1 for phase in phases]
+    else:
+        size = len(waveform)
+        wrapped = list(waveform) + [waveform[0]]
+        values = []
+        for phase in phases:
+            position = phase * size
+            i = int(position)
+            values.append(wrapped[i] + (wrapped[i + 1] - wrapped[i]) * (position - i))
+    return array.array('i', [int(round(value * amplitude)) for value in values])
+
+
+def checkWaveform(waveform):
+    '''
+    Raise a ``ValueError`` if ``waveform`` is not a voice
+    :meth:`MIDIFile.renderWAV` can play: ``'sine'``, ``'saw'`` or a
+    non-empty wavetable.
+    '''
+    if isinstance(waveform, (str, type(u''))):
+        if waveform not in ('sine', 'saw'):
+            raise ValueError("waveform must be 'sine', 'saw' or a wavetable")
+    elif len(waveform) == 0:
+        raise ValueError("A wavetable must hold at least one value")
+
+
+def loopedSlice(table, start, length):
+    '''
+    Return ``length`` samples of a looped table from sample ``start``, as a
+    new array.
+    '''
+    size = len(table)
+    start %= size
+    if start + length <= size:
+        return table[start:start + length]
+    samples = table[start:]
+    repeats, rest = divmod(length - len(samples), size)
+    return samples + table * repeats + table[:rest]
+
+
+def resampleTicks(ticks, old, new, rounding='nearest'):
+    '''
+    Convert ticks at a resolution of old ticks per quarter note to new ticks
+    per quarter note, and return them as an array.
+
+    ``rounding`` is ``'nearest'`` (halves are rounded up), ``'floor'`` or
+    ``'ceil'``. The arithmetic is on integers, so the conversion is exact
+    whenever new is a multiple of old.
+    '''
+    if rounding == 'nearest':
+        half = old // 2
+        return array.array('l', [(tick * new + half) // old for tick in ticks])
+    if rounding == 'floor':
+        return array.array('l', [tick * new // old for tick in ticks])
+    if rounding == 'ceil':
+        return array.array('l', [-(-tick * new // old) for tick in ticks])
+    raise ValueError("rounding must be 'nearest', 'floor' or 'ceil'")
+
+
+def transformKey(steps):
+    '''
+    Return a representation of transform steps which does not depend on
+    the order in which the members of a set are listed, for fingerprints.
+    '''
+    return tuple(tuple(sorted(part) if isinstance(part, frozenset) else part
+                       for part in step) for step in steps)
+
+
+def applyTransforms(events, steps):
+    '''
+    Return copies of events with the transforms recorded by the transform
+    methods of :class:`MIDIFile` applied, leaving out the events they
+    remove.
+
+    Each step is a tuple: ``('transpose', semitones, channels)``,
+    ``('scaleVelocity', factor, channels)``, ``('filterChannels',
+    channels)``, ``('quantize', grid)`` or ``('stretch', factor)``, where
+    ``channels`` is a frozenset or None for all channels and ``grid`` is in
+    ticks.
+
+    The steps are fused before the events are visited, so however many
+    there are the events are traversed once: the transpositions are summed
+    and the velocity factors multiplied for each channel, the channel
+    filters are intersected, and the changes of time are composed into one
+    function of the start and end of a note (and one of the tick of any
+    other event). A note keeps its note off: the note off is given the end
+    computed for its note on, which it is matched with by channel, pitch,
+    tick and insertion order.
+    '''
+    shifts = [0] * 16
+    factors = [1.0] * 16
+    allowed = None
+    times = []
+    for step in steps:
+        kind = step[0]
+        if kind == 'transpose':
+            for channel in range(16):
+                if step[2] is None or channel in step[2]:
+                    shifts[channel] += step[1]
+        elif kind == 'scaleVelocity':
+            for channel in range(16):
+                if step[2] is None or channel in step[2]:
+                    factors[channel] *= step[1]
+        elif kind == 'filterChannels':
+            allowed = step[1] if allowed is None else allowed & step[1]
+        else:
+            times.append(step)
+    scaled = any(factor != 1.0 for factor in factors)
+
+    def moveNote(start, end):
+        for step in times:
+            if step[0] == 'quantize':
+                grid = step[1]
+                moved = (start + grid // 2) // grid * grid
+                start, end = moved, end + moved - start
+            else:
+                start = int(round(start * step[1]))
+                end = int(round(end * step[1]))
+        return start, end
+
+    def moveTick(tick):
+        for step in times:
+            if step[0] == 'stretch':
+                tick = int(round(tick * step[1]))
+        return tick
+
+    ends = {}  # note off key -> end of the transformed note
+    offs = {}  # note off key -> a note off seen before its note on
+    transformed = []
+    for event in events:
+        channel = getattr(event, 'channel', None)
+        if allowed is not None and channel is not None and channel not in allowed:
+            continue
+        name = event.evtname
+        if name == 'NoteOn' or name == 'NoteOff':
+            pitch = event.pitch + shifts[channel]
+            if pitch < 0 or pitch > 127:
+                continue
+            original = event
+            event = copy.copy(event)
+            event.pitch = pitch
+            if scaled:
+                volume = int(round(event.volume * factors[channel]))
+                event.volume = min(max(volume, 1 if name == 'NoteOn' else 0), 127)
+            if times:
+                if name == 'NoteOn':
+                    end = original.tick + original.duration
+                    key = (channel, original.pitch, end, original.insertion_order)
+                    event.tick, end = moveNote(original.tick, end)
+                    event.duration = end - event.tick
+                    if key in offs:
+                        offs.pop(key).tick = end
+                    else:
+                        ends[key] = end
+                else:
+                    key = (channel, original.pitch, original.tick,
+                           original.insertion_order)
+                    if key in ends:
+                        event.tick = ends.pop(key)
+                    else:
+                        event.tick = moveTick(event.tick)
+                        offs[key] = event
+        else:
+            event = copy.copy(event)
+            if times:
+                event.tick = moveTick(event.tick)
+        transformed.append(event)
+    return transformed
+
+
+def thinValues(values, tolerance=0):
+    '''
+    Return the indices of the values worth writing to the stream.
+
+    A value is dropped if it is within ``tolerance`` of the last value kept
+    (so with a tolerance of zero only repeated values are dropped). The first
+    value is always kept, as is the last one unless it is the same as the
+    last value kept, so that a curve always ends where it should.
+    '''
+    if len(values) == 0:
+        return []
+    kept = [0]
+    last = values[0]
+    for i in range(1, len(values)):
+        if abs(values[i] - last) > tolerance:
+            kept.append(i)
+            last = values[i]
+    final = len(values) - 1
+    if kept[-1] != final and values[final] != last:
+        kept.append(final)
+    return kept
+
+
+def simplifyCurve(ticks, values, tolerance=0):
+    '''
+    Return the indices of the points of a curve kept by the
+    Ramer-Douglas-Peucker algorithm.
+
+    The first and last points are always kept. A segment between two kept
+    points is split at the point furthest (measured along the value axis)
+    from the straight line between them, if that distance exceeds
+    ``tolerance``. The segments are processed from a stack rather than by
+    recursion, so long curves are no problem.
+    '''
+    count = len(values)
+    if count < 3:
+        return list(range(count))
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        span = ticks[last] - ticks[first]
+        slope = (values[last] - values[first]) / span if span else 0
+        worst = -1
+        index = first
+        for i in range(first + 1, last):
+            expected = values[first] + slope * (ticks[i] - ticks[first])
+            deviation = abs(values[i] - expected)
+            if deviation > worst:
+                worst = deviation
+                index = i
+        if worst > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i in range(count) if keep[i]]
+
+
 def frequencyTransform(freq):
     '''
     Returns a three-byte transform of a frequency.
     '''
-    resolution = 16384
+    return list(frequencyBytes(float(freq)))
+
+
+def tuningBytes(freq):
+    '''
+    Returns the three bytes of the tuning standard for a frequency, as a tuple.
+
+    ``None``, and frequencies outside the range that can be represented, give
+    the reserved value meaning "no change".
+    '''
+    if freq is None:
+        return (0x7F, 0x7F, 0x7F)
     freq = float(freq)
+    if not MTS_LOWEST_FREQUENCY <= freq < MTS_HIGHEST_FREQUENCY:
+        return (0x7F, 0x7F, 0x7F)
+    return frequencyBytes(freq)
+
+
+# The range of frequencies which the MIDI tuning standard can represent,
+# from note 0 to just under a semitone above note 127.
+MTS_LOWEST_FREQUENCY = 440 * pow(2.0, -69 / 12.0)
+MTS_HIGHEST_FREQUENCY = 440 * pow(2.0, (128 - 69) / 12.0)
+
+
+@lru_cache(maxsize=4096)
+def frequencyBytes(freq):
+    '''
+    The cached implementation of ``frequencyTransform``.
+
+    Tunings tend to use the same frequencies over and over, so the two
+    logarithms and the power that the transform costs are only computed
+    once for each frequency. A tuple is returned, as the result is shared.
+    '''
+    resolution = 16384
     dollars = 69 + 12 * math.log(freq / (float(440)), 2)
     firstByte = int(dollars)
     lowerFreq = 440 * pow(2.0, ((float(firstByte) - 69.0) / 12.0))
@@ -1793,7 +6114,77 @@ def frequencyTransform(freq):
     if thirdByte == 0x7f and secondByte == 0x7F and firstByte == 0x7F:
         thirdByte = 0x7e
     thirdByte = int(thirdByte)
-    return [firstByte, secondByte, thirdByte]
+    return (firstByte, secondByte, thirdByte)
+
+
+def readScalaTuning(scl, kbm=None):
+    '''
+    Read a tuning from a Scala scale file, and optionally a keyboard mapping.
+
+    :param scl: A Scala scale (``.scl``) file, as a file handle opened for
+        reading (or any iterable of its lines).
+    :param kbm: Optional. A Scala keyboard mapping (``.kbm``) file, in the
+        same form. Without a mapping the scale is mapped linearly, with its
+        first degree on note 60 at 261.6256 Hz (middle C).
+
+    Returns a list of the frequencies of the 128 MIDI notes, with ``None``
+    for notes that the mapping leaves unmapped, suitable for
+    ``MIDIFile.addTuningDump``.
+    '''
+    lines = [line.strip() for line in scl if not line.strip().startswith('!')]
+    # The first line is the description, which may be blank.
+    lines = [line for line in lines[1:] if line]
+    count = int(lines[0].split()[0])
+    pitches = []
+    for line in lines[1:count + 1]:
+        value = line.split()[0]
+        if '.' in value:
+            pitches.append(float(value))
+        else:
+            ratio = value.split('/')
+            denominator = float(ratio[1]) if len(ratio) > 1 else 1.0
+            pitches.append(1200 * math.log(float(ratio[0]) / denominator, 2))
+    period = pitches[-1]
+    table = [0.0] + pitches[:-1]
+
+    size, first, last, middle, reference = 0, 0, 127, 60, 60
+    frequency = 440 * pow(2.0, -9 / 12.0)
+    octaveDegree = count
+    mapping = []
+    if kbm is not None:
+        values = [line.split()[0] for line in (line.strip() for line in kbm)
+                  if line and not line.startswith('!')]
+        size, first, last, middle, reference = [int(v) for v in values[0:5]]
+        frequency = float(values[5])
+        octaveDegree = int(values[6])
+        mapping = [None if v == 'x' else int(v) for v in values[7:7 + size]]
+
+    def degree(note):
+        if size == 0:
+            return note - middle
+        octave, index = divmod(note - middle, size)
+        if index >= len(mapping) or mapping[index] is None:
+            return None
+        return octave * octaveDegree + mapping[index]
+
+    def cents(degree):
+        octave, index = divmod(degree, count)
+        return octave * period + table[index]
+
+    referenceDegree = degree(reference)
+    if referenceDegree is None:
+        raise ValueError("The reference note is not mapped")
+    referenceCents = cents(referenceDegree)
+
+    frequencies = []
+    for note in range(128):
+        noteDegree = degree(note)
+        if noteDegree is None or not first <= note <= last:
+            frequencies.append(None)
+        else:
+            frequencies.append(frequency * pow(2.0, (cents(noteDegree) -
+                                                     referenceCents) / 1200))
+    return frequencies
 
 
 def returnFrequency(freqBytes):
@@ -1,3 +1,3 @@
 from midiutil.MidiFile import *
 
-__all__ = ['MIDIFile', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
+__all__ = ['MIDIFile', 'MIDIPattern', 'ChannelAllocator', 'RenderCache', 'InvalidValuesError', 'mergeMIDIFiles', 'readColumns', 'readScalaTuning', 'MAJOR', 'MINOR', 'SHARPS', 'FLATS']
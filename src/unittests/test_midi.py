@@ -13,14 +13,24 @@
 
 
 from __future__ import division, print_function
+import array
+import io
+import json
+import os
+import pickle
+import shutil
 import sys
 import struct
+import tempfile
+import threading
+import wave
 
 import unittest
 
 from midiutil.MidiFile import *
 
-from midiutil.MidiFile import writeVarLength,  \
+from midiutil.MidiFile import writeVarLength, readTrackChunks, simplifyCurve, \
+    unpackEvents, \
     frequencyTransform, returnFrequency, MAJOR, MINOR, SHARPS, FLATS, MIDIFile
 
 
@@ -933,6 +943,1332 @@ class TestMIDIUtils(unittest.TestCase):
         MyMIDI.close()
         self.assertEqual(2, len(MyMIDI.tracks[1].eventList))
 
+    def testPattern(self):
+        pattern = MIDIPattern()
+        pattern.addProgramChange(9, 0, 10)
+        for beat in range(4):
+            pattern.addNote(9, 36 + beat % 2, beat, 0.5, 100)
+        pattern.addControllerEvent(9, 3, 7, 90)
+
+        MyMIDI = MIDIFile(1)
+        for bar in range(4):
+            MyMIDI.addPattern(0, bar * 4, pattern)
+        MyMIDI.close()
+
+        expected = MIDIFile(1)
+        for bar in range(4):
+            expected.addProgramChange(0, 9, bar * 4, 10)
+            for beat in range(4):
+                expected.addNote(0, 9, 36 + beat % 2, bar * 4 + beat, 0.5, 100)
+            expected.addControllerEvent(0, 9, bar * 4 + 3, 7, 90)
+        expected.close()
+
+        # None of the placements interleave, so they are copied as blocks.
+        self.assertEqual(4, len(MyMIDI.tracks[1].MIDIEventList))
+        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].evtname, 'Pattern')
+        self.assertEqual(MyMIDI.tracks[1].MIDIdata, expected.tracks[1].MIDIdata)
+
+        # A note inside the second placement forces it to be expanded.
+        MyMIDI = MIDIFile(1)
+        for bar in range(4):
+            MyMIDI.addPattern(0, bar * 4, pattern)
+        MyMIDI.addNote(0, 9, 60, 5.5, 0.25, 100)
+        MyMIDI.close()
+        expected = MIDIFile(1)
+        for bar in range(4):
+            expected.addProgramChange(0, 9, bar * 4, 10)
+            for beat in range(4):
+                expected.addNote(0, 9, 36 + beat % 2, bar * 4 + beat, 0.5, 100)
+            expected.addControllerEvent(0, 9, bar * 4 + 3, 7, 90)
+        expected.addNote(0, 9, 60, 5.5, 0.25, 100)
+        expected.close()
+
+        evtnames = [evt.evtname for evt in MyMIDI.tracks[1].MIDIEventList]
+        self.assertEqual(3, evtnames.count('Pattern'))
+        self.assertEqual(MyMIDI.tracks[1].MIDIdata, expected.tracks[1].MIDIdata)
+
+        # Overlapping placements, and a note sounding across a placement.
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addPattern(0, 0, pattern)
+        MyMIDI.addPattern(0, 2, pattern)
+        MyMIDI.addNote(0, 9, 36, 7, 4, 100)
+        MyMIDI.addPattern(0, 8, pattern)
+        MyMIDI.close()
+        evtnames = [evt.evtname for evt in MyMIDI.tracks[1].MIDIEventList]
+        self.assertEqual(0, evtnames.count('Pattern'))
+
+    def testFork(self):
+        MyMIDI = MIDIFile(2)
+        MyMIDI.addTempo(0, 0, 120)
+        for i in range(8):
+            MyMIDI.addNote(0, 0, 60 + i, i, 1, 100)
+            MyMIDI.addNote(1, 1, 48 + i, i, 2, 100)
+
+        variant = MyMIDI.fork()
+        variant.addNote(1, 1, 72, 3, 1, 100)
+
+        # Unmodified tracks share their events; modified ones do not
+        self.assertTrue(variant.tracks[1].eventList is MyMIDI.tracks[1].eventList)
+        self.assertFalse(variant.tracks[2].eventList is MyMIDI.tracks[2].eventList)
+        self.assertEqual(16, len(MyMIDI.tracks[2].eventList))
+        self.assertEqual(18, len(variant.tracks[2].eventList))
+
+        MyMIDI.close()
+        variant.close()
+        self.assertEqual(MyMIDI.tracks[1].MIDIdata, variant.tracks[1].MIDIdata)
+        self.assertNotEqual(MyMIDI.tracks[2].MIDIdata, variant.tracks[2].MIDIdata)
+
+        # Closing the parent must not have disturbed the events of the fork
+        expected = MIDIFile(2)
+        expected.addTempo(0, 0, 120)
+        for i in range(8):
+            expected.addNote(0, 0, 60 + i, i, 1, 100)
+            expected.addNote(1, 1, 48 + i, i, 2, 100)
+        expected.addNote(1, 1, 72, 3, 1, 100)
+        expected.close()
+        self.assertEqual(expected.tracks[2].MIDIdata, variant.tracks[2].MIDIdata)
+
+        # A fork of a closed file shares the serialized data of the tracks
+        # it does not modify, and re-writes those that it does.
+        second = variant.fork()
+        second.addNote(0, 0, 30, 0, 1, 100)
+        second.close()
+        self.assertTrue(second.tracks[2].MIDIdata is variant.tracks[2].MIDIdata)
+        self.assertEqual(len(variant.tracks[1].MIDIdata) + 8,
+                         len(second.tracks[1].MIDIdata))
+
+    def testMerge(self):
+        melody = MIDIFile(1, ticks_per_quarternote=480)
+        melody.addTempo(0, 0, 100)
+        drums = MIDIFile(1)
+        for i in range(4):
+            melody.addNote(0, 0, 60 + i, i, 1, 100)
+            drums.addNote(0, 0, 36, i, 0.5, 100)
+            drums.addNote(0, 0, 42, i + 0.5, 0.5, 100)
+        drums.addControllerEvent(0, 0, 0, 7, 90)
+
+        mix = mergeMIDIFiles([melody, drums])
+        self.assertEqual(3, mix.numTracks)
+        self.assertEqual(960, mix.ticks_per_quarternote)
+
+        expected = MIDIFile(2)
+        expected.addTempo(0, 0, 100)
+        for i in range(4):
+            expected.addNote(0, 0, 60 + i, i, 1, 100)
+            expected.addNote(1, 0, 36, i, 0.5, 100)
+            expected.addNote(1, 0, 42, i + 0.5, 0.5, 100)
+        expected.addControllerEvent(1, 0, 0, 7, 90)
+
+        mix.close()
+        expected.close()
+        for i in range(3):
+            self.assertEqual(expected.tracks[i].MIDIdata, mix.tracks[i].MIDIdata)
+
+        # Both stems on one track, the drums moved to channel 9. Events at
+        # the same time keep the order of their files.
+        mix = mergeMIDIFiles([melody, drums], track_map=[None, [0]],
+                             channel_map=[None, {0: 9}])
+        self.assertEqual(2, mix.numTracks)
+        expected = MIDIFile(1)
+        expected.addTempo(0, 0, 100)
+        for i in range(4):
+            expected.addNote(0, 0, 60 + i, i, 1, 100)
+        for i in range(4):
+            expected.addNote(0, 9, 36, i, 0.5, 100)
+            expected.addNote(0, 9, 42, i + 0.5, 0.5, 100)
+        expected.addControllerEvent(0, 9, 0, 7, 90)
+
+        mix.close()
+        expected.close()
+        self.assertEqual(expected.tracks[1].MIDIdata, mix.tracks[1].MIDIdata)
+        self.assertEqual(25, len(mix.tracks[1].eventList))
+        # The sources are unchanged
+        self.assertEqual(0, drums.tracks[1].eventList[0].channel)
+        self.assertEqual(480, melody.tracks[1].eventList[2].tick)
+
+        # Notes and their NoteOffs still pair up, so notes of a merged file
+        # can be quantized and removed
+        for i in range(4):
+            drums.addNote(0, 0, 38, i + 0.1, 0.3, 100)
+        mix = mergeMIDIFiles([melody, drums], track_map=[None, [0]])
+        mix.quantizeNotes(0, 0.5)
+        mix.close()
+        self.assertEqual([event.tick for event in mix.tracks[1].eventList
+                          if event.evtname == 'NoteOn' and event.pitch == 38],
+                         [0, 960, 1920, 2880])
+        mix = mergeMIDIFiles([melody, drums])
+        self.assertEqual(12, len(mix.removeNotes(1, 0, 100)))
+        self.assertEqual([], [event for event in mix.tracks[2].eventList
+                              if event.evtname in ('NoteOn', 'NoteOff')])
+
+    def testFormat0(self):
+        MyMIDI = MIDIFile(2, file_format=0)
+        expected = MIDIFile(1, file_format=2)
+        for midi_file, bass in ((MyMIDI, 1), (expected, 0)):
+            midi_file.addTempo(0, 0, 120)
+            midi_file.addTrackName(0, 0, "Single")
+            for i in range(4):
+                midi_file.addNote(0, 0, 60 + i, i, 1, 100)
+                midi_file.addNote(bass, 1, 36, i, 2, 100)
+            midi_file.addTempo(0, 2, 90)
+            midi_file.addProgramChange(bass, 1, 1, 33)
+
+        MyMIDI.close()
+        expected.close()
+        self.assertEqual(expected.tracks[0].MIDIdata, MyMIDI.mergedTrack.MIDIdata)
+
+        with open("/tmp/test0.mid", "wb") as output_file:
+            MyMIDI.writeFile(output_file)
+        with open("/tmp/test0.mid", "rb") as input_file:
+            data = Decoder(input_file.read())
+        self.assertEqual(data[0:4], b'MThd')
+        self.assertEqual(data[8:10], struct.pack('>H', 0))  # format
+        self.assertEqual(data[10:12], struct.pack('>H', 1))  # one track
+        self.assertEqual(len(data), 14 + 8 + len(MyMIDI.mergedTrack.MIDIdata))
+
+        # A tempo change inside a pattern on another track
+        pattern = MIDIPattern()
+        for beat in range(4):
+            pattern.addNote(0, 60 + beat, beat, 1, 100)
+        MyMIDI = MIDIFile(1, file_format=0)
+        expected = MIDIFile(1, file_format=0)
+        MyMIDI.addPattern(0, 0, pattern)
+        for beat in range(4):
+            expected.addNote(0, 0, 60 + beat, beat, 1, 100)
+        for midi_file in (MyMIDI, expected):
+            midi_file.addTempo(0, 2, 90)
+            midi_file.close()
+        self.assertEqual(expected.mergedTrack.MIDIdata,
+                         MyMIDI.mergedTrack.MIDIdata)
+
+    def testAddTrackChunks(self):
+        source = MIDIFile(2)
+        source.addTempo(0, 0, 120)
+        source.addTrackName(0, 0, "First")
+        source.addNote(0, 0, 60, 0, 1, 100)
+        source.addTrackName(1, 0, "Second")
+        source.addNote(1, 1, 36, 1, 2, 100)
+        output = io.BytesIO()
+        source.writeFile(output)
+        data = output.getvalue()
+
+        MyMIDI = MIDIFile(0)
+        MyMIDI.addTempo(0, 0, 90)
+        MyMIDI.addTrackChunks(data, tracks=[2, 1])
+        self.assertEqual(3, MyMIDI.numTracks)
+        output = io.BytesIO()
+        MyMIDI.writeFile(output)
+        result = output.getvalue()
+
+        file_format, division, chunks = readTrackChunks(result)
+        self.assertEqual(1, file_format)
+        self.assertEqual(960, division)
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(source.tracks[2].MIDIdata, chunks[1].tobytes())
+        self.assertEqual(source.tracks[1].MIDIdata, chunks[2].tobytes())
+        self.assertNotEqual(source.tracks[0].MIDIdata, chunks[0].tobytes())
+
+        # The tempo track can be taken from the source as well
+        MyMIDI = MIDIFile(0)
+        MyMIDI.addTrackChunks(io.BytesIO(data), tracks=[0, 1, 2], tempo_track=True)
+        output = io.BytesIO()
+        MyMIDI.writeFile(output)
+        self.assertEqual(data, output.getvalue())
+
+        # The copied tracks can not be modified
+        self.assertRaises(ValueError, MyMIDI.addNote, 1, 0, 60, 0, 1, 100)
+        self.assertEqual([], MyMIDI.tracks[2].eventList)
+        # nor merged
+        self.assertRaises(ValueError, mergeMIDIFiles, [source, MyMIDI])
+
+        MyMIDI = MIDIFile(0, ticks_per_quarternote=480)
+        self.assertRaises(ValueError, MyMIDI.addTrackChunks, data)
+        self.assertRaises(ValueError, readTrackChunks, data[:-5])
+
+    def testControllerRamp(self):
+        MyMIDI = MIDIFile(1, eventtime_is_ticks=True)
+        dropped = MyMIDI.addControllerRamp(0, 0, 100, 960, 7, 0, 127, 1)
+        events = MyMIDI.tracks[1].eventList
+        self.assertEqual(128, len(events))
+        self.assertEqual(961 - 128, dropped)
+        self.assertEqual([evt.parameter for evt in events], list(range(128)))
+        self.assertEqual(100, events[0].tick)
+        # 127 is reached (by rounding) before the end of the ramp
+        self.assertEqual(1057, events[-1].tick)
+        self.assertEqual(128, MyMIDI.event_counter)
+
+        MyMIDI = MIDIFile(1, eventtime_is_ticks=True)
+        MyMIDI.addControllerRamp(0, 0, 0, 960, 74, 127, 0, 10,
+                                 curve='exponential', tolerance=4)
+        events = MyMIDI.tracks[1].eventList
+        values = [evt.parameter for evt in events]
+        self.assertEqual(127, values[0])
+        self.assertEqual(0, values[-1])
+        self.assertEqual(values, sorted(values, reverse=True))
+        # An exponential fall is steep at first: big steps, then small ones
+        self.assertTrue(values[0] - values[1] > values[-2] - values[-1])
+
+        MyMIDI = MIDIFile(1)
+        dropped = MyMIDI.addControllerCurve(0, 0, 1, 1,
+                                            [0, 1, 2, 3, 10, 10, 10, 11],
+                                            0.25, tolerance=2)
+        events = MyMIDI.tracks[1].eventList
+        self.assertEqual(4, dropped)
+        self.assertEqual([0, 3, 10, 11], [evt.parameter for evt in events])
+        self.assertEqual([960, 1680, 1920, 2640], [evt.tick for evt in events])
+
+    def testPitchWheelCurve(self):
+        import math
+        vibrato = [400 * math.sin(2 * math.pi * tick / 480.0)
+                   for tick in range(960)]
+        rounded = [int(round(value)) for value in vibrato]
+
+        MyMIDI = MIDIFile(1, eventtime_is_ticks=True)
+        dropped = MyMIDI.addPitchWheelCurve(0, 0, 0, vibrato, 1, tolerance=20)
+        events = MyMIDI.tracks[1].eventList
+        self.assertEqual(960 - len(events), dropped)
+        self.assertTrue(dropped > 800)
+        # Holding each value until the next event stays within tolerance
+        held = 0
+        for tick in range(960):
+            while held + 1 < len(events) and events[held + 1].tick <= tick:
+                held += 1
+            self.assertTrue(abs(events[held].pitch_wheel_value - rounded[tick]) <= 20)
+
+        MyMIDI = MIDIFile(1, eventtime_is_ticks=True)
+        rdp_dropped = MyMIDI.addPitchWheelCurve(0, 0, 0, vibrato, 1,
+                                                tolerance=20, method='rdp')
+        events = MyMIDI.tracks[1].eventList
+        self.assertTrue(rdp_dropped > dropped)
+        self.assertEqual(0, events[0].tick)
+        self.assertEqual(959, events[-1].tick)
+        # Interpolating between the events stays within tolerance
+        for first, last in zip(events, events[1:]):
+            slope = (last.pitch_wheel_value - first.pitch_wheel_value) / (last.tick - first.tick)
+            for tick in range(first.tick, last.tick):
+                expected = first.pitch_wheel_value + slope * (tick - first.tick)
+                self.assertTrue(abs(expected - rounded[tick]) <= 20)
+
+        self.assertEqual([0, 2, 3], simplifyCurve([0, 1, 2, 3], [0, 1, 5, 5], 1.6))
+
+    def testRemoveRedundant(self):
+        MyMIDI = MIDIFile(1, removeRedundant=True)
+        MyMIDI.addTempo(0, 0, 120)
+        MyMIDI.addTempo(0, 4, 120)
+        MyMIDI.addTempo(0, 8, 100)
+        MyMIDI.addProgramChange(0, 0, 0, 10)
+        MyMIDI.addProgramChange(0, 1, 0, 10)  # Another channel
+        MyMIDI.addProgramChange(0, 0, 2, 10)
+        MyMIDI.addProgramChange(0, 0, 3, 11)
+        for time in range(4):
+            MyMIDI.addControllerEvent(0, 0, time, 7, 100)
+            MyMIDI.addPitchWheelEvent(0, 0, time, 0)
+            MyMIDI.addNote(0, 0, 60, time, 1, 100)
+        MyMIDI.addControllerEvent(0, 0, 4, 121, 0)  # Reset All Controllers
+        MyMIDI.addControllerEvent(0, 0, 4, 7, 100)
+        MyMIDI.changeTuningProgram(0, 0, 5, 0)
+        MyMIDI.changeTuningBank(0, 0, 6, 0)
+        MyMIDI.close()
+
+        self.assertEqual({'Tempo': 1, 'ProgramChange': 1,
+                          'ControllerEvent': 4, 'PitchWheelEvent': 3},
+                         MyMIDI.redundantEventCounts())
+        # The events themselves are kept
+        self.assertEqual(2, len(MyMIDI.tracks[0].MIDIEventList))
+        self.assertEqual(3, len(MyMIDI.tracks[0].eventList))
+        # Both data entry values of the RPN calls are kept
+        data_entries = [evt for evt in MyMIDI.tracks[1].MIDIEventList
+                        if evt.evtname == 'ControllerEvent' and
+                        evt.controller_number in (6, 38)]
+        self.assertEqual(4, len(data_entries))
+
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addProgramChange(0, 0, 0, 10)
+        MyMIDI.addProgramChange(0, 0, 1, 10)
+        MyMIDI.close()
+        self.assertEqual({}, MyMIDI.redundantEventCounts())
+        self.assertEqual(2, len(MyMIDI.tracks[1].MIDIEventList))
+
+    def testRemoveRedundantAcrossTracks(self):
+        def volumes(file_format):
+            MyMIDI = MIDIFile(2, removeRedundant=True, file_format=file_format)
+            MyMIDI.addControllerEvent(0, 0, 0, 7, 100)
+            MyMIDI.addControllerEvent(1, 0, 1, 7, 50)  # The same channel
+            MyMIDI.addControllerEvent(0, 0, 2, 7, 100)
+            MyMIDI.addControllerEvent(0, 0, 3, 7, 100)
+            # Set at the same tick by both tracks, in an unknown order
+            MyMIDI.addControllerEvent(0, 0, 4, 10, 0)
+            MyMIDI.addControllerEvent(1, 0, 4, 10, 127)
+            MyMIDI.addControllerEvent(0, 0, 5, 10, 0)
+            MyMIDI.addControllerEvent(1, 0, 6, 10, 0)
+            MyMIDI.close()
+            return ([(event.tick, event.parameter) for track in MyMIDI.tracks
+                     for event in track.MIDIEventList
+                     if event.evtname == 'ControllerEvent'],
+                    MyMIDI.redundantEventCounts())
+
+        events, counts = volumes(1)
+        self.assertEqual({'ControllerEvent': 2}, counts)
+        # (Delta ticks, as written.) Only ticks 3 and 6 are dropped.
+        self.assertEqual([(0, 100), (1920, 100), (1920, 0), (960, 0),
+                          (960, 50), (2880, 127)], events)
+        # Format 0 merges the tracks the same way
+        self.assertEqual({'ControllerEvent': 2}, volumes(0)[1])
+        # The tracks of a format 2 file are played on their own
+        self.assertEqual({'ControllerEvent': 3}, volumes(2)[1])
+
+    def testTuningDump(self):
+        equal = [440 * pow(2.0, (note - 69) / 12.0) for note in range(128)]
+        equal[0] = None
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addTuningDump(0, 1, equal, tuningProgram=5, tuningName="Equal")
+        MyMIDI.close()
+
+        data = Decoder(MyMIDI.tracks[1].MIDIdata)
+        self.assertEqual(MyMIDI.tracks[1].MIDIEventList[0].evtname, 'UniversalSysEx')
+        self.assertEqual(data[0:2], b'\x87\x40')  # time, 960 ticks
+        self.assertEqual(data.unpack_into_byte(2), 0xf0)
+        self.assertEqual(data[3:5], b'\x83\x17')  # length, 407
+        self.assertEqual(data.unpack_into_byte(5), 0x7E)  # non-real-time
+        self.assertEqual(data.unpack_into_byte(6), 0x7F)
+        self.assertEqual(data.unpack_into_byte(7), 0x08)
+        self.assertEqual(data.unpack_into_byte(8), 0x01)
+        self.assertEqual(data.unpack_into_byte(9), 5)
+        self.assertEqual(data[10:26], b'Equal           ')
+        self.assertEqual(data[26:29], b'\x7f\x7f\x7f')  # note 0 unchanged
+        self.assertEqual(data[29:32], b'\x01\x00\x00')
+        self.assertEqual(data[26 + 69 * 3:29 + 69 * 3], b'\x45\x00\x00')
+        checksum = 0
+        for i in range(5, 410):
+            checksum ^= data.unpack_into_byte(i)
+        self.assertEqual(checksum & 0x7F, data.unpack_into_byte(410))
+        self.assertEqual(data.unpack_into_byte(411), 0xf7)
+
+        # The bank form holds the same tuning after the bank number
+        MyMIDI.addTuningDump(0, 2, equal, tuningProgram=5, tuningName="Equal",
+                             bank=1)
+        first, second = [event for event in MyMIDI.tracks[1].eventList
+                         if event.evtname == 'UniversalSysEx']
+        self.assertEqual(4, second.subcode)
+        self.assertEqual(1, bytearray(second.payload)[0])
+        self.assertEqual(first.payload[:-1], second.payload[1:-1])
+
+        self.assertRaises(ValueError, MyMIDI.addTuningDump, 0, 2, equal[:127])
+        self.assertRaises(ValueError, MyMIDI.addTuningDump, 0, 2, equal + [440])
+
+    def testScaleTuning(self):
+        MyMIDI = MIDIFile(1)
+        offsets = [0, -10, 0, 10, 0, 0, -64, 0, 63, 0, 0, 0]
+        MyMIDI.changeScaleTuning(0, 0, offsets, channels=[0, 9, 15])
+        MyMIDI.close()
+
+        data = Decoder(MyMIDI.tracks[1].MIDIdata)
+        self.assertEqual(data.unpack_into_byte(2), 20)
+        self.assertEqual(data.unpack_into_byte(3), 0x7F)  # real-time
+        self.assertEqual(data.unpack_into_byte(5), 0x08)
+        self.assertEqual(data.unpack_into_byte(6), 0x08)
+        self.assertEqual(data.unpack_into_byte(7), 0x02)  # channel 15
+        self.assertEqual(data.unpack_into_byte(8), 0x04)  # channel 9
+        self.assertEqual(data.unpack_into_byte(9), 0x01)  # channel 0
+        self.assertEqual([data.unpack_into_byte(i) for i in range(10, 22)],
+                         [offset + 64 for offset in offsets])
+
+        self.assertRaises(ValueError, MyMIDI.changeScaleTuning, 0, 0,
+                          offsets[:11])
+        self.assertRaises(ValueError, MyMIDI.changeScaleTuning, 0, 0,
+                          offsets + [0])
+
+    def testScalaTuning(self):
+        scl = io.StringIO(u"""! meantone.scl
+!
+Just major triads
+ 3
+!
+ 5/4
+ 386.31371 cents
+ 2
+""")
+        frequencies = readScalaTuning(scl)
+        self.assertAlmostEqual(261.6256, frequencies[60], places=3)
+        self.assertAlmostEqual(261.6256 * 5 / 4, frequencies[61], places=3)
+        self.assertAlmostEqual(261.6256 * 2, frequencies[63], places=3)
+        self.assertAlmostEqual(261.6256 / 2, frequencies[57], places=3)
+
+        scl.seek(0)
+        kbm = io.StringIO(u"""! Four keys to the period, one of them unmapped
+4
+0
+72
+60
+62
+330.0
+3
+0
+x
+1
+2
+""")
+        frequencies = readScalaTuning(scl, kbm)
+        self.assertAlmostEqual(330.0, frequencies[62], places=3)
+        self.assertAlmostEqual(264.0, frequencies[60], places=3)
+        self.assertEqual(None, frequencies[61])
+        self.assertAlmostEqual(528.0, frequencies[64], places=3)
+        self.assertAlmostEqual(165.0, frequencies[59], places=3)
+        self.assertEqual(None, frequencies[73])
+
+    def testChannelAllocator(self):
+        MyMIDI = MIDIFile(1)
+        allocator = ChannelAllocator(MyMIDI, 0, channels=[0, 1, 2])
+        self.assertEqual(allocator.addNote(60.5, 0, 2, 100), 0)
+        self.assertEqual(allocator.addNote(64, 0, 1, 100), 1)
+        self.assertEqual(allocator.addNote(67.25, 0, 3, 100), 2)
+        self.assertRaises(ValueError, allocator.addNote, 70, 0.5, 1, 100)
+        # Channel 1 was released first, then channel 0
+        self.assertEqual(allocator.addNote(62, 2, 1, 100), 1)
+        self.assertEqual(allocator.addNote(64, 2, 1, 100), 0)
+        self.assertRaises(ValueError, allocator.addNote, 60, 1, 1, 100)
+
+        events = [(event.evtname, event.tick, event.channel,
+                   getattr(event, 'pitch', getattr(event, 'pitch_wheel_value', None)))
+                  for event in MyMIDI.tracks[1].eventList
+                  if event.evtname != 'NoteOff']
+        self.assertEqual(events[:6], [('PitchWheelEvent', 0, 0, -2048),
+                                      ('NoteOn', 0, 0, 61),
+                                      ('PitchWheelEvent', 0, 1, 0),
+                                      ('NoteOn', 0, 1, 64),
+                                      ('PitchWheelEvent', 0, 2, 1024),
+                                      ('NoteOn', 0, 2, 67)])
+        # Channel 1 is already unbent, so no pitch wheel event is needed
+        self.assertEqual(events[6:], [('NoteOn', 1920, 1, 62),
+                                      ('PitchWheelEvent', 1920, 0, 0),
+                                      ('NoteOn', 1920, 0, 64)])
+
+        allocator.addPitchBendRange(0)
+        copied = pickle.loads(pickle.dumps(MyMIDI))
+        MyMIDI.close()
+        data = bytes(MyMIDI.tracks[1].MIDIdata)
+        self.assertEqual(data[0:4], b'\x00\xe0\x00\x30')  # bent down 2048
+        self.assertIn(b'\xb2\x06\x02', data)  # two semitone range
+        # Channel 0 is bent again after the NoteOff of its previous note
+        self.assertEqual(['PitchWheelEvent', 'NoteOn', 'NoteOff',
+                          'PitchWheelEvent', 'NoteOn', 'NoteOff'],
+                         [event.evtname for event in MyMIDI.tracks[1].MIDIEventList
+                          if event.evtname in ('NoteOn', 'NoteOff', 'PitchWheelEvent') and
+                          event.channel == 0])
+        copied.close()
+        self.assertEqual(data, bytes(copied.tracks[1].MIDIdata))
+
+    def testPolyphony(self):
+        def build(**kwargs):
+            MyMIDI = MIDIFile(2, polyphony=2, **kwargs)
+            MyMIDI.addNote(0, 0, 60, 0, 4, 100)
+            MyMIDI.addNote(0, 0, 64, 1, 4, 50)
+            MyMIDI.addNote(1, 1, 67, 2, 4, 80)
+            MyMIDI.close()
+            notes = {}
+            for track in MyMIDI.tracks:
+                tick = 0
+                for event in track.MIDIEventList:
+                    tick += event.tick
+                    if event.evtname == 'NoteOff':
+                        notes[event.pitch] = tick
+            return MyMIDI.stolenNotes, notes
+
+        self.assertEqual(build(stealPolicy='oldest'),
+                         (1, {60: 1920, 64: 4800, 67: 5760}))
+        self.assertEqual(build(stealPolicy='quietest'),
+                         (1, {60: 3840, 64: 1920, 67: 5760}))
+        self.assertEqual(build(stealPolicy='lowest')[1][60], 1920)
+        self.assertEqual(build(polyphonyPerChannel=True)[0], 0)
+
+        # The new note is the quietest, so it never sounds
+        MyMIDI = MIDIFile(1, polyphony=1, stealPolicy='quietest')
+        MyMIDI.addNote(0, 0, 60, 0, 4, 100)
+        MyMIDI.addNote(0, 0, 64, 1, 4, 50)
+        MyMIDI.close()
+        self.assertEqual(MyMIDI.stolenNotes, 1)
+        self.assertEqual([event.evtname for event in MyMIDI.tracks[1].MIDIEventList],
+                         ['NoteOn', 'NoteOff'])
+
+        self.assertRaises(ValueError, MIDIFile, 1, stealPolicy='newest')
+
+    def testConcurrentWriters(self):
+        def render(writer, part):
+            for i in range(1000):
+                writer.addNote(i % 2, part, 40 + (i * 7) % 50, i * 0.25, 1, 100)
+                if i % 10 == 0:
+                    writer.addControllerEvent(i % 2, part, i * 0.25, 7, i % 128)
+
+        def build(threaded):
+            MyMIDI = MIDIFile(2)
+            MyMIDI.addTempo(0, 0, 120)
+            writers = [MyMIDI.concurrentWriter() for part in range(8)]
+            if threaded:
+                threads = [threading.Thread(target=render, args=(writer, part))
+                           for part, writer in enumerate(writers)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            else:
+                for part, writer in enumerate(writers):
+                    render(writer, part)
+            MyMIDI.addNote(0, 9, 36, 0, 1, 100)
+            output = io.BytesIO()
+            MyMIDI.writeFile(output)
+            return MyMIDI, output.getvalue()
+
+        MyMIDI, expected = build(False)
+        self.assertEqual(MyMIDI.event_counter, 2 + 8 * 1100)
+        self.assertEqual(len(MyMIDI.tracks[1].MIDIEventList) +
+                         len(MyMIDI.tracks[2].MIDIEventList), 8 * 2100 + 2)
+        for attempt in range(3):
+            self.assertEqual(build(True)[1], expected)
+
+        self.assertRaises(ValueError, MyMIDI.writers[0].close)
+        self.assertRaises(ValueError, MyMIDI.writers[0].fork)
+        self.assertRaises(ValueError, MyMIDI.writers[0].trackPayload, 0)
+        self.assertRaises(ValueError, MyMIDI.writers[0].concurrentWriter)
+
+        # The events still buffered in writers are merged with their file
+        source = MIDIFile(1)
+        source.addNote(0, 0, 60, 0, 1, 100)
+        source.concurrentWriter().addNote(0, 0, 80, 1, 1, 100)
+        mix = mergeMIDIFiles([source])
+        self.assertEqual([60, 80], [event.pitch for event
+                                    in mix.tracks[1].eventList
+                                    if event.evtname == 'NoteOn'])
+
+    def testTrackPayload(self):
+        def render(midi_file, track, part):
+            midi_file.addTrackName(track, 0, "Part %d" % part)
+            midi_file.addProgramChange(track, part, 0, 40 + part)
+            for i in range(50):
+                midi_file.addNote(track, part, 60 + i % 12, i * 0.5, 1, 100,
+                                  annotation=[part, i] if i % 10 == 0 else None)
+            midi_file.addPitchWheelEvent(track, part, 10, -8192)
+            midi_file.addSysEx(track, 20, 0x43, b"\x01\x02")
+
+        expected = MIDIFile(3)
+        for part in range(3):
+            render(expected, part, part)
+        output = io.BytesIO()
+        expected.writeFile(output)
+
+        MyMIDI = MIDIFile(3)
+        for part in range(3):
+            worker = MIDIFile(1)
+            render(worker, 0, part)
+            payload = worker.trackPayload(0)
+            division, events = unpackEvents(payload)
+            self.assertEqual(division, 960)
+            self.assertEqual([(evt.__class__, evt.__dict__) for evt in events],
+                             [(evt.__class__, evt.__dict__)
+                              for evt in worker.tracks[1].eventList])
+            MyMIDI.addTrackPayload(part, payload)
+        self.assertEqual(MyMIDI.event_counter, expected.event_counter)
+        result = io.BytesIO()
+        MyMIDI.writeFile(result)
+        self.assertEqual(result.getvalue(), output.getvalue())
+
+        self.assertRaises(ValueError, MIDIFile(1, ticks_per_quarternote=480).addTrackPayload,
+                          0, payload)
+        self.assertRaises(ValueError, unpackEvents, b"MThd")
+
+        # The side table is JSON, so annotations must be JSON values
+        worker = MIDIFile(1)
+        worker.addNote(0, 0, 60, 0, 1, 100, annotation=object())
+        self.assertRaises(ValueError, worker.trackPayload, 0)
+        # Patterns are expanded
+        bar = MIDIPattern()
+        bar.addNote(9, 36, 0, 1, 100)
+        worker = MIDIFile(1)
+        worker.addPattern(0, 4, bar)
+        events = unpackEvents(worker.trackPayload(0))[1]
+        self.assertEqual(['NoteOn', 'NoteOff'], [evt.evtname for evt in events])
+        self.assertEqual(3840, events[0].tick)
+
+    def testPickle(self):
+        MyMIDI = MIDIFile(2, eventtime_is_ticks=True)
+        MyMIDI.addTempo(0, 0, 120)
+        MyMIDI.addTimeSignature(0, 0, 3, 2, 24)
+        MyMIDI.addKeySignature(0, 0, 2, SHARPS, MAJOR)
+        MyMIDI.addNote(0, 0, 60, 0, 960, 100, annotation={'id': 7})
+        MyMIDI.addNote(0, 0, 64, 0, 960, 100)
+        MyMIDI.addText(1, 0, "Text")
+        MyMIDI.addSysEx(1, 10, 0x43, b"\x01")
+        bar = MIDIPattern(eventtime_is_ticks=True)
+        bar.addNote(9, 36, 0, 100, 100)
+        MyMIDI.addPattern(1, 0, bar)
+        MyMIDI.addPattern(1, 1920, bar)
+        writer = MyMIDI.concurrentWriter()
+        writer.addNote(1, 2, 67, 480, 480, 90)
+
+        copied = pickle.loads(pickle.dumps(MyMIDI, pickle.HIGHEST_PROTOCOL))
+        for track, other in zip(MyMIDI.tracks, copied.tracks):
+            self.assertEqual([(evt.__class__, evt.__dict__) for evt in track.eventList
+                              if evt.evtname != 'Pattern'],
+                             [(evt.__class__, evt.__dict__) for evt in other.eventList
+                              if evt.evtname != 'Pattern'])
+        copied.addNote(0, 1, 72, 1920, 960, 100)  # time is still in ticks
+        self.assertEqual(copied.tracks[1].eventList[-2].tick, 1920)
+        copied.tracks[1].eventList.pop()
+        copied.tracks[1].eventList.pop()
+
+        output = io.BytesIO()
+        MyMIDI.writeFile(output)
+        result = io.BytesIO()
+        copied.writeFile(result)
+        self.assertEqual(result.getvalue(), output.getvalue())
+
+        # A closed file keeps its data
+        copied = pickle.loads(pickle.dumps(MyMIDI))
+        self.assertTrue(copied.closed)
+        result = io.BytesIO()
+        copied.writeFile(result)
+        self.assertEqual(result.getvalue(), output.getvalue())
+
+    def testRenderCache(self):
+        def build(pitch=60):
+            MyMIDI = MIDIFile(2)
+            MyMIDI.addTempo(0, 0, 120)
+            for i in range(20):
+                MyMIDI.addNote(0, 0, pitch + i % 5, i, 1, 100)
+                MyMIDI.addNote(1, 1, 48 + i % 7, i, 2, 100)
+            return MyMIDI
+
+        # The fingerprint depends on content only, and is incremental
+        self.assertEqual(build().fingerprint(), build().fingerprint())
+        self.assertNotEqual(build().fingerprint(), build(61).fingerprint())
+        MyMIDI = build()
+        before = MyMIDI.tracks[2].fingerprint()
+        MyMIDI.fingerprint()
+        MyMIDI.addText(1, 0, "Text")
+        self.assertNotEqual(MyMIDI.tracks[2].fingerprint(), before)
+        self.assertEqual(MyMIDI.tracks[1].fingerprint(), build().tracks[1].fingerprint())
+        complete = build()
+        complete.addText(1, 0, "Text")
+        self.assertEqual(MyMIDI.fingerprint(), complete.fingerprint())
+        annotated = build()
+        annotated.tracks[1].eventList[0].annotation = "not written"
+        self.assertEqual(annotated.fingerprint(), build().fingerprint())
+
+        directory = tempfile.mkdtemp()
+        try:
+            cache = RenderCache(directory)
+            output = io.BytesIO()
+            build().writeFile(output, cache=cache)
+            self.assertEqual((cache.hits, cache.misses), (0, 4))
+            self.assertEqual(len(os.listdir(directory)), 4)  # the file and its tracks
+
+            result = io.BytesIO()
+            build().writeFile(result, cache=cache)
+            self.assertEqual(result.getvalue(), output.getvalue())
+            self.assertEqual(cache.hits, 1)
+
+            # Only the changed track is processed
+            changed = build()
+            changed.addNote(0, 0, 72, 30, 1, 100)
+            changed.writeFile(io.BytesIO(), cache=cache)
+            self.assertEqual((cache.hits, cache.misses), (3, 6))
+
+            # A format 0 file written again is not looked up under a new key
+            merged = MIDIFile(2, file_format=0)
+            merged.addNote(0, 0, 60, 0, 1, 100)
+            merged.addNote(0, 0, 60, 0, 1, 100)  # removed as a duplicate
+            first = io.BytesIO()
+            merged.writeFile(first, cache=cache)
+            entries = len(os.listdir(directory))
+            second = io.BytesIO()
+            merged.writeFile(second, cache=cache)
+            self.assertEqual(entries, len(os.listdir(directory)))
+            self.assertEqual(first.getvalue(), second.getvalue())
+            hits = cache.hits
+            merged = MIDIFile(2, file_format=0)
+            merged.addNote(0, 0, 60, 0, 1, 100)
+            merged.addNote(0, 0, 60, 0, 1, 100)
+            merged.writeFile(io.BytesIO(), cache=cache)
+            self.assertEqual(hits + 1, cache.hits)
+
+            # Threads of one process can store the same entry at once
+            threads = [threading.Thread(target=cache.put,
+                                        args=('shared', b'x' * 100000))
+                       for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(b'x' * 100000, cache.get('shared'))
+            self.assertFalse([name for name in os.listdir(directory)
+                              if name.endswith('.tmp')])
+
+            # The least recently used entries are evicted
+            cache.maxBytes = 1
+            cache.evict()
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+    def testValidation(self):
+        # Without validation nothing is checked when the values are added
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addNote(0, 0, 200, 0, 1, 100)
+
+        MyMIDI = MIDIFile(1, validate=True)
+        MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+        with self.assertRaises(InvalidValuesError) as context:
+            MyMIDI.addNote(0, 16, 128, 0, 1, 100)
+        self.assertEqual(context.exception.errors, {'channel': [0], 'pitch': [0]})
+        self.assertRaises(ValueError, MyMIDI.addControllerEvent, 0, 0, 0, 7, 128)
+        self.assertRaises(ValueError, MyMIDI.addPitchWheelEvent, 0, 0, 0, 8192)
+        self.assertRaises(ValueError, MyMIDI.addProgramChange, 0, 0, 0, -1)
+        self.assertRaises(ValueError, MyMIDI.addChannelPressure, 0, 0, 0, 128)
+        self.assertRaises(ValueError, MyMIDI.addTempo, 0, 0, 0)
+        MyMIDI.addTempo(0, 0, 120.5)
+
+        # A bulk insert reports every bad index, and adds nothing
+        pitches = [60, 128, 62, -1, 64]
+        with self.assertRaises(InvalidValuesError) as context:
+            MyMIDI.addNotes(0, 0, pitches, [0, 1, 2, 3, 4], [1] * 5,
+                            [100, 100, 100.5, 100, 100])
+        self.assertEqual(context.exception.errors,
+                         {'pitch': [1, 3], 'volume': [2]})
+        self.assertEqual(len(MyMIDI.tracks[1].eventList), 2)
+
+        # Trusted data is not checked
+        MyMIDI.addNotes(0, 0, pitches, [0, 1, 2, 3, 4], [1] * 5, [100] * 5,
+                        trusted=True)
+        self.assertEqual(len(MyMIDI.tracks[1].eventList), 12)
+
+        # A bulk insert is the same as adding the notes one by one
+        channels = [0, 1, 0, 1]
+        pitches = [60, 64, 67, 72]
+        times = [0, 0.5, 1, 1]
+        bulk = MIDIFile(1, validate=True)
+        bulk.addNotes(0, channels, pitches, times, [1] * 4, [90] * 4)
+        single = MIDIFile(1)
+        for channel, pitch, time in zip(channels, pitches, times):
+            single.addNote(0, channel, pitch, time, 1, 90)
+        bulkFile = io.BytesIO()
+        bulk.writeFile(bulkFile)
+        singleFile = io.BytesIO()
+        single.writeFile(singleFile)
+        self.assertEqual(bulkFile.getvalue(), singleFile.getvalue())
+
+        # Integers of other types (numpy's, say) are only reported if bad
+        class Integer(object):
+            def __init__(self, value):
+                self.value = value
+
+            def __index__(self):
+                return self.value
+
+        with self.assertRaises(InvalidValuesError) as context:
+            MyMIDI.addNotes(0, Integer(1), [Integer(60), 128], [0, 1], [1, 1],
+                            [Integer(100), 100])
+        self.assertEqual(context.exception.errors, {'pitch': [1]})
+
+        # Curves and patterns are checked too
+        self.assertRaises(InvalidValuesError, MyMIDI.addControllerRamp,
+                          0, 16, 0, 1, 7, 0, 127, 0.25)
+        self.assertRaises(InvalidValuesError, MyMIDI.addControllerCurve,
+                          0, 0, 0, 128, [0, 1], 0.25)
+        self.assertRaises(InvalidValuesError, MyMIDI.addPitchWheelCurve,
+                          0, 0, -1, [0, 100], 0.25)
+        bar = MIDIPattern()
+        bar.addNote(0, 130, 0, 1, 100)
+        bar.addControllerEvent(0, 1, 7, 200)
+        with self.assertRaises(InvalidValuesError) as context:
+            MyMIDI.addPattern(0, 0, bar)
+        self.assertEqual(sorted(context.exception.errors), ['parameter', 'pitch'])
+        self.assertEqual(len(MyMIDI.tracks[1].eventList), 12)
+
+    def testNoteIndex(self):
+        MyMIDI = MIDIFile(1, eventtime_is_ticks=True)
+        notes = [(i * 7 % 1000, i * 13 % 50) for i in range(2000)]
+        for i, (start, duration) in enumerate(notes):
+            MyMIDI.addNote(0, 0, i % 128, start, duration, 100)
+        track = MyMIDI.tracks[1]
+
+        def expected(start, end):
+            return sorted((tick, duration) for tick, duration in notes
+                          if tick < end and tick + duration > start)
+
+        def found(events):
+            return sorted((event.tick, event.duration) for event in events)
+
+        for tick in (0, 1, 500, 999, 1048, 2000):
+            self.assertEqual(found(MyMIDI.notesAt(0, tick)),
+                             expected(tick, tick + 1))
+        self.assertEqual(found(MyMIDI.notesOverlapping(0, 100, 300)),
+                         expected(100, 300))
+        # The notes are returned in order of their start
+        starts = [event.tick for event in MyMIDI.notesOverlapping(0, 0, 2000)]
+        self.assertEqual(starts, sorted(starts))
+
+        # Notes added after a query are found by the next one
+        MyMIDI.addNote(0, 1, 60, 5000, 10, 100)
+        notes.append((5000, 10))
+        self.assertEqual(found(MyMIDI.notesAt(0, 5005)), [(5000, 10)])
+        self.assertTrue(track.noteIndexState is not None)
+
+        # Removing the notes in a region removes their note offs too
+        removed = MyMIDI.removeNotes(0, 200, 400)
+        self.assertEqual(len(removed),
+                         len([1 for tick, duration in notes if 200 <= tick < 400]))
+        notes = [(tick, duration) for tick, duration in notes
+                 if not 200 <= tick < 400]
+        self.assertEqual(len(track.eventList), 2 * len(notes))
+        self.assertEqual(found(MyMIDI.notesOverlapping(0, 0, 6000)),
+                         expected(0, 6000))
+
+        # The index is rebuilt when the event list is replaced by a fork
+        fork = MyMIDI.fork()
+        fork.addNote(0, 0, 60, 250, 10, 100)
+        self.assertEqual(len(fork.notesAt(0, 255)), len(expected(255, 256)) + 1)
+        self.assertEqual(found(MyMIDI.notesAt(0, 255)), expected(255, 256))
+
+    def testSlice(self):
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addTempo(0, 0, 100)
+        MyMIDI.addTempo(0, 2, 120)
+        MyMIDI.addProgramChange(0, 0, 0, 5)
+        MyMIDI.addProgramChange(0, 0, 1, 10)
+        MyMIDI.addControllerEvent(0, 0, 1, 7, 90)
+        MyMIDI.addNote(0, 0, 60, 3, 2, 100)  # crosses the start
+        MyMIDI.addNote(0, 0, 62, 4, 1, 100)  # inside
+        MyMIDI.addNote(0, 0, 64, 7, 2, 100)  # crosses the end
+        MyMIDI.addNote(0, 0, 65, 9, 1, 100)  # after
+
+        def notes(midi_file):
+            return sorted((event.pitch, event.tick, event.duration)
+                          for event in midi_file.tracks[1].eventList
+                          if event.evtname == 'NoteOn')
+
+        sliced = MyMIDI.slice(4, 8)
+        self.assertEqual(notes(sliced), [(60, 0, 960), (62, 0, 960),
+                                         (64, 2880, 960)])
+        self.assertEqual(notes(MyMIDI.slice(4, 8, 'keep')),
+                         [(62, 0, 960), (64, 2880, 1920)])
+        self.assertEqual(notes(MyMIDI.slice(4, 8, 'drop')), [(62, 0, 960)])
+        self.assertRaises(ValueError, MyMIDI.slice, 4, 8, 'clip')
+
+        # The state at the start is carried in, at the start of the slice
+        tempos = [(event.tick, event.tempo)
+                  for event in sliced.tracks[0].eventList]
+        self.assertEqual(tempos, [(0, 500000)])
+        carried = sorted((event.evtname, event.tick)
+                         for event in sliced.tracks[1].eventList
+                         if event.evtname != 'NoteOn' and
+                         event.evtname != 'NoteOff')
+        self.assertEqual(carried, [('ControllerEvent', 0),
+                                   ('ProgramChange', 0)])
+        self.assertEqual([event.programNumber
+                          for event in sliced.tracks[1].eventList
+                          if event.evtname == 'ProgramChange'], [10])
+
+        # A slice of a closed file, and the slice itself, can be written
+        MyMIDI.writeFile(io.BytesIO())
+        sliced = MyMIDI.slice(4, 8)
+        self.assertEqual(len(notes(sliced)), 3)
+        output = io.BytesIO()
+        sliced.writeFile(output)
+        data = output.getvalue()
+        self.assertEqual(data[0:4], b'MThd')
+
+        # Slicing the whole file leaves it unchanged
+        whole = MyMIDI.slice(0, 100)
+        self.assertEqual(notes(whole), notes(MyMIDI))
+
+    def testTransforms(self):
+        def build(notes):
+            MyMIDI = MIDIFile(1)
+            MyMIDI.addTempo(0, 2, 100)
+            MyMIDI.addControllerEvent(0, 1, 1, 7, 90)
+            for channel, pitch, time, duration, volume in notes:
+                MyMIDI.addNote(0, channel, pitch, time, duration, volume)
+            return MyMIDI
+
+        def written(midi_file):
+            output = io.BytesIO()
+            midi_file.writeFile(output)
+            return output.getvalue()
+
+        notes = [(0, 60, 0.1, 1, 100), (1, 64, 0.9, 0.5, 90),
+                 (0, 124, 2.2, 1, 120), (2, 40, 3, 1, 60)]
+        MyMIDI = build(notes)
+        plain = written(MyMIDI)
+        self.assertTrue(MyMIDI.transpose(5, channels=[0]).scaleVelocity(1.25)
+                        is MyMIDI)
+        MyMIDI.filterChannels([0, 1]).quantize(0.5).stretch(2)
+        # The transforms are applied when the file is written
+        self.assertEqual(MyMIDI.tracks[1].eventList[0].pitch, 60)
+
+        expected = MIDIFile(1)
+        expected.addTempo(0, 4, 100)
+        expected.addControllerEvent(0, 1, 2, 7, 90)
+        expected.addNote(0, 0, 65, 0, 2, 125)
+        expected.addNote(0, 1, 64, 2, 1, 112)
+        self.assertEqual(written(MyMIDI), written(expected))
+
+        # The transforms are part of the fingerprint, and can be cleared
+        self.assertNotEqual(MyMIDI.fingerprint(), build(notes).fingerprint())
+        MyMIDI.clearTransforms()
+        self.assertEqual(written(MyMIDI), plain)
+        self.assertRaises(ValueError, MyMIDI.quantize, 0)
+        self.assertRaises(ValueError, MyMIDI.stretch, -1)
+
+        # A note keeps its note off, even one at the same tick
+        MyMIDI = MIDIFile(1, eventtime_is_ticks=True, deinterleave=False,
+                          adjust_origin=False)
+        MyMIDI.addNote(0, 0, 60, 10, 0, 100)
+        MyMIDI.addNote(0, 0, 62, 10, 30, 100)
+        MyMIDI.quantize(8)
+        MyMIDI.tracks[1].closeTrack()
+        events = [(event.evtname, event.tick) for event in
+                  MyMIDI.tracks[1].MIDIEventList]
+        self.assertEqual(sorted(events), [('NoteOff', 8), ('NoteOff', 38),
+                                          ('NoteOn', 8), ('NoteOn', 8)])
+
+        # The transforms of merged files are applied, and a merged file can
+        # be transformed
+        notes = [(0, 60, 0.1, 1, 100), (1, 64, 0.9, 0.5, 90)]
+        source = build(notes).transpose(12)
+        mix = mergeMIDIFiles([source], ticks_per_quarternote=1920)
+        mix.quantize(0.5).stretch(2)
+        expected = MIDIFile(1, ticks_per_quarternote=1920)
+        expected.addTempo(0, 4, 100)
+        expected.addControllerEvent(0, 1, 2, 7, 90)
+        expected.addNote(0, 0, 72, 0, 2, 100)
+        expected.addNote(0, 1, 76, 2, 1, 90)
+        self.assertEqual(written(mix), written(expected))
+        self.assertEqual(source.tracks[1].eventList[-2].pitch, 64)
+
+    def testQuantizeHumanize(self):
+        def build():
+            MyMIDI = MIDIFile(1, eventtime_is_ticks=True)
+            MyMIDI.addControllerEvent(0, 0, 5, 7, 90)
+            for tick in (5, 230, 500, 700, 1001):
+                MyMIDI.addNote(0, 0, 60, tick, 100, 100)
+            return MyMIDI
+
+        def notes(midi_file):
+            return sorted((event.tick, event.duration, event.volume)
+                          for event in midi_file.tracks[1].eventList
+                          if event.evtname == 'NoteOn')
+
+        def offs(midi_file):
+            return sorted(event.tick for event in midi_file.tracks[1].eventList
+                          if event.evtname == 'NoteOff')
+
+        MyMIDI = build()
+        MyMIDI.quantizeNotes(0, 240)
+        self.assertEqual(notes(MyMIDI), [(0, 100, 100), (240, 100, 100),
+                                         (480, 100, 100), (720, 100, 100),
+                                         (960, 100, 100)])
+        self.assertEqual(offs(MyMIDI), [100, 340, 580, 820, 1060])
+        self.assertEqual(len(MyMIDI.tracks[1].eventList), 11)
+
+        # With swing every second line of the grid is delayed
+        MyMIDI = build()
+        MyMIDI.quantizeNotes(0, 240, swing=0.5)
+        self.assertEqual([note[0] for note in notes(MyMIDI)],
+                         [0, 360, 480, 840, 960])
+        MyMIDI = build()
+        MyMIDI.quantizeNotes(0, 240, strength=0.5)
+        self.assertEqual([note[0] for note in notes(MyMIDI)],
+                         [2, 235, 490, 710, 980])
+        self.assertRaises(ValueError, MyMIDI.quantizeNotes, 0, 240, 1)
+
+        # A fork is not changed
+        fork = MyMIDI.fork()
+        fork.quantizeNotes(0, 480)
+        self.assertEqual([note[0] for note in notes(MyMIDI)],
+                         [2, 235, 490, 710, 980])
+
+        # Humanizing is the same for the same seed
+        first = build()
+        first.humanizeNotes(0, timing=10, velocity=8, seed=7)
+        second = build()
+        second.humanizeNotes(0, timing=10, velocity=8, seed=7)
+        self.assertEqual(notes(first), notes(second))
+        self.assertNotEqual(notes(first), notes(build()))
+        third = build()
+        third.humanizeNotes(0, timing=10, velocity=8, seed=8)
+        self.assertNotEqual(notes(first), notes(third))
+        for tick, duration, volume in notes(first):
+            self.assertEqual(duration, 100)
+            self.assertTrue(1 <= volume <= 127)
+        self.assertEqual(offs(first), [note[0] + 100 for note in notes(first)])
+
+    def testResample(self):
+        def written(midi_file):
+            output = io.BytesIO()
+            midi_file.writeFile(output)
+            return output.getvalue()
+
+        MyMIDI = MIDIFile(1, ticks_per_quarternote=480)
+        MyMIDI.addTempo(0, 0, 120)
+        MyMIDI.addControllerEvent(0, 0, 0, 7, 100)
+        MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+        MyMIDI.addNote(0, 0, 62, 1, 0.5, 100)
+        MyMIDI.addNote(0, 0, 64, 1.5, 0.005, 100)
+        original = written(MyMIDI)
+
+        # Up and back down again is lossless
+        doubled = MyMIDI.resample(960)
+        self.assertEqual(doubled.collisions, [])
+        self.assertEqual(doubled.ticks_per_quarternote, 960)
+        self.assertEqual(struct.unpack('>H', written(doubled)[12:14])[0], 960)
+        self.assertEqual(written(doubled.resample(480)), original)
+        self.assertEqual(written(MyMIDI), original)
+
+        # The note of 0.005 beats collapses at 96 ticks per quarter note
+        reduced = MyMIDI.resample(96)
+        self.assertEqual([(track, tick, [event.evtname for event in events])
+                          for track, tick, events in reduced.collisions],
+                         [(1, 144, ['NoteOff', 'NoteOff', 'NoteOn'])])
+        notes = sorted((event.pitch, event.tick, event.duration)
+                       for event in reduced.tracks[1].eventList
+                       if event.evtname == 'NoteOn')
+        self.assertEqual(notes, [(60, 0, 96), (62, 96, 48), (64, 144, 0)])
+        self.assertEqual([(event.pitch, event.duration) for event in
+                          MyMIDI.resample(96, 'ceil').tracks[1].eventList
+                          if event.evtname == 'NoteOn'][2], (64, 1))
+        self.assertEqual([(event.pitch, event.duration) for event in
+                          MyMIDI.resample(96, 'floor').tracks[1].eventList
+                          if event.evtname == 'NoteOn'][2], (64, 0))
+        self.assertRaises(ValueError, MyMIDI.resample, 96, 'up')
+
+    def testColumns(self):
+        MyMIDI = MIDIFile(2, adjust_origin=True)
+        MyMIDI.addTempo(0, 0, 100)
+        MyMIDI.addTimeSignature(0, 0, 3, 2, 24)
+        MyMIDI.addKeySignature(0, 0, 2, SHARPS, MAJOR)
+        MyMIDI.addTrackName(0, 0, "Piano")
+        MyMIDI.addSysEx(1, 2, 0x41, b'\x01\xf0')
+        MyMIDI.addControllerEvent(1, 1, 0, 7, 90)
+        MyMIDI.addPitchWheelEvent(1, 1, 0, -8000)
+        for i in range(10):
+            MyMIDI.addNote(0, i % 3, 60 + i, 1 + i * 0.5, 0.5, 100,
+                           annotation={'id': i} if i % 2 else None)
+        pattern = MIDIPattern()
+        pattern.addNote(0, 72, 0, 1, 90)
+        MyMIDI.addPattern(1, 4, pattern)
+        MyMIDI.transpose(2, channels=[0])
+
+        output = io.BytesIO()
+        MyMIDI.writeColumns(output)
+        data = output.getvalue()
+        self.assertEqual(data[0:4], b'MUcf')
+
+        # The columns can be found from the metadata alone
+        length = struct.unpack_from('<I', data, 8)[0]
+        metadata = json.loads(data[12:12 + length].decode('utf-8'))
+        base = 12 + length + (-(12 + length) % 8)
+        layout = metadata['tracks'][1]
+        start = base + layout['columns']['data1']
+        self.assertEqual(start % 8, 0)
+        pitches = struct.unpack_from('<%di' % layout['count'], data, start)
+        start = base + layout['columns']['type']
+        types = bytearray(data[start:start + layout['count']])
+        self.assertEqual(sorted(pitch for pitch, kind in zip(pitches, types)
+                                if metadata['types'][kind] == 'NoteOn'),
+                         list(range(60, 70)))
+
+        # The file read back writes the same MIDI data
+        copied = readColumns(data)
+        written = io.BytesIO()
+        MyMIDI.writeFile(written)
+        rewritten = io.BytesIO()
+        copied.writeFile(rewritten)
+        self.assertEqual(rewritten.getvalue(), written.getvalue())
+        self.assertEqual(copied.event_counter, MyMIDI.event_counter)
+        self.assertEqual([event.annotation for event in copied.tracks[1].eventList
+                          if event.evtname == 'NoteOn'][:2], [None, {'id': 1}])
+
+        # A file on disk is mapped
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'song.mcf')
+            with open(path, 'wb') as output_file:
+                output_file.write(data)
+            with open(path, 'rb') as input_file:
+                mapped = readColumns(input_file)
+            self.assertEqual(len(mapped.tracks[2].eventList),
+                             len(copied.tracks[2].eventList))
+        finally:
+            shutil.rmtree(directory)
+        self.assertRaises(ValueError, readColumns, b'MThd')
+
+        # Nothing is written if a channel or an annotation can't be
+        unvalidated = MIDIFile(1)
+        unvalidated.addNote(0, 16, 60, 0, 1, 100)
+        output = io.BytesIO()
+        with self.assertRaises(InvalidValuesError) as context:
+            unvalidated.writeColumns(output)
+        self.assertEqual({'channel': [0, 1]}, context.exception.errors)
+        unvalidated = MIDIFile(1)
+        unvalidated.addNote(0, 0, 60, 0, 1, 100, annotation=object())
+        self.assertRaises(ValueError, unvalidated.writeColumns, output)
+        self.assertEqual(b'', output.getvalue())
+
+    def testPianoRoll(self):
+        MyMIDI = MIDIFile(2)
+        MyMIDI.addTempo(0, 0, 120)
+        MyMIDI.addTempo(0, 4, 60)
+        MyMIDI.addNote(0, 0, 60, 0, 1, 100)
+        MyMIDI.addNote(0, 0, 60, 0.5, 1, 80)
+        MyMIDI.addNote(1, 0, 64, 4, 1, 90)
+        MyMIDI.addNote(1, 0, 67, 4.1, 0.01, 70)
+
+        self.assertEqual(MyMIDI.tempoMap().seconds([0, 960, 3840, 4800]),
+                         [0.0, 0.5, 2.0, 3.0])
+
+        roll = MyMIDI.pianoRoll(0.25)
+        self.assertEqual(len(roll), 128)
+        self.assertEqual(len(roll[0]), 20)
+        self.assertEqual(list(roll[60][0:7]), [100, 100, 80, 80, 80, 80, 0])
+        self.assertEqual(list(roll[64][15:20]), [0, 90, 90, 90, 90])
+        # A short note takes at least one step
+        self.assertEqual(list(roll[67][16:18]), [70, 0])
+        self.assertEqual(sum(sum(row) for row in roll),
+                         2 * 100 + 4 * 80 + 4 * 90 + 70)
+
+        # One track, binary, in seconds (by the tempo map) and sparse
+        self.assertEqual(MyMIDI.pianoRoll(0.25, track=1, seconds=True,
+                                          binary=True, sparse=True),
+                         [(64, 8, 12, 1), (67, 8, 9, 1)])
+        binary = MyMIDI.pianoRoll(0.25, track=0, binary=True)
+        self.assertEqual(list(binary[60]), [1, 1, 1, 1, 1, 1])
+
+        # The notes are taken as they will be written
+        MyMIDI.transpose(12)
+        self.assertEqual([note[0] for note in
+                          MyMIDI.pianoRoll(1, track=1, sparse=True)], [76, 79])
+        self.assertRaises(ValueError, MyMIDI.pianoRoll, 0)
+
+        # Notes whose voices are stolen are cut short or left out
+        MyMIDI = MIDIFile(2, polyphony=1)
+        MyMIDI.addNote(0, 0, 60, 0, 2, 100)
+        MyMIDI.addNote(0, 0, 64, 1, 1, 80)
+        MyMIDI.addNote(1, 0, 67, 1, 1, 90)  # takes the voice of 64 at once
+        self.assertEqual(MyMIDI.pianoRoll(1, sparse=True),
+                         [(60, 0, 1, 100), (67, 1, 2, 90)])
+        self.assertEqual(MyMIDI.pianoRoll(1, track=0, sparse=True),
+                         [(60, 0, 1, 100)])
+        self.assertEqual(len(MyMIDI.tracks[1].eventList), 4)  # unchanged
+
+        # Values that don't fit the matrix are reported
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addNote(0, 0, 130, 0, 1, 300)
+        with self.assertRaises(InvalidValuesError) as context:
+            MyMIDI.pianoRoll(1)
+        self.assertEqual(context.exception.errors, {'pitch': [0], 'volume': [0]})
+        self.assertEqual(MyMIDI.pianoRoll(1, sparse=True), [(130, 0, 1, 300)])
+
+    def testAddPianoRoll(self):
+        roll = [[] for pitch in range(128)]
+        roll[60] = [100, 100, 80, 80, 0, 0, 90]
+        roll[64] = bytearray([0, 50, 50, 50, 0, 0, 0])
+        roll[67] = bytes(bytearray([1, 0, 1, 1, 0, 1, 0]))
+
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addPianoRoll(0, 2, 1, roll, 0.5)
+        notes = [(event.pitch, event.tick, event.duration, event.volume,
+                  event.channel) for event in MyMIDI.tracks[1].eventList
+                 if event.evtname == 'NoteOn']
+        # In order of onset and pitch; a change of velocity starts a note
+        self.assertEqual(notes, [(60, 960, 960, 100, 2), (67, 960, 480, 1, 2),
+                                 (64, 1440, 1440, 50, 2),
+                                 (60, 1920, 960, 80, 2), (67, 1920, 960, 1, 2),
+                                 (67, 3360, 480, 1, 2), (60, 3840, 480, 90, 2)])
+        orders = [event.insertion_order for event in MyMIDI.tracks[1].eventList
+                  if event.evtname == 'NoteOn']
+        self.assertEqual(orders, list(range(7)))
+        self.assertEqual(MyMIDI.event_counter, 7)
+
+        # With a fixed velocity a note is a run of non-zero values
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addPianoRoll(0, 0, 0, roll, 0.5, velocity=64)
+        self.assertEqual(sorted((event.pitch, event.tick, event.duration)
+                                for event in MyMIDI.tracks[1].eventList
+                                if event.evtname == 'NoteOn' and
+                                event.pitch == 60),
+                         [(60, 0, 1920), (60, 2880, 480)])
+
+        # It is the reverse of pianoRoll
+        self.assertEqual(MyMIDI.pianoRoll(0.5, binary=True)[67],
+                         array.array('B', roll[67]))
+        self.assertRaises(ValueError, MyMIDI.addPianoRoll, 0, 0, 0, roll, 0.0001)
+
+        # Rolls the file can't hold are rejected even without validation
+        MyMIDI = MIDIFile(1, validate=False)
+        self.assertRaises(ValueError, MyMIDI.addPianoRoll, 0, 0, 0,
+                          roll + [[1]], 0.5)
+        loud = list(roll)
+        loud[62] = [0, 200, 200]
+        with self.assertRaises(InvalidValuesError) as context:
+            MyMIDI.addPianoRoll(0, 0, 0, loud, 0.5)
+        self.assertEqual(list(context.exception.errors), ['volume'])
+        self.assertRaises(InvalidValuesError, MyMIDI.addPianoRoll, 0, 0, 0,
+                          roll, 0.5, velocity=128)
+        self.assertEqual([], MyMIDI.tracks[1].eventList)
+
+    def testRenderWAV(self):
+        MyMIDI = MIDIFile(1)
+        MyMIDI.addTempo(0, 0, 120)
+        MyMIDI.addNote(0, 0, 69, 0, 2, 127)  # one second of A 440
+        MyMIDI.addNote(0, 0, 81, 3, 1, 127)  # half a second of A 880
+
+        def render(**options):
+            output = io.BytesIO()
+            MyMIDI.renderWAV(output, sampleRate=8000, **options)
+            audio = wave.open(io.BytesIO(output.getvalue()))
+            self.assertEqual((audio.getnchannels(), audio.getsampwidth(),
+                              audio.getframerate()), (1, 2, 8000))
+            samples = array.array('h', audio.readframes(audio.getnframes()))
+            if sys.byteorder == 'big':
+                samples.byteswap()
+            return samples
+
+        def crossings(samples):
+            return len([1 for a, b in zip(samples, samples[1:])
+                        if a < 0 <= b])
+
+        samples = render(blockSize=1000)
+        self.assertEqual(len(samples), 16000)
+        self.assertAlmostEqual(crossings(samples[0:8000]), 440, delta=1)
+        self.assertEqual(max(samples[8000:12000]), 0)
+        self.assertAlmostEqual(crossings(samples[12000:16000]), 440, delta=1)
+        self.assertEqual(max(samples), int(round(0.1 * 32767)))
+        # The attack and the release
+        self.assertEqual(samples[0], 0)
+        full = int(round(0.1 * 32767))
+        for i in range(40):
+            self.assertTrue(abs(samples[i]) <= full * i // 40 + 1)
+            self.assertTrue(abs(samples[7999 - i]) <= full * (i + 1) // 40 + 1)
+
+        # The blocks don't change the result
+        self.assertEqual(render(blockSize=333), samples)
+        for waveform in ('saw', [0, 1, 0, -1]):
+            self.assertAlmostEqual(
+                crossings(render(waveform=waveform)[0:8000]), 440, delta=1)
+
+        # Loud enough to clip
+        loud = render(gain=0.9)
+        MyMIDI.addNote(0, 0, 69, 0, 2, 127)
+        MyMIDI.addNote(0, 0, 69, 0, 2, 126)
+        self.assertEqual(max(render(gain=0.9)), 32767)
+        self.assertTrue(max(loud) < 32767)
+        self.assertEqual(render(waveform=u'saw'), render(waveform='saw'))
+        for waveform in ('square', u'square', []):
+            output = io.BytesIO()
+            self.assertRaises(ValueError, MyMIDI.renderWAV, output,
+                              waveform=waveform)
+            self.assertEqual(output.getvalue(), b'')
+        self.assertRaises(ValueError, render, blockSize=0)
+
 
 def suite():
     MIDISuite = unittest.TestLoader().loadTestsFromTestCase(TestMIDIUtils)